@@ -0,0 +1,172 @@
+"""
+Кэш балансов AI монет в памяти процесса (TTL + LRU).
+
+Кэш заполняется при чтении (get_balance) и обновляется функциями
+coin_service после фиксации транзакции (write-through).
+
+Чтение из БД могло начаться до фиксации параллельного изменения баланса и
+закончиться после нее. Чтобы такое устаревшее значение не попало в кэш,
+каждое изменение ключа получает номер из счетчика изменений, а прочитанный
+баланс кладется в кэш (fill) только если ключ не менялся с начала чтения.
+
+Инвалидация между процессами не поддерживается, поэтому при запуске
+нескольких экземпляров бота кэш нужно отключить: BALANCE_CACHE_ENABLED=0.
+"""
+
+import os
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+load_dotenv()
+
+# Ключи в session.info, под которыми копятся новые и прочитанные балансы
+# до фиксации транзакции
+_PENDING_KEY = 'pending_balances'
+_PENDING_FILL_KEY = 'pending_balance_fills'
+
+
+class BalanceCache:
+    """LRU-кэш балансов с ограниченным временем жизни записей."""
+
+    def __init__(self, enabled: bool, maxsize: int = 10000, ttl: float = 60.0):
+        self.enabled = enabled
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        # telegram_id -> (момент устаревания, баланс)
+        self._items = OrderedDict()
+        # telegram_id -> номер последнего изменения (не больше maxsize ключей)
+        self._changed = OrderedDict()
+        self._clock = 0
+        # Номер последнего изменения среди вытесненных из _changed ключей
+        self._changed_floor = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, telegram_id: int):
+        """
+        Возвращает баланс из кэша.
+
+        Returns:
+            Баланс или None, если записи нет, она устарела или кэш выключен
+        """
+        if not self.enabled:
+            return None
+
+        item = self._items.get(telegram_id)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._items[telegram_id]
+            self.misses += 1
+            return None
+
+        self._items.move_to_end(telegram_id)
+        self.hits += 1
+        return item[1]
+
+    def _touch(self, telegram_id: int):
+        """Отмечает изменение баланса пользователя."""
+        self._clock += 1
+        self._changed[telegram_id] = self._clock
+        self._changed.move_to_end(telegram_id)
+        while len(self._changed) > self.maxsize:
+            _, clock = self._changed.popitem(last=False)
+            self._changed_floor = clock
+
+    def _store(self, telegram_id: int, balance: int):
+        self._items[telegram_id] = (time.monotonic() + self.ttl, balance)
+        self._items.move_to_end(telegram_id)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def set(self, telegram_id: int, balance: int):
+        """Сохраняет новый (зафиксированный) баланс пользователя."""
+        if not self.enabled:
+            return
+        self._touch(telegram_id)
+        self._store(telegram_id, balance)
+
+    def read_token(self) -> int:
+        """Номер, который нужно взять перед чтением баланса из БД (для fill)."""
+        return self._clock
+
+    def fill(self, telegram_id: int, balance: int, token: int):
+        """
+        Кладет в кэш баланс, прочитанный из БД, если с момента получения
+        token баланс пользователя не менялся (иначе прочитанное могло устареть).
+        """
+        if not self.enabled:
+            return
+        if token < self._changed_floor or self._changed.get(telegram_id, 0) > token:
+            return
+        self._store(telegram_id, balance)
+
+    def invalidate(self, telegram_id: int):
+        """Удаляет баланс пользователя из кэша."""
+        self._touch(telegram_id)
+        self._items.pop(telegram_id, None)
+
+    def clear(self):
+        """Полностью очищает кэш."""
+        self._items.clear()
+        # Незавершенные чтения не должны заполнить очищенный кэш
+        self._changed.clear()
+        self._changed_floor = self._clock = self._clock + 1
+
+    def stats(self) -> dict:
+        """Возвращает счетчики попаданий и промахов."""
+        return {
+            'enabled': self.enabled,
+            'size': len(self._items),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+balance_cache = BalanceCache(
+    enabled=os.getenv('BALANCE_CACHE_ENABLED', '1') == '1',
+    maxsize=int(os.getenv('BALANCE_CACHE_SIZE', '10000')),
+    ttl=float(os.getenv('BALANCE_CACHE_TTL', '60')),
+)
+
+
+def set_on_commit(session: AsyncSession, telegram_id: int, balance: int):
+    """
+    Откладывает обновление кэша до фиксации транзакции сессии.
+
+    До COMMIT запись пользователя удаляется из кэша, при ROLLBACK
+    кэш остается без этой записи и будет заполнен при следующем чтении.
+    """
+    balance_cache.invalidate(telegram_id)
+    session.info.setdefault(_PENDING_KEY, {})[telegram_id] = balance
+
+
+def fill_on_commit(session: AsyncSession, telegram_id: int, balance: int, token: int):
+    """
+    Откладывает заполнение кэша прочитанным в транзакции балансом до ее
+    фиксации (см. BalanceCache.fill).
+    """
+    session.info.setdefault(_PENDING_FILL_KEY, {})[telegram_id] = (balance, token)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_committed_balances(session):
+    fills = session.info.pop(_PENDING_FILL_KEY, None)
+    if fills:
+        for telegram_id, (balance, token) in fills.items():
+            balance_cache.fill(telegram_id, balance, token)
+    balances = session.info.pop(_PENDING_KEY, None)
+    if balances:
+        for telegram_id, balance in balances.items():
+            balance_cache.set(telegram_id, balance)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_rolled_back_balances(session):
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_PENDING_FILL_KEY, None)
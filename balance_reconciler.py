@@ -0,0 +1,402 @@
+"""
+Инкрементальная сверка балансов пользователей с журналом операций.
+
+users.ai_coins_balance - денормализованная копия суммы
+ai_coin_operations.amount пользователя. Сверка никогда не считает SUM по
+всему журналу:
+- журнал читается пачками по возрастанию id от сохраненной позиции
+  (ledger_reconcile_state.last_operation_id), суммы пачки по пользователям
+  добавляются к user_ledger_sums;
+- ожидаемый баланс = сумма из user_ledger_sums + операции пользователя после
+  позиции (их немного, они читаются по индексу user_id);
+- проверяются пользователи из пачки и очередная страница всех пользователей
+  (обход по users.id), поэтому со временем проверяется каждый пользователь,
+  в том числе без новых операций.
+
+id выдается до фиксации транзакции, и меньший id может появиться в журнале
+позже большего, поэтому позиция не проходит пропуск в id, пока он может
+быть операцией незавершенной транзакции. Пропуски ниже наибольшего id,
+увиденного в момент T (по часам БД), выданы транзакциями, начатыми до T.
+Когда в pg_stat_activity не остается транзакций, начатых до T, такие
+пропуски окончательны (откаты, пропуски последовательности), и позиция их
+проходит. Для этого соединения бота должны видеть xact_start друг друга
+(одна роль или pg_read_all_stats). Дополнительно позиция не проходит
+операции моложе BALANCE_RECONCILE_LAG секунд по часам БД.
+
+Расхождение подтверждается, если оно не изменилось при
+повторной проверке в следующем цикле (при write-behind журнал отстает от
+баланса). Подтвержденные расхождения пишутся в лог и в
+user_ledger_sums.mismatch, а при BALANCE_RECONCILE_REPAIR=1 баланс
+исправляется по журналу.
+
+Скорость сверки (строк журнала в секунду) пишется в лог и в метрики и
+показывается командой /reconcile_stats.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import func, select, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from balance_cache import set_on_commit
+from database import async_session
+from leaderboard import update_on_commit
+from metrics import RECONCILE_MISMATCHES, RECONCILE_ROWS, RECONCILE_ROWS_PER_SEC
+from models import AICoinOperation, LedgerReconcileState, User, UserLedgerSum
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Строка ledger_reconcile_state этой сверки
+STATE_NAME = 'ai_coins_balance'
+
+# Наибольший id журнала, часы БД и начало самой старой транзакции других
+# клиентских соединений этой базы
+CLOCK_SQL = text("""
+SELECT (SELECT max(id) FROM ai_coin_operations) AS max_id,
+       clock_timestamp() AS now,
+       (SELECT min(xact_start) FROM pg_stat_activity
+        WHERE datname = current_database()
+          AND backend_type = 'client backend'
+          AND pid <> pg_backend_pid()) AS oldest
+""")
+
+
+class BalanceReconciler:
+    """Сверка балансов с журналом по позиции в журнале и обходу пользователей."""
+
+    def __init__(self, enabled: bool, interval: float = 60.0, batch_size: int = 5000,
+                 max_batches: int = 20, sweep_size: int = 1000, lag: float = 60.0,
+                 repair: bool = False):
+        self.enabled = enabled
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.sweep_size = sweep_size
+        self.lag = lag
+        self.repair = repair
+
+        self._suspects = {}  # users.id -> расхождение, ожидающее повторной проверки
+        # (наибольший увиденный id, момент по часам БД): пропуски ниже этого id
+        # окончательны, когда завершатся все транзакции, начатые до этого момента
+        self._horizon = None
+        self._task = None
+
+        self.last_operation_id = 0
+        self.rows_total = 0
+        self.rows_per_sec = 0.0
+        self.flagged_total = 0
+        self.repaired_total = 0
+        self.last_run_at = None
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'repair': self.repair,
+            'last_operation_id': self.last_operation_id,
+            'rows_total': self.rows_total,
+            'rows_per_sec': self.rows_per_sec,
+            'suspects': len(self._suspects),
+            'flagged_total': self.flagged_total,
+            'repaired_total': self.repaired_total,
+            'last_run_at': self.last_run_at,
+        }
+
+    async def _lock_state(self, session: AsyncSession) -> LedgerReconcileState:
+        """Читает позицию сверки с блокировкой строки (сверку ведет один процесс)."""
+        await session.execute(
+            insert(LedgerReconcileState).values(name=STATE_NAME).on_conflict_do_nothing()
+        )
+        result = await session.execute(
+            select(LedgerReconcileState)
+            .where(LedgerReconcileState.name == STATE_NAME)
+            .with_for_update()
+        )
+        return result.scalar_one()
+
+    async def _mismatches(self, session: AsyncSession, last_operation_id: int, user_ids) -> dict:
+        """
+        Возвращает расхождения пользователей user_ids.
+
+        Returns:
+            Словарь users.id -> (баланс - журнал, уже_отмечено)
+        """
+        tail = (
+            select(func.coalesce(func.sum(AICoinOperation.amount), 0))
+            .where(
+                AICoinOperation.user_id == User.id,
+                AICoinOperation.id > last_operation_id
+            )
+            .scalar_subquery()
+        )
+        diff = User.ai_coins_balance - (func.coalesce(UserLedgerSum.ledger_sum, 0) + tail)
+        result = await session.execute(
+            select(User.id, diff, UserLedgerSum.mismatch)
+            .outerjoin(UserLedgerSum, UserLedgerSum.user_id == User.id)
+            .where(User.id.in_(user_ids), diff != 0)
+        )
+        return {
+            user_id: (user_diff, mismatch == user_diff)
+            for user_id, user_diff, mismatch in result
+        }
+
+    async def _clear_flags(self, session: AsyncSession, user_ids, mismatched):
+        """Снимает отметку с проверенных пользователей, у которых расхождения больше нет."""
+        await session.execute(
+            update(UserLedgerSum)
+            .where(
+                UserLedgerSum.user_id.in_(user_ids),
+                UserLedgerSum.user_id.not_in(mismatched),
+                UserLedgerSum.mismatch.is_not(None)
+            )
+            .values(mismatch=None, checked_at=func.now())
+        )
+
+    async def _process_batch(self):
+        """
+        Учитывает очередную пачку журнала и проверяет пользователей из нее.
+
+        Returns:
+            (число учтенных строк, новые расхождения users.id -> разница)
+        """
+        async with async_session() as session:
+            state = await self._lock_state(session)
+            result = await session.execute(
+                select(
+                    AICoinOperation.id, AICoinOperation.user_id, AICoinOperation.amount,
+                    AICoinOperation.created_at
+                    < func.localtimestamp() - timedelta(seconds=self.lag)
+                )
+                .where(AICoinOperation.id > state.last_operation_id)
+                .order_by(AICoinOperation.id)
+                .limit(self.batch_size)
+            )
+            operations = result.all()
+            # Пропуски ниже max_id выданы до момента now
+            clock = (await session.execute(CLOCK_SQL)).one()
+
+            if self._horizon is not None and (
+                clock.oldest is None or clock.oldest > self._horizon[1]
+            ):
+                final_gaps_below = self._horizon[0]
+                self._horizon = None
+            else:
+                final_gaps_below = 0
+            if clock.max_id is not None and self._horizon is None:
+                self._horizon = (clock.max_id, clock.now)
+
+            deltas = {}
+            last_operation_id = state.last_operation_id
+            rows = 0
+            for operation_id, user_id, amount, settled in operations:
+                if operation_id != last_operation_id + 1 and operation_id > final_gaps_below:
+                    break  # Пропуск может быть операцией незавершенной транзакции
+                if not settled:
+                    break  # Операция моложе lag
+                deltas[user_id] = deltas.get(user_id, 0) + amount
+                last_operation_id = operation_id
+                rows += 1
+
+            if not rows:
+                self.last_operation_id = last_operation_id
+                return 0, {}
+
+            stmt = insert(UserLedgerSum)
+            await session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=['user_id'],
+                    set_={
+                        'ledger_sum': UserLedgerSum.ledger_sum + stmt.excluded.ledger_sum,
+                        'checked_at': func.now(),
+                    }
+                ),
+                [{'user_id': user_id, 'ledger_sum': delta} for user_id, delta in deltas.items()]
+            )
+            state.last_operation_id = last_operation_id
+            mismatches = await self._mismatches(session, last_operation_id, list(deltas))
+            await session.commit()
+
+        self.last_operation_id = last_operation_id
+        return rows, {
+            user_id: user_diff
+            for user_id, (user_diff, flagged) in mismatches.items() if not flagged
+        }
+
+    async def _sweep(self) -> dict:
+        """Проверяет очередную страницу всех пользователей. Возвращает новые расхождения."""
+        async with async_session() as session:
+            state = await self._lock_state(session)
+            result = await session.execute(
+                select(User.id)
+                .where(User.id > state.last_swept_user_id)
+                .order_by(User.id)
+                .limit(self.sweep_size)
+            )
+            user_ids = result.scalars().all()
+            if not user_ids:
+                # Обход завершен, следующий начнется сначала
+                state.last_swept_user_id = 0
+                await session.commit()
+                return {}
+
+            mismatches = await self._mismatches(session, state.last_operation_id, user_ids)
+            await self._clear_flags(session, user_ids, list(mismatches))
+            state.last_swept_user_id = user_ids[-1]
+            await session.commit()
+
+        return {
+            user_id: user_diff
+            for user_id, (user_diff, flagged) in mismatches.items() if not flagged
+        }
+
+    async def _confirm(self, suspects: dict):
+        """
+        Повторно проверяет подозрительных пользователей. Неизменившиеся
+        расхождения отмечаются или исправляются.
+
+        Returns:
+            (подтвержденные users.id, расхождения, изменившиеся с прошлой проверки)
+        """
+        async with async_session() as session:
+            state = await self._lock_state(session)
+            mismatches = await self._mismatches(session, state.last_operation_id, list(suspects))
+            await self._clear_flags(session, list(suspects), list(mismatches))
+
+            confirmed = {
+                user_id: user_diff
+                for user_id, (user_diff, _) in mismatches.items()
+                if suspects[user_id] == user_diff
+            }
+            for user_id, user_diff in confirmed.items():
+                if self.repair:
+                    await self._repair(session, user_id, user_diff)
+                else:
+                    await session.execute(
+                        insert(UserLedgerSum)
+                        .values(user_id=user_id, ledger_sum=0, mismatch=user_diff)
+                        .on_conflict_do_update(
+                            index_elements=['user_id'],
+                            set_={'mismatch': user_diff, 'checked_at': func.now()}
+                        )
+                    )
+            await session.commit()
+
+        for user_id, user_diff in confirmed.items():
+            action = 'repaired' if self.repair else 'flagged'
+            logger.warning(
+                f"Баланс пользователя {user_id} расходится с журналом на {user_diff} "
+                f"({'исправлен' if self.repair else 'отмечен'})"
+            )
+            RECONCILE_MISMATCHES.labels(action).inc()
+        if self.repair:
+            self.repaired_total += len(confirmed)
+        else:
+            self.flagged_total += len(confirmed)
+
+        changed = {
+            user_id: user_diff
+            for user_id, (user_diff, _) in mismatches.items()
+            if user_id not in confirmed
+        }
+        return set(confirmed), changed
+
+    async def _repair(self, session: AsyncSession, user_id: int, user_diff: int):
+        """Приводит баланс к журналу относительным UPDATE (параллельные операции не теряются)."""
+        result = await session.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(ai_coins_balance=User.ai_coins_balance - user_diff)
+            .returning(User.telegram_id, User.ai_coins_balance)
+        )
+        row = result.one_or_none()
+        if row is not None:
+            set_on_commit(session, row.telegram_id, row.ai_coins_balance)
+            update_on_commit(session, row.telegram_id, row.ai_coins_balance)
+        await session.execute(
+            update(UserLedgerSum)
+            .where(UserLedgerSum.user_id == user_id)
+            .values(mismatch=None, checked_at=func.now())
+        )
+
+    async def run_once(self) -> int:
+        """Выполняет один цикл сверки. Возвращает число учтенных строк журнала."""
+        suspects, self._suspects = self._suspects, {}
+        found = {}
+
+        rows = 0
+        started = time.perf_counter()
+        for _ in range(self.max_batches):
+            batch_rows, mismatches = await self._process_batch()
+            rows += batch_rows
+            found.update(mismatches)
+            if batch_rows < self.batch_size:
+                break
+        elapsed = time.perf_counter() - started
+
+        found.update(await self._sweep())
+        if suspects:
+            confirmed, changed = await self._confirm(suspects)
+            found.update(changed)
+            for user_id in confirmed:
+                found.pop(user_id, None)
+        self._suspects = found
+
+        self.rows_total += rows
+        self.last_run_at = datetime.now()
+        if rows:
+            self.rows_per_sec = rows / elapsed if elapsed > 0 else 0.0
+            RECONCILE_ROWS.inc(rows)
+            RECONCILE_ROWS_PER_SEC.set(self.rows_per_sec)
+            logger.info(
+                f"Сверка журнала: {rows} строк за {elapsed:.2f} с "
+                f"({self.rows_per_sec:.0f} строк/с), позиция {self.last_operation_id}, "
+                f"на проверке {len(self._suspects)}"
+            )
+        return rows
+
+    async def _run(self):
+        while True:
+            try:
+                rows = await self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка сверки балансов: {e}", exc_info=True)
+                rows = 0
+            if rows < self.batch_size * self.max_batches:
+                await asyncio.sleep(self.interval)
+            # Иначе журнал еще не догнан - следующий цикл сразу
+
+    async def start(self):
+        """Запускает фоновую сверку."""
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(
+                f"Сверка балансов с журналом включена: interval={self.interval}s, "
+                f"batch_size={self.batch_size}, repair={self.repair}"
+            )
+
+    async def stop(self):
+        """Останавливает фоновую сверку."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+balance_reconciler = BalanceReconciler(
+    enabled=os.getenv('BALANCE_RECONCILE_ENABLED', '0') == '1',
+    interval=float(os.getenv('BALANCE_RECONCILE_INTERVAL', '60')),
+    batch_size=int(os.getenv('BALANCE_RECONCILE_BATCH_SIZE', '5000')),
+    max_batches=int(os.getenv('BALANCE_RECONCILE_MAX_BATCHES', '20')),
+    sweep_size=int(os.getenv('BALANCE_RECONCILE_SWEEP_SIZE', '1000')),
+    lag=float(os.getenv('BALANCE_RECONCILE_LAG', '60')),
+    repair=os.getenv('BALANCE_RECONCILE_REPAIR', '0') == '1',
+)
@@ -0,0 +1,174 @@
+"""
+Бенчмарк сессии Bot API: ответы пользователям на фоне массовой рассылки.
+
+Локальный сервер на aiohttp изображает Bot API: отвечает с задержкой сети
+и по желанию возвращает 429 (RetryAfter) и 5xx. Одновременно идут поток
+массовых отправок (внутри bulk_lane(), как в BroadcastEngine) и размеренные
+интерактивные отправки. Скрипт печатает JSON с p50/p95/p99 задержки
+интерактивных запросов и пропускной способностью рассылки.
+
+Сравнение с обычной сессией aiogram:
+    python bench_bot_api.py --session priority
+    python bench_bot_api.py --session default
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from statistics import quantiles
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramAPIError
+
+from bot_session import PriorityAiohttpSession, bulk_lane
+
+BENCH_TOKEN = '123456:BENCHMARK'
+
+
+class FakeBotApi:
+    """Заглушка Bot API: задержка ответа, случайные 429 и 5xx."""
+
+    def __init__(self, latency: float, retry_after_ratio: float, error_ratio: float):
+        self.latency = latency
+        self.retry_after_ratio = retry_after_ratio
+        self.error_ratio = error_ratio
+        self.calls = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.calls += 1
+        form = await request.post()
+        await asyncio.sleep(self.latency)
+
+        roll = random.random()
+        if roll < self.retry_after_ratio:
+            return web.json_response({
+                'ok': False, 'error_code': 429,
+                'description': 'Too Many Requests: retry after 1',
+                'parameters': {'retry_after': 1},
+            }, status=429)
+        if roll < self.retry_after_ratio + self.error_ratio:
+            return web.json_response({
+                'ok': False, 'error_code': 502, 'description': 'Bad Gateway',
+            }, status=502)
+
+        return web.json_response({'ok': True, 'result': {
+            'message_id': 1,
+            'date': 0,
+            'chat': {'id': int(form['chat_id']), 'type': 'private'},
+            'text': form.get('text', ''),
+        }})
+
+
+async def start_server(api: FakeBotApi):
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', api.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def make_session(kind: str, base_url: str):
+    server = TelegramAPIServer.from_base(base_url)
+    if kind == 'priority':
+        return PriorityAiohttpSession(api=server)
+    return AiohttpSession(api=server)
+
+
+def latency_stats(latencies: list) -> dict:
+    latencies_ms = [latency * 1000 for latency in latencies]
+    if not latencies_ms:
+        return {}
+    # quantiles требует минимум две точки
+    cuts = quantiles(latencies_ms, n=100) if len(latencies_ms) > 1 else latencies_ms * 99
+    return {
+        'p50': round(cuts[49], 2),
+        'p95': round(cuts[94], 2),
+        'p99': round(cuts[98], 2),
+        'max': round(max(latencies_ms), 2),
+    }
+
+
+async def run_benchmark(args):
+    api = FakeBotApi(args.latency, args.retry_after_ratio, args.error_ratio)
+    runner, base_url = await start_server(api)
+    bot = Bot(token=BENCH_TOKEN, session=make_session(args.session, base_url))
+
+    bulk_sent = bulk_failed = 0
+    interactive_latencies = []
+    interactive_failed = 0
+    stop_bulk = asyncio.Event()
+
+    async def bulk_sender(worker: int):
+        nonlocal bulk_sent, bulk_failed
+        with bulk_lane():
+            chat_id = worker
+            while not stop_bulk.is_set():
+                try:
+                    await bot.send_message(chat_id, "broadcast")
+                    bulk_sent += 1
+                except TelegramAPIError:
+                    bulk_failed += 1
+                chat_id += args.bulk_concurrency
+
+    async def interactive_send(index: int):
+        nonlocal interactive_failed
+        started = time.perf_counter()
+        try:
+            await bot.send_message(10_000_000 + index, "reply")
+            interactive_latencies.append(time.perf_counter() - started)
+        except TelegramAPIError:
+            interactive_failed += 1
+
+    try:
+        bulk_tasks = [asyncio.create_task(bulk_sender(worker))
+                      for worker in range(args.bulk_concurrency)]
+        # Даем рассылке занять соединения
+        await asyncio.sleep(args.latency * 2)
+
+        started = time.perf_counter()
+        interactive_tasks = []
+        for index in range(args.interactive):
+            interactive_tasks.append(asyncio.create_task(interactive_send(index)))
+            await asyncio.sleep(args.interactive_interval)
+        await asyncio.gather(*interactive_tasks)
+        elapsed = time.perf_counter() - started
+
+        stop_bulk.set()
+        await asyncio.gather(*bulk_tasks)
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+
+    print(json.dumps({
+        'session': args.session,
+        'api_latency_sec': args.latency,
+        'bulk_concurrency': args.bulk_concurrency,
+        'elapsed_sec': round(elapsed, 3),
+        'interactive_sent': len(interactive_latencies),
+        'interactive_failed': interactive_failed,
+        'interactive_latency_ms': latency_stats(interactive_latencies),
+        'bulk_sent': bulk_sent,
+        'bulk_failed': bulk_failed,
+        'bulk_per_sec': round(bulk_sent / elapsed, 2),
+        'api_calls': api.calls,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк сессии Bot API")
+    parser.add_argument('--session', choices=['priority', 'default'], default='priority')
+    parser.add_argument('--interactive', type=int, default=500)
+    parser.add_argument('--interactive-interval', type=float, default=0.01)
+    parser.add_argument('--bulk-concurrency', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--retry-after-ratio', type=float, default=0.0)
+    parser.add_argument('--error-ratio', type=float, default=0.0)
+    asyncio.run(run_benchmark(parser.parse_args()))
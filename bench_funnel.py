@@ -0,0 +1,330 @@
+"""
+Нагрузочный тест воронки на реальном Dispatcher.
+
+Каждый виртуальный пользователь проходит шаги /start -> выбор направления ->
+register -> confirm_registration_<id>. Обновления подаются в dp.feed_update
+из main.py, поэтому работают все middleware и обработчики, а также локальная
+БД из DATABASE_URL. Вызовы Bot API перехватывает заглушка сессии бота, которая
+отвечает с заданной задержкой сети.
+
+Виртуальные пользователи получают telegram_id от BENCH_TELEGRAM_ID_BASE и
+удаляются из БД до и после прогона. Если предстоящих вебинаров нет, на время
+теста создается временный вебинар.
+
+Скрипт печатает JSON: пропускную способность, p50/p95/p99 задержки, число
+SQL-запросов и вызовов Bot API по шагам, а также пиковую память (RSS).
+С --trace-memory после замера выполняется отдельный, не замеряемый прогон
+под tracemalloc: трассировка замедляет аллокации и исказила бы задержки.
+
+Пример:
+    python bench_funnel.py --users 2000 --concurrency 100 --output funnel.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import subprocess
+import time
+import tracemalloc
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from itertools import count
+from statistics import mean, quantiles
+from typing import Any, Awaitable, Callable, Dict
+
+# main.py требует токен при импорте; сеть заглушкой не используется
+os.environ.setdefault('BOT_TOKEN', '123456:BENCHMARK')
+os.environ.setdefault('VIDEO_FILE_ID', 'bench-video')
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.types import CallbackQuery, Chat, Message, TelegramObject, Update
+from aiogram.types import User as TelegramUser
+from sqlalchemy import delete, select
+
+from database import async_session
+from models import AICoinOperation, User, Webinar, webinar_registrations
+from metrics import BotApiMetricsMiddleware, current_update_stats
+from balance_cache import balance_cache
+from ledger_writer import ledger_writer
+from webinar_schedule import webinar_schedule
+import main
+
+# Лог каждого обновления от aiogram искажает замеры
+logging.getLogger('aiogram.event').setLevel(logging.WARNING)
+
+BENCH_TELEGRAM_ID_BASE = 9_000_000_000
+
+# Запись текущего шага: заполняется middleware и читается после feed_update
+current_step: ContextVar[dict] = ContextVar('current_step', default=None)
+
+
+class StubSession(BaseSession):
+    """Заглушка сессии Bot API: отвечает True после задержки сети."""
+
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+        self.calls = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536,
+                             raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+class StepStatsMiddleware(BaseMiddleware):
+    """
+    Внешний middleware на dp.update (после MetricsMiddleware): копирует
+    счетчики обновления в запись текущего шага.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            step, stats = current_step.get(), current_update_stats.get()
+            if step is not None and stats is not None:
+                step['handler'] = stats.handler
+                step['db_statements'] = stats.db_statements
+                step['api_calls'] = stats.api_calls
+
+
+class FunnelBenchmark:
+    """Генерирует обновления виртуальных пользователей и собирает статистику."""
+
+    def __init__(self, bot: Bot, webinar_id: int):
+        self.bot = bot
+        self.webinar_id = webinar_id
+        self.update_ids = count(1)
+        self.message_ids = count(1)
+        self.steps = {}
+
+    def _user(self, telegram_id: int) -> TelegramUser:
+        return TelegramUser(
+            id=telegram_id, is_bot=False,
+            first_name=f"Bench {telegram_id}", username=f"bench_{telegram_id}",
+        )
+
+    def _message(self, telegram_id: int, text: str = None) -> Message:
+        return Message(
+            message_id=next(self.message_ids),
+            date=datetime.now(),
+            chat=Chat(id=telegram_id, type='private'),
+            from_user=self._user(telegram_id),
+            text=text,
+        ).as_(self.bot)
+
+    def start_update(self, telegram_id: int) -> Update:
+        return Update(
+            update_id=next(self.update_ids),
+            message=self._message(telegram_id, '/start'),
+        ).as_(self.bot)
+
+    def callback_update(self, telegram_id: int, data: str) -> Update:
+        return Update(
+            update_id=next(self.update_ids),
+            callback_query=CallbackQuery(
+                id=str(next(self.update_ids)),
+                from_user=self._user(telegram_id),
+                chat_instance='bench',
+                message=self._message(telegram_id),
+                data=data,
+            ).as_(self.bot),
+        ).as_(self.bot)
+
+    async def _feed(self, step_name: str, update: Update):
+        step = {'handler': '-', 'db_statements': 0, 'api_calls': 0, 'error': None}
+        token = current_step.set(step)
+        started = time.perf_counter()
+        try:
+            await main.dp.feed_update(self.bot, update)
+        except Exception as e:
+            step['error'] = f"{type(e).__name__}: {e}"
+        finally:
+            step['latency'] = time.perf_counter() - started
+            current_step.reset(token)
+        self.steps.setdefault(step_name, []).append(step)
+
+    async def run_user(self, index: int, slots: asyncio.Semaphore):
+        telegram_id = BENCH_TELEGRAM_ID_BASE + index
+        direction = 'direction_personal' if index % 2 else 'direction_business'
+        async with slots:
+            await self._feed('start', self.start_update(telegram_id))
+            await self._feed('direction', self.callback_update(telegram_id, direction))
+            await self._feed('register', self.callback_update(telegram_id, 'register'))
+            await self._feed(
+                'confirm_registration',
+                self.callback_update(telegram_id, f"confirm_registration_{self.webinar_id}")
+            )
+
+    def report(self) -> dict:
+        report = {}
+        for step_name, steps in self.steps.items():
+            latencies_ms = [step['latency'] * 1000 for step in steps]
+            # quantiles требует минимум две точки
+            cuts = quantiles(latencies_ms, n=100) if len(latencies_ms) > 1 else latencies_ms * 99
+            errors = [step['error'] for step in steps if step['error']]
+            report[step_name] = {
+                'handler': steps[0]['handler'],
+                'updates': len(steps),
+                'errors': len(errors),
+                'first_error': errors[0] if errors else None,
+                'latency_ms': {
+                    'mean': round(mean(latencies_ms), 2),
+                    'p50': round(cuts[49], 2),
+                    'p95': round(cuts[94], 2),
+                    'p99': round(cuts[98], 2),
+                    'max': round(max(latencies_ms), 2),
+                },
+                'db_statements_avg': round(mean(step['db_statements'] for step in steps), 2),
+                'db_statements_max': max(step['db_statements'] for step in steps),
+                'api_calls_avg': round(mean(step['api_calls'] for step in steps), 2),
+            }
+        return report
+
+
+async def cleanup_users(users: int):
+    """Удаляет виртуальных пользователей и их данные."""
+    bench_users = select(User.id).where(
+        User.telegram_id.between(BENCH_TELEGRAM_ID_BASE, BENCH_TELEGRAM_ID_BASE + users)
+    )
+    async with async_session() as session:
+        await session.execute(
+            delete(webinar_registrations).where(webinar_registrations.c.user_id.in_(bench_users))
+        )
+        await session.execute(
+            delete(AICoinOperation).where(AICoinOperation.user_id.in_(bench_users))
+        )
+        await session.execute(
+            delete(User).where(
+                User.telegram_id.between(BENCH_TELEGRAM_ID_BASE, BENCH_TELEGRAM_ID_BASE + users)
+            )
+        )
+        await session.commit()
+    balance_cache.clear()
+
+
+async def prepare_webinar():
+    """Возвращает (вебинар, создан_ли_он_для_теста)."""
+    await webinar_schedule.refresh()
+    webinar = webinar_schedule.next_webinar()
+    if webinar:
+        return webinar, False
+
+    async with async_session() as session:
+        webinar = Webinar(webinar_date=datetime.now() + timedelta(days=30))
+        session.add(webinar)
+        await session.commit()
+    await webinar_schedule.refresh()
+    return webinar, True
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmark(args):
+    session = StubSession(args.latency)
+    session.middleware(BotApiMetricsMiddleware())
+    bot = Bot(token=os.environ['BOT_TOKEN'], session=session)
+    main.dp.update.outer_middleware(StepStatsMiddleware())
+
+    await cleanup_users(args.users)
+    webinar, temporary_webinar = await prepare_webinar()
+    await ledger_writer.start()
+
+    benchmark = FunnelBenchmark(bot, webinar.id)
+    slots = asyncio.Semaphore(args.concurrency)
+
+    peak_traced = None
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*[
+            benchmark.run_user(index, slots) for index in range(1, args.users + 1)
+        ])
+        elapsed = time.perf_counter() - started
+        # ru_maxrss в Linux измеряется в килобайтах
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        if args.trace_memory:
+            # Отдельный прогон с теми же пользователями, его статистика не учитывается
+            await cleanup_users(args.users)
+            traced = FunnelBenchmark(bot, webinar.id)
+            tracemalloc.start()
+            try:
+                await asyncio.gather(*[
+                    traced.run_user(index, slots) for index in range(1, args.users + 1)
+                ])
+                _, peak_traced = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+    finally:
+        await ledger_writer.stop()
+        if not args.keep_data:
+            await cleanup_users(args.users)
+            if temporary_webinar:
+                async with async_session() as db_session:
+                    await db_session.execute(delete(Webinar).where(Webinar.id == webinar.id))
+                    await db_session.commit()
+
+    steps = benchmark.report()
+    updates = sum(step['updates'] for step in steps.values())
+    result = {
+        'revision': git_revision(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'users': args.users,
+        'concurrency': args.concurrency,
+        'api_latency_sec': args.latency,
+        'elapsed_sec': round(elapsed, 3),
+        'users_per_sec': round(args.users / elapsed, 2),
+        'updates_per_sec': round(updates / elapsed, 2),
+        'api_calls': session.calls,
+        'peak_rss_mb': round(peak_rss / 1024, 2),
+        'peak_traced_memory_mb': (
+            round(peak_traced / 2 ** 20, 2) if peak_traced is not None else None
+        ),
+        'steps': steps,
+    }
+
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест воронки регистрации")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help="Задержка ответа заглушки Bot API, с")
+    parser.add_argument('--output', help="Файл для сохранения JSON-отчета")
+    parser.add_argument('--keep-data', action='store_true',
+                        help="Не удалять виртуальных пользователей после прогона")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="Отдельный прогон под tracemalloc для пиковой памяти Python")
+    asyncio.run(run_benchmark(parser.parse_args()))
@@ -0,0 +1,230 @@
+"""
+Сравнение приема обновлений: long polling и вебхук под нагрузкой.
+
+Записанные обновления (JSON по одному на строку, --updates) или
+сгенерированные /start подаются боту двумя способами:
+- polling: локальная заглушка Bot API отдает их через getUpdates пачками,
+  бот работает через dp.start_polling;
+- webhook: заглушка Telegram отправляет их POST-запросами на эндпоинт
+  webhook_server (с секретным заголовком) в --connections соединений, как
+  Telegram с max_connections.
+
+Обработчик имитирует работу задержкой --work. Для каждого режима скрипт
+печатает JSON с пропускной способностью и p50/p95/p99 задержки от
+поступления обновления до конца обработки.
+
+Пример:
+    python bench_webhook.py --updates 5000 --work 0.02
+    python bench_webhook.py --updates-file recorded_updates.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime
+from statistics import quantiles
+
+from aiohttp import ClientSession, web
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message
+
+from webhook_server import SECRET_HEADER, TelegramWebhookHandler
+
+BENCH_TOKEN = '123456:BENCHMARK'
+BENCH_SECRET = 'bench-secret'
+
+
+def generated_updates(count: int) -> list:
+    now = int(datetime.now().timestamp())
+    return [
+        {
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id,
+                'date': now,
+                'chat': {'id': 1_000_000 + update_id % 5000, 'type': 'private'},
+                'from': {'id': 1_000_000 + update_id % 5000, 'is_bot': False, 'first_name': 'Bench'},
+                'text': '/start',
+            },
+        }
+        for update_id in range(1, count + 1)
+    ]
+
+
+def load_updates(path: str) -> list:
+    with open(path, encoding='utf-8') as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+    # Нумеруем заново: getUpdates отдает обновления по возрастанию update_id
+    for update_id, update in enumerate(updates, 1):
+        update['update_id'] = update_id
+    return updates
+
+
+class Recorder:
+    """Обработчик-заглушка: имитирует работу и записывает задержки."""
+
+    def __init__(self, total: int, work: float):
+        self.total = total
+        self.work = work
+        self.arrived = {}  # update_id -> момент поступления
+        self.latencies = []
+        self.done = asyncio.Event()
+
+    def dispatcher(self) -> Dispatcher:
+        dp = Dispatcher()
+
+        @dp.update.outer_middleware()
+        async def record(handler, event, data):
+            try:
+                return await handler(event, data)
+            finally:
+                self.latencies.append(time.perf_counter() - self.arrived[event.update_id])
+                if len(self.latencies) >= self.total:
+                    self.done.set()
+
+        @dp.message()
+        async def work(message: Message):
+            await asyncio.sleep(self.work)
+
+        return dp
+
+
+def latency_stats(latencies: list) -> dict:
+    latencies_ms = [latency * 1000 for latency in latencies]
+    # quantiles требует минимум две точки
+    cuts = quantiles(latencies_ms, n=100) if len(latencies_ms) > 1 else latencies_ms * 99
+    return {
+        'p50': round(cuts[49], 2),
+        'p95': round(cuts[94], 2),
+        'p99': round(cuts[98], 2),
+        'max': round(max(latencies_ms), 2),
+    }
+
+
+async def start_site(app: web.Application):
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def run_polling(updates: list, args) -> dict:
+    recorder = Recorder(len(updates), args.work)
+    pending = list(updates)
+    available = asyncio.Event()
+
+    async def bot_api(request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        if method == 'getMe':
+            return web.json_response({'ok': True, 'result': {
+                'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot',
+            }})
+        if method != 'getUpdates':
+            return web.json_response({'ok': True, 'result': True})
+
+        form = await request.post()
+        offset = int(form.get('offset') or 0)
+        timeout = float(form.get('timeout') or 0)
+        # Подтвержденные (update_id < offset) обновления больше не отдаются
+        while pending and pending[0]['update_id'] < offset:
+            pending.pop(0)
+        if not pending and timeout:
+            available.clear()
+            try:
+                await asyncio.wait_for(available.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        batch = pending[:100]
+        now = time.perf_counter()
+        for update in batch:
+            recorder.arrived.setdefault(update['update_id'], now)
+        return web.json_response({'ok': True, 'result': batch})
+
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', bot_api)
+    runner, base_url = await start_site(app)
+    bot = Bot(token=BENCH_TOKEN,
+              session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)))
+    dp = recorder.dispatcher()
+
+    started = time.perf_counter()
+    polling = asyncio.create_task(dp.start_polling(
+        bot, polling_timeout=1, handle_signals=False, close_bot_session=False,
+    ))
+    await recorder.done.wait()
+    elapsed = time.perf_counter() - started
+    await dp.stop_polling()
+    await polling
+    await bot.session.close()
+    await runner.cleanup()
+    return {
+        'mode': 'polling',
+        'elapsed_sec': round(elapsed, 3),
+        'updates_per_sec': round(len(updates) / elapsed, 2),
+        'latency_ms': latency_stats(recorder.latencies),
+    }
+
+
+async def run_webhook(updates: list, args) -> dict:
+    recorder = Recorder(len(updates), args.work)
+    bot = Bot(token=BENCH_TOKEN)
+    handler = TelegramWebhookHandler(
+        bot, recorder.dispatcher(), secret=BENCH_SECRET, concurrency=args.webhook_concurrency
+    )
+    app = web.Application()
+    app.router.add_post('/telegram/webhook', handler.handle)
+    runner, base_url = await start_site(app)
+
+    queue = list(reversed(updates))
+
+    async def telegram_connection(http: ClientSession):
+        while queue:
+            update = queue.pop()
+            recorder.arrived[update['update_id']] = time.perf_counter()
+            async with http.post(f"{base_url}/telegram/webhook", json=update,
+                                 headers={SECRET_HEADER: BENCH_SECRET}) as response:
+                response.raise_for_status()
+
+    started = time.perf_counter()
+    async with ClientSession() as http:
+        await asyncio.gather(*(telegram_connection(http) for _ in range(args.connections)))
+    await recorder.done.wait()
+    elapsed = time.perf_counter() - started
+    await handler.drain()
+    await bot.session.close()
+    await runner.cleanup()
+    return {
+        'mode': 'webhook',
+        'elapsed_sec': round(elapsed, 3),
+        'updates_per_sec': round(len(updates) / elapsed, 2),
+        'latency_ms': latency_stats(recorder.latencies),
+    }
+
+
+async def run_benchmark(args):
+    updates = load_updates(args.updates_file) if args.updates_file else generated_updates(args.updates)
+    results = [await run_polling(updates, args), await run_webhook(updates, args)]
+    print(json.dumps({
+        'updates': len(updates),
+        'work_sec': args.work,
+        'connections': args.connections,
+        'webhook_concurrency': args.webhook_concurrency,
+        'results': results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сравнение long polling и вебхука")
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--updates-file', help="Записанные обновления, JSON по одному на строку")
+    parser.add_argument('--work', type=float, default=0.02,
+                        help="Время обработки одного обновления, с")
+    parser.add_argument('--connections', type=int, default=40,
+                        help="Соединения заглушки Telegram с вебхуком (max_connections)")
+    parser.add_argument('--webhook-concurrency', type=int, default=100)
+    asyncio.run(run_benchmark(parser.parse_args()))
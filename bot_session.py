@@ -0,0 +1,197 @@
+"""
+Сессия Bot API с приоритетами, настроенным пулом соединений и повторами.
+
+- Одновременно выполняется не больше BOT_API_CONCURRENCY запросов. Ответы
+  пользователям (интерактивная полоса) получают свободный слот раньше
+  массовых отправок, а рассылки (массовая полоса) занимают не больше
+  BOT_API_BULK_SHARE слотов, поэтому ответы не стоят в очереди за ними.
+- Полоса задается контекстом: код рассылок выполняется внутри bulk_lane().
+- TelegramRetryAfter повторяется для всех методов (запрос не выполнен), а
+  ошибки 5xx/сети - только для идемпотентных методов (get*, answerCallbackQuery
+  и т.п.) или если соединение не было установлено: после таймаута или обрыва
+  sendMessage/sendPhoto могли уже выполниться, и повтор прислал бы дубликат.
+  Повторов не больше BOT_API_MAX_RETRIES, пауза со случайной добавкой
+  (jitter). RetryAfter в массовой полосе приостанавливает всю полосу
+  (интерактивные запросы продолжают работать) и сразу передается
+  вызывающему коду: рассылка сама приостанавливает свой token bucket и
+  повторяет отправку, и повторы не умножаются на повторы сессии.
+- Соединения с api.telegram.org переиспользуются (keep-alive), размер пула
+  задается BOT_API_POOL_SIZE.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import aiohttp
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+BOT_API_POOL_SIZE = int(os.getenv('BOT_API_POOL_SIZE', '100'))
+BOT_API_KEEPALIVE = float(os.getenv('BOT_API_KEEPALIVE', '60'))
+BOT_API_TIMEOUT = float(os.getenv('BOT_API_TIMEOUT', '30'))
+BOT_API_CONCURRENCY = int(os.getenv('BOT_API_CONCURRENCY', '64'))
+BOT_API_BULK_SHARE = float(os.getenv('BOT_API_BULK_SHARE', '0.5'))
+BOT_API_MAX_RETRIES = int(os.getenv('BOT_API_MAX_RETRIES', '3'))
+BOT_API_RETRY_BASE = float(os.getenv('BOT_API_RETRY_BASE', '0.5'))
+BOT_API_RETRY_CAP = float(os.getenv('BOT_API_RETRY_CAP', '10'))
+
+INTERACTIVE = 0
+BULK = 1
+
+# Методы, повтор которых после неизвестного исхода не меняет результат
+IDEMPOTENT_METHODS = {
+    'answerCallbackQuery', 'sendChatAction', 'setWebhook', 'deleteWebhook',
+    'setMyCommands', 'deleteMyCommands', 'setChatMenuButton',
+}
+
+# Ошибки до отправки запроса: соединение не установлено, Telegram его не получил
+CONNECT_ERRORS = (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError)
+
+# Полоса запросов текущего контекста (по умолчанию интерактивная)
+current_lane: ContextVar[int] = ContextVar('current_lane', default=INTERACTIVE)
+
+
+@contextmanager
+def bulk_lane():
+    """Выполняет запросы Bot API внутри блока в массовой полосе."""
+    token = current_lane.set(BULK)
+    try:
+        yield
+    finally:
+        current_lane.reset(token)
+
+
+class PriorityGate:
+    """
+    Ограничитель параллельности с приоритетами: свободный слот получает
+    ожидающий запрос с наименьшим номером полосы (в порядке прихода внутри
+    полосы). Массовая полоса ограничена bulk_limit слотами и может быть
+    приостановлена.
+    """
+
+    def __init__(self, capacity: int, bulk_limit: int):
+        self.capacity = capacity
+        self.bulk_limit = max(1, bulk_limit)
+        self.in_flight = [0, 0]  # Занятые слоты по полосам
+        self._waiters = []  # Куча (полоса, порядковый номер, future)
+        self._order = itertools.count()
+        self._bulk_paused_until = 0.0
+        self._resume_handle = None
+
+    def _can_start(self, lane: int) -> bool:
+        if sum(self.in_flight) >= self.capacity:
+            return False
+        if lane == BULK:
+            if self.in_flight[BULK] >= self.bulk_limit:
+                return False
+            if time.monotonic() < self._bulk_paused_until:
+                return False
+        return True
+
+    def _wake(self):
+        """Отдает освободившиеся слоты ожидающим в порядке приоритета."""
+        skipped = []
+        while self._waiters:
+            lane, order, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            if not self._can_start(lane):
+                skipped.append((lane, order, future))
+                if lane == INTERACTIVE:
+                    break  # Нет свободных слотов вообще
+                continue
+            self.in_flight[lane] += 1
+            future.set_result(None)
+        for waiter in skipped:
+            heapq.heappush(self._waiters, waiter)
+
+    async def acquire(self, lane: int):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (lane, next(self._order), future))
+        self._wake()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Слот уже был выдан - возвращаем его
+                self.release(lane)
+            raise
+
+    def release(self, lane: int):
+        self.in_flight[lane] -= 1
+        self._wake()
+
+    def pause_bulk(self, seconds: float):
+        """Приостанавливает массовую полосу (например, по RetryAfter)."""
+        self._bulk_paused_until = max(self._bulk_paused_until, time.monotonic() + seconds)
+        if self._resume_handle is not None:
+            self._resume_handle.cancel()
+        self._resume_handle = asyncio.get_running_loop().call_later(seconds, self._wake)
+
+
+class PriorityAiohttpSession(AiohttpSession):
+    """AiohttpSession с полосами приоритета и повтором временных ошибок."""
+
+    def __init__(self, concurrency: int = BOT_API_CONCURRENCY,
+                 bulk_share: float = BOT_API_BULK_SHARE,
+                 max_retries: int = BOT_API_MAX_RETRIES,
+                 retry_base: float = BOT_API_RETRY_BASE,
+                 retry_cap: float = BOT_API_RETRY_CAP,
+                 pool_size: int = BOT_API_POOL_SIZE,
+                 keepalive: float = BOT_API_KEEPALIVE,
+                 **kwargs):
+        kwargs.setdefault('timeout', BOT_API_TIMEOUT)
+        super().__init__(limit=pool_size, **kwargs)
+        self._connector_init['keepalive_timeout'] = keepalive
+        self.gate = PriorityGate(concurrency, int(concurrency * bulk_share))
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_cap = retry_cap
+
+    def _backoff(self, attempt: int) -> float:
+        """Экспоненциальная пауза с полным jitter."""
+        return random.uniform(0, min(self.retry_cap, self.retry_base * 2 ** attempt))
+
+    @staticmethod
+    def _is_safe_to_retry(method, error: Exception) -> bool:
+        """Можно ли повторить запрос после ошибки 5xx или сети."""
+        name = method.__api_method__
+        if name.startswith('get') or name in IDEMPOTENT_METHODS:
+            return True
+        # aiogram оборачивает ошибку aiohttp в TelegramNetworkError (raise ... from e)
+        return isinstance(error, TelegramNetworkError) and isinstance(error.__cause__, CONNECT_ERRORS)
+
+    async def make_request(self, bot: Bot, method, timeout=None):
+        lane = current_lane.get()
+        for attempt in range(self.max_retries + 1):
+            await self.gate.acquire(lane)
+            try:
+                return await super().make_request(bot, method, timeout=timeout)
+            except TelegramRetryAfter as e:
+                delay = e.retry_after + random.uniform(0, 1)
+                if lane == BULK:
+                    self.gate.pause_bulk(delay)
+                    raise
+                if attempt >= self.max_retries:
+                    raise
+                logger.warning(f"{type(method).__name__}: RetryAfter {e.retry_after} с, повтор через {delay:.1f} с")
+            except (TelegramServerError, TelegramNetworkError) as e:
+                if attempt >= self.max_retries or not self._is_safe_to_retry(method, e):
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(f"{type(method).__name__}: {e}, повтор через {delay:.2f} с")
+            finally:
+                self.gate.release(lane)
+            await asyncio.sleep(delay)
@@ -0,0 +1,337 @@
+"""
+Рассылка сообщений с соблюдением лимитов Telegram.
+
+- Общий token bucket ограничивает скорость всех рассылок процесса
+  (BROADCAST_RATE сообщений в секунду, по умолчанию 25 при лимите ~30).
+- Сообщения в один чат отправляются не чаще BROADCAST_PER_CHAT_INTERVAL.
+- На TelegramRetryAfter приостанавливается весь bucket, затем отправка повторяется.
+- Запросы выполняются в массовой полосе сессии бота (bot_session.bulk_lane),
+  поэтому ответы пользователям во время рассылки обслуживаются первыми.
+- Получатели читаются из БД порциями по users.id (keyset), без загрузки всех
+  пользователей. Прогресс - наибольший users.id, до которого включительно
+  все отправки завершены, - сохраняется в таблицу broadcasts по мере
+  продвижения, а при отмене (остановка планировщика) сохраняется перед
+  выходом. Отправка, запрос которой уже ушел в Telegram, при отмене
+  дожидается ответа. Поэтому продолженная рассылка не отправляет
+  сообщение повторно (кроме отправок, прерванных падением процесса).
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from dotenv import load_dotenv
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert
+
+from bot_session import bulk_lane
+from database import async_session
+from models import Broadcast, User, webinar_registrations
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Ограничитель скорости: rate токенов в секунду, запас не больше capacity."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def pause(self, seconds: float):
+        """Останавливает выдачу токенов (например, по RetryAfter)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ChatPacer:
+    """Минимальный интервал между сообщениями в один чат."""
+
+    def __init__(self, interval: float, max_chats: int = 100000):
+        self.interval = interval
+        self.max_chats = max_chats
+        self._next_allowed = {}
+
+    async def wait(self, chat_id: int):
+        now = time.monotonic()
+        next_allowed = self._next_allowed.get(chat_id, 0.0)
+        self._next_allowed[chat_id] = max(now, next_allowed) + self.interval
+        if next_allowed > now:
+            await asyncio.sleep(next_allowed - now)
+
+        if len(self._next_allowed) > self.max_chats:
+            # Убираем чаты, для которых пауза уже истекла
+            self._next_allowed = {
+                chat: allowed for chat, allowed in self._next_allowed.items() if allowed > now
+            }
+
+
+@dataclass
+class BroadcastStats:
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def rate(self) -> float:
+        """Фактическая скорость отправки (сообщений в секунду)."""
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+
+def webinar_attendees(webinar_id: int, page_size: int = 500):
+    """
+    Возвращает источник получателей-участников вебинара.
+
+    Источник - функция, которая по последнему обработанному users.id отдает
+    асинхронный итератор пар (users.id, telegram_id) по возрастанию users.id.
+    """
+    async def recipients(after_user_id: int):
+        last_user_id = after_user_id
+        while True:
+            async with async_session() as session:
+                result = await session.execute(
+                    select(User.id, User.telegram_id)
+                    .join(webinar_registrations, webinar_registrations.c.user_id == User.id)
+                    .where(
+                        webinar_registrations.c.webinar_id == webinar_id,
+                        User.id > last_user_id
+                    )
+                    .order_by(User.id)
+                    .limit(page_size)
+                )
+                rows = result.all()
+
+            if not rows:
+                return
+            for row in rows:
+                yield row.id, row.telegram_id
+            last_user_id = rows[-1].id
+
+    return recipients
+
+
+class BroadcastEngine:
+    """Исполнитель рассылок с общим ограничением скорости."""
+
+    def __init__(self, rate: float, per_chat_interval: float, concurrency: int,
+                 max_retries: int = 5):
+        self.bucket = TokenBucket(rate, capacity=rate)
+        self.pacer = ChatPacer(per_chat_interval)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+
+    async def _send(self, bot: Bot, chat_id: int, text: str, stats: BroadcastStats,
+                    slots: asyncio.Semaphore, send_kwargs: dict) -> bool:
+        try:
+            for attempt in range(self.max_retries + 1):
+                await self.pacer.wait(chat_id)
+                await self.bucket.acquire()
+                request = asyncio.ensure_future(bot.send_message(chat_id, text, **send_kwargs))
+                try:
+                    await asyncio.shield(request)
+                    stats.sent += 1
+                    return True
+                except asyncio.CancelledError:
+                    # Запрос уже начат: дожидаемся ответа, чтобы учесть
+                    # доставку, но больше не повторяем
+                    try:
+                        await request
+                    except Exception:
+                        raise asyncio.CancelledError()
+                    stats.sent += 1
+                    return True
+                except TelegramRetryAfter as e:
+                    # Telegram просит подождать - останавливаем всю рассылку
+                    logger.warning(f"RetryAfter {e.retry_after} с при отправке в {chat_id}")
+                    self.bucket.pause(e.retry_after)
+                except (TelegramServerError, TelegramNetworkError) as e:
+                    logger.warning(f"Временная ошибка при отправке в {chat_id}: {e}")
+                    await asyncio.sleep(min(2 ** attempt, 30))
+                except (TelegramForbiddenError, TelegramBadRequest) as e:
+                    # Пользователь заблокировал бота или чат недоступен - не повторяем
+                    logger.info(f"Сообщение в {chat_id} не доставлено: {e}")
+                    break
+                stats.retries += 1
+
+            stats.failed += 1
+            return False
+        finally:
+            slots.release()
+
+    async def _load_checkpoint(self, broadcast_key: str, webinar_id: int):
+        async with async_session() as session:
+            await session.execute(
+                insert(Broadcast)
+                .values(broadcast_key=broadcast_key, webinar_id=webinar_id)
+                .on_conflict_do_nothing(index_elements=['broadcast_key'])
+            )
+            result = await session.execute(
+                select(Broadcast).where(Broadcast.broadcast_key == broadcast_key)
+            )
+            checkpoint = result.scalar_one()
+            await session.commit()
+        return checkpoint
+
+    async def _save_checkpoint(self, broadcast_key: str, last_user_id: int,
+                               sent: int, failed: int, done: bool = False):
+        values = {
+            'last_user_id': last_user_id,
+            'sent_count': Broadcast.sent_count + sent,
+            'failed_count': Broadcast.failed_count + failed,
+        }
+        if done:
+            values['status'] = 'done'
+        async with async_session() as session:
+            await session.execute(
+                update(Broadcast)
+                .where(Broadcast.broadcast_key == broadcast_key)
+                .values(**values)
+            )
+            await session.commit()
+
+    async def run(self, bot: Bot, recipients, text: str, broadcast_key: str = None,
+                  webinar_id: int = None, **send_kwargs) -> BroadcastStats:
+        """
+        Выполняет рассылку.
+
+        Args:
+            bot: Экземпляр бота (или любой объект с методом send_message)
+            recipients: Источник получателей (см. webinar_attendees)
+            text: Текст сообщения
+            broadcast_key: Ключ рассылки для контрольных точек; без ключа
+                прогресс не сохраняется
+            webinar_id: ID вебинара (для истории рассылок)
+            **send_kwargs: Дополнительные параметры send_message
+
+        Returns:
+            Статистика рассылки
+        """
+        stats = BroadcastStats()
+        last_user_id = 0
+
+        if broadcast_key:
+            checkpoint = await self._load_checkpoint(broadcast_key, webinar_id)
+            if checkpoint.status == 'done':
+                logger.info(f"Рассылка {broadcast_key} уже завершена, пропускаем")
+                return stats
+            last_user_id = checkpoint.last_user_id
+            if last_user_id:
+                logger.info(f"Рассылка {broadcast_key} продолжается после users.id={last_user_id}")
+
+        slots = asyncio.Semaphore(self.concurrency)
+        started = time.monotonic()
+        # Отправки в порядке users.id: (users.id, задача)
+        in_flight = deque()
+        # Завершенные подряд отправки и то, что из них уже в контрольной точке
+        sent = failed = 0
+        saved_user_id, saved_sent, saved_failed = last_user_id, 0, 0
+        finished = False
+        progress = asyncio.Event()
+        save_lock = asyncio.Lock()
+
+        def advance(_=None):
+            """Продвигает позицию по завершенным подряд отправкам."""
+            nonlocal last_user_id, sent, failed
+            while in_flight and in_flight[0][1].done():
+                task = in_flight[0][1]
+                if task.cancelled() or task.exception() is not None:
+                    # Прерванная отправка будет выполнена при продолжении
+                    break
+                user_id, _ = in_flight.popleft()
+                if task.result():
+                    sent += 1
+                else:
+                    failed += 1
+                last_user_id = user_id
+                progress.set()
+
+        async def save_progress(done: bool = False):
+            nonlocal saved_user_id, saved_sent, saved_failed
+            if not broadcast_key:
+                return
+            async with save_lock:
+                if last_user_id == saved_user_id and not done:
+                    return
+                position, position_sent, position_failed = last_user_id, sent, failed
+                await self._save_checkpoint(
+                    broadcast_key, position,
+                    position_sent - saved_sent, position_failed - saved_failed,
+                    done=done
+                )
+                saved_user_id, saved_sent, saved_failed = position, position_sent, position_failed
+
+        async def save_periodically():
+            while True:
+                await progress.wait()
+                progress.clear()
+                try:
+                    await save_progress()
+                except Exception as e:
+                    logger.error(f"Не удалось сохранить прогресс рассылки {broadcast_key}: {e}")
+
+        saver = asyncio.create_task(save_periodically())
+        try:
+            # Отправки рассылки идут в массовой полосе сессии бота и не задерживают ответы пользователям
+            with bulk_lane():
+                async for user_id, chat_id in recipients(last_user_id):
+                    await slots.acquire()
+                    task = asyncio.create_task(
+                        self._send(bot, chat_id, text, stats, slots, send_kwargs)
+                    )
+                    in_flight.append((user_id, task))
+                    task.add_done_callback(advance)
+                await asyncio.gather(*(task for _, task in in_flight))
+            finished = True
+        finally:
+            saver.cancel()
+            tasks = [task for _, task in in_flight]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(saver, *tasks, return_exceptions=True)
+            advance()
+            # Позиция сохраняется и при отмене рассылки
+            await asyncio.shield(save_progress(done=finished))
+
+        stats.elapsed = time.monotonic() - started
+        logger.info(
+            f"Рассылка {broadcast_key or ''} завершена: отправлено {stats.sent}, "
+            f"ошибок {stats.failed}, повторов {stats.retries}, {stats.rate:.1f} сообщ./с"
+        )
+        return stats
+
+
+broadcast_engine = BroadcastEngine(
+    rate=float(os.getenv('BROADCAST_RATE', '25')),
+    per_chat_interval=float(os.getenv('BROADCAST_PER_CHAT_INTERVAL', '1.0')),
+    concurrency=int(os.getenv('BROADCAST_CONCURRENCY', '20')),
+)
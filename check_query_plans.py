@@ -0,0 +1,391 @@
+"""
+Проверка планов горячих запросов на большом наборе данных.
+
+Скрипт создает отдельную схему (по умолчанию query_plan_check), применяет к
+ней версионные миграции (migrate.py), заполняет таблицы сгенерированными
+данными и выполняет настоящий код бота: обновления воронки и админских
+команд подаются в dp.feed_update из main.py (Bot API заменен заглушкой,
+ЮКасса - FakePaymentGateway), а планировщик, рассылки, кэш курса, рейтинг и
+сверка балансов вызываются напрямую. Все SQL-запросы, выполненные этим
+кодом, перехватываются вместе с параметрами, и для каждого выполняется
+EXPLAIN. Поэтому проверяются именно те запросы, которые выполняет бот, а
+новый запрос попадает в проверку без правки скрипта.
+
+Если какой-либо запрос читает последовательным сканом (Seq Scan) таблицу
+из --min-rows строк и больше, скрипт завершается с кодом 1. Маленькие
+служебные таблицы (ledger_reconcile_state и т.п.) Postgres законно читает
+целиком. Ошибка в сценарии тоже считается провалом. Схема удаляется после
+проверки.
+
+Скрипт печатает JSON: для каждого запроса - текст, сценарии и обработчики,
+которые его выполнили, узлы плана и таблицы, прочитанные последовательным
+сканом.
+
+Пример:
+    python check_query_plans.py --users 200000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+from contextvars import ContextVar
+from datetime import datetime
+
+# Модули бота читают настройки при импорте
+os.environ.setdefault('BOT_TOKEN', '123456:QUERYPLAN')
+os.environ.setdefault('VIDEO_FILE_ID', 'query-plan-video')
+# Журнал монет пишется сразу, иначе его запросы не выполнятся во время проверки
+os.environ['LEDGER_WRITE_BEHIND'] = '0'
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.types import CallbackQuery, Chat, Message, Update
+from aiogram.types import User as TelegramUser
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from database import DATABASE_URL, async_session, current_handler, engine as app_engine
+from migrate import MigrationRunner
+
+TELEGRAM_ID_BASE = 1_000_000_000
+
+# Заполнение схемы; :users задает масштаб, остальные таблицы пропорциональны
+SEED_STATEMENTS = [
+    """
+    INSERT INTO users (telegram_id, user_name, start_time, direction, ai_coins_balance)
+    SELECT :telegram_id_base + g, 'user_' || g, now() - g * interval '1 minute',
+           CASE WHEN g % 2 = 0 THEN 'personal' ELSE 'business' END, g % 1000
+    FROM generate_series(1, :users) AS g
+    """,
+    # Почти все вебинары в прошлом, три предстоящих
+    """
+    INSERT INTO webinars (webinar_date, topic)
+    SELECT CASE WHEN g <= 3 THEN now() + g * interval '1 day'
+                ELSE now() - g * interval '1 hour' END,
+           'Вебинар ' || g
+    FROM generate_series(1, :users / 10) AS g
+    """,
+    """
+    INSERT INTO webinar_registrations (user_id, webinar_id)
+    SELECT g, 1 + (g * k) % (:users / 10)
+    FROM generate_series(1, :users) AS g, generate_series(1, 2) AS k
+    ON CONFLICT DO NOTHING
+    """,
+    # Половина курсов активна, но предстоящих только два
+    """
+    INSERT INTO courses (course_name, start_date, price, is_active, created_at)
+    SELECT 'Курс ' || g,
+           CASE WHEN g <= 2 THEN now() + g * interval '1 day'
+                ELSE now() - g * interval '1 day' END,
+           1000, g % 2 = 0 OR g <= 2, now()
+    FROM generate_series(1, :users / 100) AS g
+    """,
+    """
+    INSERT INTO course_registrations (user_id, course_id, registration_date)
+    SELECT g, 1 + g % (:users / 100), now()
+    FROM generate_series(1, :users) AS g
+    """,
+    """
+    INSERT INTO payments (user_id, course_id, payment_id, amount, currency, status, created_at)
+    SELECT g, 1 + g % (:users / 100), 'plan-check-' || g, 1000, 'RUB',
+           (ARRAY['pending', 'succeeded', 'canceled', 'failed'])[1 + g % 4]::payment_status,
+           now() - g * interval '1 minute'
+    FROM generate_series(1, :users) AS g
+    """,
+    """
+    INSERT INTO ai_coin_operations (user_id, amount, operation_type, reason, created_at)
+    SELECT 1 + g % :users,
+           CASE WHEN g % 5 = 0 THEN -10 ELSE 50 END,
+           (CASE WHEN g % 5 = 0 THEN 'spent' ELSE 'earned' END)::coin_operation_type,
+           'генерация', now() - g * interval '1 second'
+    FROM generate_series(1, :users * 5) AS g
+    """,
+    # Выполненные задания и немного ожидающих
+    """
+    INSERT INTO scheduled_jobs (job_type, dedup_key, run_at, status, attempts, created_at)
+    SELECT 'webinar_reminder_1h', 'plan-check-' || g,
+           now() - g * interval '1 minute',
+           CASE WHEN g <= 10 THEN 'pending' ELSE 'done' END, 1, now()
+    FROM generate_series(1, :users / 2) AS g
+    """,
+    """
+    INSERT INTO broadcasts (broadcast_key, status, last_user_id, sent_count, failed_count,
+                            created_at, updated_at)
+    SELECT 'plan-check-' || g, 'done', 0, 0, 0, now(), now()
+    FROM generate_series(1, :users / 100) AS g
+    """,
+]
+
+
+# Сценарий, запросы которого сейчас перехватываются
+current_scenario: ContextVar[str] = ContextVar('current_scenario', default=None)
+
+# Запросы, для которых строится план
+_EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+
+class StubSession(BaseSession):
+    """Заглушка Bot API: отвечает True без сетевых запросов."""
+
+    async def make_request(self, bot, method, timeout=None):
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536,
+                             raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+class StatementCapture:
+    """Запоминает SQL-запросы движка, выполненные внутри сценариев."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = {}  # текст -> {'parameters', 'scenarios', 'handlers'}
+
+    def _capture(self, conn, cursor, statement, parameters, context, executemany):
+        scenario = current_scenario.get()
+        if scenario is None or executemany:
+            return
+        if not statement.lstrip().upper().startswith(_EXPLAINABLE):
+            return
+        entry = self.statements.setdefault(statement, {
+            'parameters': parameters, 'scenarios': set(), 'handlers': set(),
+        })
+        entry['scenarios'].add(scenario)
+        entry['handlers'].add(current_handler.get())
+
+    def __enter__(self):
+        event.listen(self.engine.sync_engine, 'before_cursor_execute', self._capture)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine.sync_engine, 'before_cursor_execute', self._capture)
+
+
+class Updates:
+    """Строит обновления Telegram, привязанные к боту."""
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self._ids = iter(range(1, 10 ** 9))
+
+    def _user(self, telegram_id: int) -> TelegramUser:
+        return TelegramUser(id=telegram_id, is_bot=False, first_name='Plan',
+                            username=f"plan_{telegram_id}")
+
+    def _message(self, telegram_id: int, text: str = None) -> Message:
+        return Message(
+            message_id=next(self._ids), date=datetime.now(),
+            chat=Chat(id=telegram_id, type='private'),
+            from_user=self._user(telegram_id), text=text,
+        ).as_(self.bot)
+
+    def message(self, telegram_id: int, text: str) -> Update:
+        return Update(update_id=next(self._ids),
+                      message=self._message(telegram_id, text)).as_(self.bot)
+
+    def callback(self, telegram_id: int, data: str) -> Update:
+        return Update(
+            update_id=next(self._ids),
+            callback_query=CallbackQuery(
+                id=str(next(self._ids)), from_user=self._user(telegram_id),
+                chat_instance='plan', message=self._message(telegram_id), data=data,
+            ).as_(self.bot),
+        ).as_(self.bot)
+
+
+def scenarios(users: int) -> list:
+    """Пары (имя, фабрика корутины): код бота, чьи запросы проверяются."""
+    import main
+    from balance_reconciler import BalanceReconciler
+    from broadcast import broadcast_engine, webinar_attendees
+    from coin_service import add_coins, get_balance
+    from course_offer import course_offer_cache
+    from handlers import enroll_course
+    from leaderboard import Leaderboard
+    from payment_gateway import FakePaymentGateway
+    from scheduler import JobScheduler, schedule_upcoming_reminders
+    from webinar_schedule import webinar_schedule
+
+    telegram_id = TELEGRAM_ID_BASE + users // 2
+    new_telegram_id = TELEGRAM_ID_BASE + users + 1
+    webinar_id = 1  # Предстоящий вебинар из SEED_STATEMENTS
+    bot = Bot(token=os.environ['BOT_TOKEN'], session=StubSession())
+    updates = Updates(bot)
+    enroll_course.payment_gateway = FakePaymentGateway()
+
+    def feed(update):
+        return lambda: main.dp.feed_update(bot, update)
+
+    async def broadcast_recipients():
+        async for _ in webinar_attendees(webinar_id)(0):
+            pass
+
+    async def job_scheduler():
+        scheduler = JobScheduler()
+        await scheduler._claim()
+        await scheduler._seconds_until_next()
+
+    def reconciler():
+        return BalanceReconciler(enabled=True, max_batches=1).run_once()
+
+    def leaderboard_refresh():
+        return Leaderboard(enabled=True).refresh()
+
+    def course_offer():
+        course_offer_cache.invalidate()
+        return course_offer_cache.get()
+
+    return [
+        ('webinar_schedule', webinar_schedule.refresh),
+        ('course_offer', course_offer),
+        ('start_new_user', feed(updates.message(new_telegram_id, '/start'))),
+        ('start', feed(updates.message(telegram_id, '/start'))),
+        ('direction', feed(updates.callback(telegram_id, 'direction_personal'))),
+        ('register', feed(updates.callback(telegram_id, 'register'))),
+        ('confirm_registration',
+         feed(updates.callback(new_telegram_id, f"confirm_registration_{webinar_id}"))),
+        ('confirm_registration_again',
+         feed(updates.callback(new_telegram_id, f"confirm_registration_{webinar_id}"))),
+        ('enroll_course', feed(updates.callback(telegram_id, 'enroll_course'))),
+        ('purchase_course', feed(updates.callback(telegram_id, 'purchase_course'))),
+        ('user_stats', feed(updates.message(telegram_id, f"/user_stats {telegram_id}"))),
+        ('add_coins', lambda: add_coins(telegram_id, 50, 'проверка планов')),
+        ('get_balance', lambda: get_balance(telegram_id)),
+        ('broadcast_recipients', broadcast_recipients),
+        ('broadcast_checkpoint', lambda: broadcast_engine._load_checkpoint('plan-check-1', webinar_id)),
+        ('schedule_reminders', schedule_upcoming_reminders),
+        ('job_scheduler', job_scheduler),
+        ('balance_reconciler', reconciler),
+        ('leaderboard_refresh', leaderboard_refresh),
+    ]
+
+
+def plan_nodes(plan: dict):
+    """Обходит узлы плана EXPLAIN (FORMAT JSON)."""
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+async def explain(conn, statement: str, parameters) -> dict:
+    if isinstance(parameters, list):
+        parameters = tuple(parameters)
+    result = await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters or ())
+    plan = result.scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+
+async def check(users: int, schema: str, min_rows: int = 1000, keep_schema: bool = False) -> dict:
+    """Заполняет схему, выполняет сценарии и возвращает отчет по планам запросов."""
+    engine = create_async_engine(
+        DATABASE_URL,
+        poolclass=NullPool,
+        connect_args={'server_settings': {'search_path': schema}},
+    )
+    errors = {}
+    report = {}
+    try:
+        async with engine.begin() as conn:
+            await conn.exec_driver_sql(f'DROP SCHEMA IF EXISTS "{schema}" CASCADE')
+            await conn.exec_driver_sql(f'CREATE SCHEMA "{schema}"')
+
+        await MigrationRunner(engine).upgrade()
+
+        async with engine.begin() as conn:
+            params = {'users': users, 'telegram_id_base': TELEGRAM_ID_BASE}
+            for statement in SEED_STATEMENTS:
+                await conn.execute(text(statement), params)
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+            await conn.exec_driver_sql('ANALYZE')
+
+        # Код бота работает с проверяемой схемой
+        async_session.configure(bind=engine)
+        try:
+            with StatementCapture(engine) as capture:
+                for name, scenario in scenarios(users):
+                    token = current_scenario.set(name)
+                    try:
+                        await scenario()
+                    except Exception as e:
+                        errors[name] = f"{type(e).__name__}: {e}"
+                    finally:
+                        current_scenario.reset(token)
+        finally:
+            async_session.configure(bind=app_engine)
+
+        async with engine.connect() as conn:
+            result = await conn.execute(
+                text(
+                    "SELECT relname, reltuples FROM pg_class "
+                    "WHERE relnamespace = to_regnamespace(:schema) AND relkind = 'r'"
+                ),
+                {'schema': schema}
+            )
+            table_rows = {row.relname: row.reltuples for row in result}
+
+            for number, (statement, entry) in enumerate(capture.statements.items(), 1):
+                try:
+                    plan = await explain(conn, statement, entry['parameters'])
+                except Exception as e:
+                    errors[f"explain #{number}"] = f"{type(e).__name__}: {e}"
+                    await conn.rollback()
+                    continue
+                nodes = list(plan_nodes(plan))
+                seq_scans = sorted({
+                    node['Relation Name'] for node in nodes if node['Node Type'] == 'Seq Scan'
+                })
+                report[f"#{number}"] = {
+                    'scenarios': sorted(entry['scenarios']),
+                    'handlers': sorted(entry['handlers']),
+                    'sql': ' '.join(statement.split()),
+                    'total_cost': plan['Total Cost'],
+                    'nodes': [
+                        f"{node['Node Type']} {node.get('Index Name') or node.get('Relation Name') or ''}".strip()
+                        for node in nodes
+                    ],
+                    'seq_scans': seq_scans,
+                    'large_seq_scans': [
+                        table for table in seq_scans if table_rows.get(table, 0) >= min_rows
+                    ],
+                }
+            await conn.rollback()
+    finally:
+        if not keep_schema:
+            async with engine.begin() as conn:
+                await conn.exec_driver_sql(f'DROP SCHEMA IF EXISTS "{schema}" CASCADE')
+        await engine.dispose()
+
+    return {
+        'users': users,
+        'queries': report,
+        'errors': errors,
+        'failed': [name for name, query in report.items() if query['large_seq_scans']],
+    }
+
+
+async def run_check(args):
+    result = await check(args.users, args.schema, args.min_rows, args.keep_schema)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if result['failed'] or result['errors']:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Проверка планов горячих запросов")
+    parser.add_argument('--users', type=int, default=200_000,
+                        help="Число пользователей; остальные таблицы заполняются пропорционально")
+    parser.add_argument('--schema', default='query_plan_check')
+    parser.add_argument('--min-rows', type=int, default=1000,
+                        help="Seq Scan по таблицам меньшего размера допустим")
+    parser.add_argument('--keep-schema', action='store_true',
+                        help="Не удалять схему после проверки")
+    asyncio.run(run_check(parser.parse_args()))
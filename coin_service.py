@@ -2,126 +2,340 @@
 Сервис для управления AI монетами пользователей
 """
 
+from contextlib import asynccontextmanager
+from datetime import datetime
+
 from sqlalchemy.orm import selectinload
-from sqlalchemy import select
+from sqlalchemy import (
+    BigInteger, Integer, String, Text, column, func, literal, select, update, values
+)
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from database import async_session
 from models import User, AICoinOperation
+from ledger_writer import enqueue_on_commit, ledger_writer
+from balance_cache import balance_cache, fill_on_commit, set_on_commit
+from leaderboard import update_on_commit
+
+
+@asynccontextmanager
+async def _session_scope(session: AsyncSession = None):
+    """
+    Использует переданную сессию (фиксация за вызывающим кодом)
+    или открывает собственную и фиксирует ее при выходе.
+    """
+    if session is not None:
+        yield session
+        return
+
+    async with async_session() as own_session:
+        yield own_session
+        await own_session.commit()
+
+
+def _ledger_statement(telegram_id: int, delta: int, operation_type: str,
+                      reason: str, description: str = None, *guards):
+    """
+    Строит атомарную операцию с балансом в виде одного запроса с CTE.
+
+    UPDATE баланса (с дополнительными условиями guards) и INSERT записи
+    в ai_coin_operations выполняются одним запросом: если UPDATE не затронул
+    ни одной строки, операция не записывается и запрос возвращает пустой
+    результат.
+
+    Returns:
+        SELECT, возвращающий новый баланс пользователя
+    """
+    updated_user = (
+        update(User)
+        .where(User.telegram_id == telegram_id, *guards)
+        .values(ai_coins_balance=User.ai_coins_balance + delta)
+        .returning(User.id, User.ai_coins_balance)
+        .cte('updated_user')
+    )
+    coin_operation = (
+        insert(AICoinOperation)
+        .from_select(
+            ['user_id', 'amount', 'operation_type', 'reason', 'description'],
+            select(
+                updated_user.c.id,
+                literal(delta, Integer),
+                literal(operation_type, AICoinOperation.operation_type.type),
+                literal(reason, String),
+                literal(description, Text),
+            )
+        )
+        .cte('coin_operation')
+    )
+    return select(updated_user.c.ai_coins_balance).add_cte(coin_operation)
 
 
-async def add_coins(telegram_id: int, amount: int, reason: str, description: str = None) -> int:
+async def _apply_coin_operation(session: AsyncSession, telegram_id: int, delta: int,
+                                operation_type: str, reason: str,
+                                description: str = None, *guards):
+    """
+    Изменяет баланс и записывает операцию в рамках переданной сессии.
+
+    При включенном write-behind (ledger_writer) синхронно выполняется только
+    UPDATE баланса, а запись операции ставится в очередь после COMMIT.
+    Кэш балансов и рейтинг обновляются после COMMIT.
+
+    Returns:
+        Новый баланс или None, если UPDATE не затронул ни одной строки
+    """
+    if not ledger_writer.enabled:
+        result = await session.execute(
+            _ledger_statement(telegram_id, delta, operation_type, reason, description, *guards)
+        )
+        new_balance = result.scalar_one_or_none()
+        if new_balance is not None:
+            set_on_commit(session, telegram_id, new_balance)
+            update_on_commit(session, telegram_id, new_balance)
+        return new_balance
+
+    result = await session.execute(
+        update(User)
+        .where(User.telegram_id == telegram_id, *guards)
+        .values(ai_coins_balance=User.ai_coins_balance + delta)
+        .returning(User.id, User.ai_coins_balance)
+    )
+    row = result.first()
+    if not row:
+        return None
+
+    enqueue_on_commit(session, {
+        'user_id': row.id,
+        'amount': delta,
+        'operation_type': operation_type,
+        'reason': reason,
+        'description': description,
+        'created_at': datetime.now(),
+    })
+    set_on_commit(session, telegram_id, row.ai_coins_balance)
+    update_on_commit(session, telegram_id, row.ai_coins_balance)
+    return row.ai_coins_balance
+
+
+async def add_coins(telegram_id: int, amount: int, reason: str, description: str = None,
+                    session: AsyncSession = None) -> int:
     """
     Начисляет монеты пользователю и создает запись об операции.
 
+    Баланс увеличивается на стороне БД (ai_coins_balance + amount), поэтому
+    параллельные начисления не теряют обновления.
+
     Args:
         telegram_id: ID пользователя в Telegram
         amount: Количество монет для начисления (должно быть положительным)
         reason: Причина начисления (например: "регистрация", "выбор направления" и т.д.)
         description: Полное описание операции (опционально)
+        session: Сессия текущего обновления (опционально, фиксирует вызывающий код)
 
     Returns:
         Новый баланс пользователя
     """
     amount = abs(amount)  # Убеждаемся, что это положительное число
 
-    async with async_session() as session:
-        # Находим пользователя
-        user_result = await session.execute(
-            select(User).where(User.telegram_id == telegram_id)
+    async with _session_scope(session) as scoped_session:
+        new_balance = await _apply_coin_operation(
+            scoped_session, telegram_id, amount, 'earned', reason, description
         )
-        user = user_result.scalar_one_or_none()
 
-        if not user:
-            return 0
+    # Пользователь не найден
+    if new_balance is None:
+        return 0
 
-        # Обновляем баланс
-        user.ai_coins_balance += amount
+    return new_balance
+
+
+async def add_coins_many(awards: list, session: AsyncSession = None) -> dict:
+    """
+    Массово начисляет монеты одним запросом.
 
-        # Создаем запись об операции
-        coin_operation = AICoinOperation(
-            user_id=user.id,
-            amount=amount,
-            operation_type='earned',
-            reason=reason,
-            description=description
+    Начисления одного пользователя суммируются, для каждого начисления
+    создается отдельная запись в ai_coin_operations.
+
+    Args:
+        awards: Список кортежей (telegram_id, amount, reason)
+        session: Сессия текущего обновления (опционально, фиксирует вызывающий код)
+
+    Returns:
+        Словарь {telegram_id: новый баланс} для найденных пользователей
+    """
+    if not awards:
+        return {}
+
+    award_rows = values(
+        column('telegram_id', BigInteger),
+        column('amount', Integer),
+        column('reason', String),
+        name='awards'
+    ).data([
+        (telegram_id, abs(amount), reason)
+        for telegram_id, amount, reason in awards
+    ]).cte('awards')
+
+    totals = (
+        select(
+            award_rows.c.telegram_id,
+            func.sum(award_rows.c.amount).label('total')
+        )
+        .group_by(award_rows.c.telegram_id)
+        .cte('totals')
+    )
+    updated_users = (
+        update(User)
+        .where(User.telegram_id == totals.c.telegram_id)
+        .values(ai_coins_balance=User.ai_coins_balance + totals.c.total)
+        .returning(User.id, User.telegram_id, User.ai_coins_balance)
+        .cte('updated_users')
+    )
+    coin_operations = (
+        insert(AICoinOperation)
+        .from_select(
+            ['user_id', 'amount', 'operation_type', 'reason'],
+            select(
+                updated_users.c.id,
+                award_rows.c.amount,
+                literal('earned', AICoinOperation.operation_type.type),
+                award_rows.c.reason,
+            ).join_from(
+                award_rows,
+                updated_users,
+                updated_users.c.telegram_id == award_rows.c.telegram_id
+            )
         )
-        session.add(coin_operation)
+        .cte('coin_operations')
+    )
+    stmt = select(
+        updated_users.c.telegram_id,
+        updated_users.c.ai_coins_balance
+    ).add_cte(coin_operations)
 
-        # Сохраняем изменения
-        await session.commit()
-        await session.refresh(user)
+    async with _session_scope(session) as scoped_session:
+        result = await scoped_session.execute(stmt)
+        balances = {row.telegram_id: row.ai_coins_balance for row in result}
+        for telegram_id, balance in balances.items():
+            set_on_commit(scoped_session, telegram_id, balance)
+            update_on_commit(scoped_session, telegram_id, balance)
 
-        return user.ai_coins_balance
+    return balances
 
 
-async def subtract_coins(telegram_id: int, amount: int, reason: str, description: str = None) -> int:
+async def subtract_coins(telegram_id: int, amount: int, reason: str, description: str = None,
+                         session: AsyncSession = None) -> int:
     """
     Списывает монеты у пользователя и создает запись об операции.
 
+    Списание выполняется условным UPDATE (ai_coins_balance >= amount),
+    поэтому баланс не может уйти в минус при параллельных списаниях.
+
     Args:
         telegram_id: ID пользователя в Telegram
         amount: Количество монет для списания (должно быть положительным)
         reason: Причина списания
         description: Полное описание операции (опционально)
+        session: Сессия текущего обновления (опционально, фиксирует вызывающий код)
 
     Returns:
         Новый баланс пользователя (или -1 если недостаточно монет)
     """
     amount = abs(amount)  # Убеждаемся, что это положительное число
 
-    async with async_session() as session:
-        # Находим пользователя
-        user_result = await session.execute(
-            select(User).where(User.telegram_id == telegram_id)
-        )
-        user = user_result.scalar_one_or_none()
-
-        if not user:
-            return -1
-
-        # Проверяем достаточность монет
-        if user.ai_coins_balance < amount:
-            return -1
-
-        # Обновляем баланс
-        user.ai_coins_balance -= amount
-
-        # Создаем запись об операции
-        coin_operation = AICoinOperation(
-            user_id=user.id,
-            amount=-amount,
-            operation_type='spent',
-            reason=reason,
-            description=description
+    async with _session_scope(session) as scoped_session:
+        new_balance = await _apply_coin_operation(
+            scoped_session, telegram_id, -amount, 'spent', reason, description,
+            User.ai_coins_balance >= amount
         )
-        session.add(coin_operation)
 
-        # Сохраняем изменения
-        await session.commit()
-        await session.refresh(user)
+    # Пользователь не найден или недостаточно монет
+    if new_balance is None:
+        return -1
 
-        return user.ai_coins_balance
+    return new_balance
 
 
-async def get_balance(telegram_id: int) -> int:
+async def get_balance(telegram_id: int, session: AsyncSession = None) -> int:
     """
     Получает текущий баланс монет пользователя.
 
+    Сначала проверяется кэш балансов, при промахе из БД читается
+    только колонка ai_coins_balance.
+
     Args:
         telegram_id: ID пользователя в Telegram
+        session: Сессия текущего обновления (опционально)
 
     Returns:
         Количество монет на счете
     """
-    async with async_session() as session:
-        user_result = await session.execute(
-            select(User).where(User.telegram_id == telegram_id)
+    cached_balance = balance_cache.get(telegram_id)
+    if cached_balance is not None:
+        return cached_balance
+
+    # Изменение баланса во время чтения не даст положить в кэш старое значение
+    token = balance_cache.read_token()
+    async with _session_scope(session) as scoped_session:
+        balance_result = await scoped_session.execute(
+            select(User.ai_coins_balance).where(User.telegram_id == telegram_id)
         )
-        user = user_result.scalar_one_or_none()
+        balance = balance_result.scalar_one_or_none()
+
+    if balance is None:
+        return 0
+
+    if session is not None:
+        # В чужой транзакции баланс мог еще не зафиксироваться
+        fill_on_commit(session, telegram_id, balance, token)
+    else:
+        balance_cache.fill(telegram_id, balance, token)
+    return balance
+
+
+async def grant_first_visit_bonus(
+    session: AsyncSession,
+    telegram_id: int,
+    user_name: str,
+    amount: int,
+    reason: str,
+    description: str = None
+) -> int:
+    """
+    Создает пользователя (если его нет) и начисляет бонус за первый вход.
 
-        if not user:
-            return 0
+    Все запросы выполняются в переданной сессии, фиксация транзакции
+    остается за вызывающим кодом. Выполняется ровно два запроса: upsert
+    пользователя и условное начисление бонуса вместе с записью операции
+    (только при нулевом балансе). Баланс уже известного пользователя
+    не читается - при необходимости его дает get_balance (из кэша).
 
-        return user.ai_coins_balance
+    Args:
+        session: Открытая сессия базы данных
+        telegram_id: ID пользователя в Telegram
+        user_name: Username пользователя в Telegram
+        amount: Размер бонуса
+        reason: Причина начисления
+        description: Полное описание операции (опционально)
+
+    Returns:
+        Баланс после начисления бонуса или None, если бонус уже был начислен
+    """
+    amount = abs(amount)
+
+    # 1. Убеждаемся, что пользователь существует
+    await session.execute(
+        insert(User).values(
+            telegram_id=telegram_id,
+            user_name=user_name
+        ).on_conflict_do_nothing(index_elements=['telegram_id'])
+    )
+
+    # 2. Начисляем бонус и записываем операцию, только если баланс еще нулевой
+    # (вход считается новым)
+    return await _apply_coin_operation(
+        session, telegram_id, amount, 'earned', reason, description,
+        User.ai_coins_balance == 0
+    )
 
 
 async def get_user_with_coins(telegram_id: int):
@@ -0,0 +1,204 @@
+"""
+Реестр готового контента воронки.
+
+Пакеты направлений (параметры видео, текст и клавиатура) и постоянные
+клавиатуры собираются один раз при старте бота и хранятся в неизменяемом
+виде, поэтому обработчики не читают переменные окружения и не собирают
+разметку на каждый клик. После изменения .env контент перечитывается
+командой /reload_content.
+"""
+
+import logging
+import os
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from dotenv import load_dotenv
+
+from keyboards import _get_additional_buttons
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Бонус за выбор направления
+DIRECTION_BONUS = 50
+
+PERSONAL_TEXT = """🤯 Круто, да?
+Пока мой цифровой аватар общался с тобой, я пил кофе или занимался стратегией.
+
+<b>Именно так выглядит личная эффективность с ИИ.</b> Ты перестаешь быть «белкой в колесе» и становишься архитектором своей жизни.
+
+🔥 <b>На вебинаре за 1 час ты научишься:</b>
+✅ Писать письма и отчеты за секунды (вместо часов мучений).
+✅ Делать презентации и картинки, не будучи дизайнером.
+✅ Учиться новому в 10 раз быстрее с персональным ИИ-ментором.
+
+🎁 <b>Твой подарок уже ждет!</b> Я открываю тебе доступ в закрытый канал, где уже лежит база лучших нейросетей и инструкции.
+
+👇 <b>Жми кнопку, чтобы забрать доступ и закрепить за собой место на эфире!</b>
+"""
+
+BUSINESS_TEXT = """🤯 Впечатляет, правда?
+Только что с тобой говорил не я, а мой цифровой двойник. Поздравляю! Твой баланс: 150 AI-Coins 🪙
+
+<b>Представь, что так же автономно работает ТВОЙ бизнес</b>
+
+💰 Реальные цифры моих клиентов:
+Кофейня: Чат-бот принимает заказы ➡️ +30% к выручке
+Салон красоты: Автозапись клиентов ➡️ минус 2 часа рутины
+Ритейл: ИИ генерит контент ➡️ охваты ×3.
+
+🎁 <b>Твой подарок (База нейросетей) уже ждет. Но сначала - давай закрепим твое место, чтобы система не аннулировала монет</b>
+
+👇 Жми кнопку ниже.
+"""
+
+VIDEO_NOT_FOUND_TEXT = (
+    "Ошибка: ID видео не найден. Пожалуйста, убедитесь, "
+    "что VIDEO_FILE_ID установлен в файле .env"
+)
+
+
+@dataclass(frozen=True)
+class DirectionPack:
+    """Готовый ответ на выбор направления."""
+
+    direction: str          # Значение users.direction
+    bonus_description: str
+    video: MappingProxyType  # Аргументы answer_video или None, если видео не задано
+    text: str
+    keyboard: InlineKeyboardMarkup
+
+
+@dataclass(frozen=True)
+class ContentPacks:
+    """Снимок всего контента (заменяется целиком при перезагрузке)."""
+
+    directions: MappingProxyType  # callback_data -> DirectionPack
+    start_keyboard: InlineKeyboardMarkup
+    member_rows: tuple  # Ряды кнопок для зарегистрированных участников
+    member_keyboard: InlineKeyboardMarkup
+
+
+def _load_video() -> MappingProxyType:
+    """Читает параметры видео из окружения один раз."""
+    video_file_id = os.getenv('VIDEO_FILE_ID')
+    if not video_file_id:
+        return None
+
+    # Отправка видео с максимальными параметрами для сохранения качества
+    video = {'video': video_file_id, 'supports_streaming': True}
+    video_width = os.getenv('VIDEO_WIDTH')
+    video_height = os.getenv('VIDEO_HEIGHT')
+    video_duration = os.getenv('VIDEO_DURATION')
+    if video_width and video_height:
+        video['width'] = int(video_width)
+        video['height'] = int(video_height)
+        if video_duration:
+            video['duration'] = int(video_duration)
+    return MappingProxyType(video)
+
+
+def _build_packs() -> ContentPacks:
+    video = _load_video()
+    register_keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="➡️ ЗАБРАТЬ ПОДАРОК И ЗАПИСАТЬСЯ",
+                    callback_data="register",
+                )
+            ]
+        ]
+    )
+    directions = {
+        'direction_personal': DirectionPack(
+            direction='personal',
+            bonus_description="Бонус за выбор личного направления (personal)",
+            video=video,
+            text=PERSONAL_TEXT,
+            keyboard=register_keyboard,
+        ),
+        'direction_business': DirectionPack(
+            direction='business',
+            bonus_description="Бонус за выбор бизнес направления (business)",
+            video=video,
+            text=BUSINESS_TEXT,
+            keyboard=register_keyboard,
+        ),
+    }
+
+    start_keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="🧑‍💻 Для личной эффективности (+50 🪙)",
+                    callback_data="direction_personal",
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    text="💼 Для бизнеса и масштабирования (+50 🪙)",
+                    callback_data="direction_business",
+                )
+            ],
+        ]
+    )
+
+    member_rows = [[
+        InlineKeyboardButton(
+            text="🔐 Закрытая группа по ИИ",
+            url="https://t.me/+VxGcD_UbVJE5NTNi"
+        )
+    ]]
+    member_rows.extend(_get_additional_buttons())
+    member_rows.append([
+        InlineKeyboardButton(
+            text="ℹ️ Информация о спикере",
+            callback_data="speaker_info"
+        )
+    ])
+
+    return ContentPacks(
+        directions=MappingProxyType(directions),
+        start_keyboard=start_keyboard,
+        member_rows=tuple(tuple(row) for row in member_rows),
+        member_keyboard=InlineKeyboardMarkup(inline_keyboard=member_rows),
+    )
+
+
+class ContentRegistry:
+    """Доступ к текущему снимку контента."""
+
+    def __init__(self):
+        self._packs = _build_packs()
+
+    def direction(self, callback_data: str) -> DirectionPack:
+        """Возвращает пакет направления по callback_data кнопки."""
+        return self._packs.directions.get(callback_data)
+
+    @property
+    def start_keyboard(self) -> InlineKeyboardMarkup:
+        """Клавиатура выбора направления в приветствии /start."""
+        return self._packs.start_keyboard
+
+    def member_keyboard(self, webinar_link: str = None) -> InlineKeyboardMarkup:
+        """Клавиатура участника вебинара (со ссылкой на эфир, если она есть)."""
+        packs = self._packs
+        if not webinar_link:
+            return packs.member_keyboard
+        link_row = [InlineKeyboardButton(text="🎥 Ссылка на вебинар", url=webinar_link)]
+        return InlineKeyboardMarkup(
+            inline_keyboard=[link_row, *(list(row) for row in packs.member_rows)]
+        )
+
+    def reload(self):
+        """Перечитывает .env и пересобирает весь контент."""
+        load_dotenv(override=True)
+        # Снимок заменяется одним присваиванием, обработчики видят старый или новый целиком
+        self._packs = _build_packs()
+        logger.info("Контент воронки перезагружен")
+
+
+content_registry = ContentRegistry()
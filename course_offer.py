@@ -0,0 +1,176 @@
+"""
+Кэш предложения активного курса.
+
+Хранит снимок ближайшего активного курса вместе с заранее подготовленными
+подписью и клавиатурой, чтобы обработчики записи и покупки курса не ходили
+в БД и не собирали подпись на каждый клик. Снимок перестраивается после
+явной инвалидации (/reload_course) или по истечении TTL.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from dotenv import load_dotenv
+from sqlalchemy import select
+
+from database import async_session
+from models import Course
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+NO_COURSE_CAPTION = "Подробности об обучении позже..."
+
+
+@dataclass(frozen=True)
+class CourseOffer:
+    """Снимок предложения курса с готовой подписью и клавиатурой."""
+
+    course: Course  # Отсоединенный объект Course или None, если курса нет
+    caption: str
+    keyboard: InlineKeyboardMarkup
+    expires_at: float
+
+
+def _render_caption(course: Course) -> str:
+    """Формирует подпись к предложению курса."""
+    if not course:
+        return NO_COURSE_CAPTION
+
+    course_date = course.start_date.strftime('%d.%m.%Y')
+    course_time = course.start_date.strftime('%H:%M')
+    return (
+        f"🚀 Полный курс по ИИ\n"
+        f"📅 Дата старта: {course_date} в {course_time} МСК\n"
+        f"💰 Цена: {float(course.price):.2f} ₽\n\n"
+        f"Что вы получите:\n"
+        f"4 интенсивных вебинара по 1.5 часа в прямом эфире\n"
+        f"Каждый день — новый модуль с практическими навыками\n"
+        f"📚 Программа курса:\n"
+        f"День 1: Основы AI и умные чат-боты\n\n"
+        f"Что такое LLM и как они работают (простым языком)\n"
+        f"Топовые нейросети: Claude Sonnet, DeepSeek, Qwen, Perplexity\n"
+        f"Создание эффективных промптов для рабочих задач\n"
+        f"Чат-боты для автоматизации клиентской поддержки\n"
+        f"✅ Результат: экономия 5-10 часов в неделю\n\n"
+        f"День 2: AI для контента — изображения и видео\n\n"
+        f"Генерация изображений: Midjourney, DALL-E, Stable Diffusion, Flux\n"
+        f"Создание видео: Runway, Pika, Kling AI\n"
+        f"Контент для соцсетей, рекламы и презентаций\n"
+        f"✅ Результат: профессиональный контент без дизайнера\n\n"
+        f"День 3: 3D-аватары и виртуальные презентации\n\n"
+        f"Создание AI-аватаров для видео\n"
+        f"Виртуальные ассистенты и спикеры\n"
+        f"Применение в обучении, продажах и маркетинге\n"
+        f"✅ Результат: масштабирование личного бренда\n\n"
+        f"День 4: Автоматизация бизнес-процессов с N8N\n\n"
+        f"No-code автоматизация рабочих процессов\n"
+        f"Интеграция AI с CRM, почтой, мессенджерами\n"
+        f"Создание автоматических воронок\n"
+        f"✅ Результат: автоматизация до 70% рутины\n\n\n"
+        f"🎁 Бонусы участникам:\n"
+        f"✔️ Все записи вебинаров в личном кабинете\n"
+        f"✔️ Доступ в закрытую группу с дополнительными материалами\n"
+        f"✔️ Готовые шаблоны промптов и чек-листы\n"
+        f"✔️ Поддержка и ответы на вопросы в чате участников\n"
+        f"✔️ База знаний с инструкциями и кейсами\n\n"
+        f"⏰ Формат проведения:\n"
+        f"🔴 Прямые эфиры каждый будний день в течение недели\n"
+        f"📹 Время: 20:00 МСК (1.5 часа)\n"
+        f"🔄 Гибкий график: можете выбрать удобный поток каждую неделю\n\n"
+        f"👥 Для кого этот курс:\n\n"
+        f"Для специалистов — повышение личной эффективности\n"
+        f"Для владельцев бизнеса — автоматизация и масштабирование\n"
+        f"Для начинающих — с нуля до уверенного применения AI\n\n"
+        f"Никакого программирования! Только практические инструменты, которые работают уже сегодня.\n\n"
+        f"Цена курса: {float(course.price):.2f} ₽\n"
+        f"Старт ближайшего потока: {course_date}"
+    )
+
+
+def _render_keyboard() -> InlineKeyboardMarkup:
+    """Формирует клавиатуру предложения курса."""
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="💬 Получить консультацию и задать вопрос",
+                    url="https://t.me/LevinMSK"
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    text="💳 Получить доступ к курсу",
+                    callback_data="purchase_course"
+                )
+            ]
+        ]
+    )
+
+
+class CourseOfferCache:
+    """Кэш текущего предложения курса с TTL и явной инвалидацией."""
+
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self._offer = None
+        self._lock = asyncio.Lock()
+
+    def _is_fresh(self, offer: CourseOffer) -> bool:
+        if offer is None or offer.expires_at < time.monotonic():
+            return False
+        # Курс уже стартовал - нужно искать следующий
+        if offer.course and offer.course.start_date <= datetime.now():
+            return False
+        return True
+
+    async def get(self) -> CourseOffer:
+        """
+        Возвращает текущее предложение курса.
+
+        При устаревшем снимке курс перечитывается из БД одним запросом,
+        параллельные обработчики ждут этот же запрос.
+
+        Returns:
+            Объект CourseOffer
+        """
+        offer = self._offer
+        if self._is_fresh(offer):
+            return offer
+
+        async with self._lock:
+            # Снимок мог обновить другой обработчик, пока мы ждали блокировку
+            if self._is_fresh(self._offer):
+                return self._offer
+
+            async with async_session() as session:
+                result = await session.execute(
+                    select(Course).where(
+                        Course.is_active.is_(True),
+                        Course.start_date > datetime.now()
+                    ).order_by(Course.start_date.asc()).limit(1)
+                )
+                course = result.scalar_one_or_none()
+
+            self._offer = CourseOffer(
+                course=course,
+                caption=_render_caption(course),
+                keyboard=_render_keyboard(),
+                expires_at=time.monotonic() + self.ttl,
+            )
+            logger.info(f"Предложение курса обновлено: {course}")
+            return self._offer
+
+    def invalidate(self):
+        """Сбрасывает снимок, следующий запрос перечитает курс из БД."""
+        self._offer = None
+
+
+course_offer_cache = CourseOfferCache(
+    ttl=float(os.getenv('COURSE_OFFER_TTL', '300')),
+)
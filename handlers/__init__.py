@@ -1 +1 @@
-from . import personal_direction, business_direction, registration, admin, additional_actions
+from . import direction, registration, admin, additional_actions
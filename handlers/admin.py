@@ -1,19 +1,25 @@
-from aiogram import Router
+from aiogram import F, Router
 from aiogram.filters import Command
-from aiogram.types import Message
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
 from datetime import datetime, timedelta
 import logging
 
-from database import async_session
 from models import Webinar, User, AICoinOperation
-from coin_service import get_balance
-from sqlalchemy import select
+from balance_cache import balance_cache
+from leaderboard import leaderboard, rank_line
+from balance_reconciler import balance_reconciler
+from webinar_schedule import webinar_schedule
+from course_offer import course_offer_cache
+from content import content_registry
+from scheduler import job_scheduler, schedule_webinar_reminders
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 
 router = Router()
 logger = logging.getLogger(__name__)
 
 @router.message(Command("create_webinar"))
-async def create_webinar_handler(message: Message):
+async def create_webinar_handler(message: Message, session: AsyncSession):
     """
     Создает новый вебинар.
     Пример использования: /create_webinar 2025-12-31 19:00
@@ -29,11 +35,20 @@ async def create_webinar_handler(message: Message):
             # Дата и время не указаны, создаем через 24 часа
             webinar_date = datetime.now() + timedelta(days=1)
 
-        async with async_session() as session:
-            new_webinar = Webinar(webinar_date=webinar_date)
-            session.add(new_webinar)
-            await session.commit()
-        
+        new_webinar = Webinar(webinar_date=webinar_date)
+        session.add(new_webinar)
+        await session.flush()  # Получаем ID вебинара
+
+        # Планируем напоминания в той же транзакции
+        await schedule_webinar_reminders(session, new_webinar)
+        await session.commit()
+
+        # Будим планировщик, чтобы он учел новые задания
+        job_scheduler.wake()
+
+        # Перестраиваем расписание вебинаров в памяти
+        await webinar_schedule.refresh()
+
         await message.answer(f"✅ Вебинар успешно создан на {webinar_date.strftime('%d.%m.%Y в %H:%M')}.")
         logger.info(f"Создан новый вебинар на {webinar_date}")
 
@@ -44,8 +59,48 @@ async def create_webinar_handler(message: Message):
         await message.answer("❌ Произошла ошибка при создании вебинара.")
 
 
+@router.message(Command("reload_course"))
+async def reload_course_handler(message: Message):
+    """
+    Сбрасывает кэш предложения курса (после изменения таблицы courses).
+    Пример использования: /reload_course
+    """
+    try:
+        course_offer_cache.invalidate()
+        offer = await course_offer_cache.get()
+
+        if offer.course:
+            await message.answer(
+                f"✅ Предложение курса обновлено: {offer.course.course_name} "
+                f"({offer.course.start_date.strftime('%d.%m.%Y в %H:%M')})."
+            )
+        else:
+            await message.answer("✅ Кэш сброшен. Активных курсов нет.")
+
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении предложения курса: {e}")
+        await message.answer("❌ Произошла ошибка при обновлении предложения курса.")
+
+
+@router.message(Command("reload_content"))
+async def reload_content_handler(message: Message):
+    """
+    Перечитывает контент воронки (видео направлений, тексты, клавиатуры) после изменения .env.
+    Пример использования: /reload_content
+    """
+    try:
+        content_registry.reload()
+        video = content_registry.direction("direction_personal").video
+        video_state = "задано" if video else "не задано (VIDEO_FILE_ID)"
+        await message.answer(f"✅ Контент воронки обновлен. Видео: {video_state}.")
+
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении контента: {e}")
+        await message.answer("❌ Произошла ошибка при обновлении контента.")
+
+
 @router.message(Command("balance"))
-async def check_balance_handler(message: Message):
+async def check_balance_handler(message: Message, session: AsyncSession):
     """
     Проверяет баланс AI монет пользователя.
     Пример использования: /balance или /balance 123456789
@@ -59,13 +114,10 @@ async def check_balance_handler(message: Message):
         else:
             telegram_id = message.from_user.id
 
-        balance = await get_balance(telegram_id)
-
-        async with async_session() as session:
-            user_result = await session.execute(
-                select(User).where(User.telegram_id == telegram_id)
-            )
-            user = user_result.scalar_one_or_none()
+        user_result = await session.execute(
+            select(User).where(User.telegram_id == telegram_id)
+        )
+        user = user_result.scalar_one_or_none()
 
         if not user:
             await message.answer(f"❌ Пользователь с ID {telegram_id} не найден в базе.")
@@ -76,7 +128,8 @@ async def check_balance_handler(message: Message):
 
 👤 Пользователь: {user.user_name or 'Анонимно'}
 🆔 Telegram ID: {telegram_id}
-💵 Баланс: {balance} монет
+💵 Баланс: {user.ai_coins_balance} монет
+{rank_line(telegram_id)}
 📍 Направление: {direction}
 📅 Дата регистрации: {user.start_time.strftime('%d.%m.%Y %H:%M') if user.start_time else 'неизвестна'}
 """
@@ -89,8 +142,150 @@ async def check_balance_handler(message: Message):
         await message.answer("❌ Произошла ошибка при проверке баланса.")
 
 
+# Максимальный размер рейтинга в /top
+TOP_MAX_LIMIT = 50
+
+
+@router.message(Command("top"))
+async def top_handler(message: Message, session: AsyncSession):
+    """
+    Показывает рейтинг пользователей по балансу AI монет.
+    Пример использования: /top или /top 20
+    """
+    try:
+        args = message.text.split()
+        limit = min(int(args[1]), TOP_MAX_LIMIT) if len(args) > 1 else 10
+
+        # Места считаются по рейтингу в памяти, из БД читаются только имена
+        top = leaderboard.top(limit)
+        if not top:
+            await message.answer("🏆 Рейтинг пока пуст.")
+            return
+
+        names_result = await session.execute(
+            select(User.telegram_id, User.user_name)
+            .where(User.telegram_id.in_([telegram_id for telegram_id, _ in top]))
+        )
+        names = dict(names_result.all())
+
+        text = f"🏆 Топ-{len(top)} по AI Coins 🪙\n"
+        for telegram_id, balance in top:
+            text += (
+                f"\n{leaderboard.rank(telegram_id)}. "
+                f"{names.get(telegram_id) or telegram_id} - {balance} монет"
+            )
+        await message.answer(text)
+
+    except ValueError:
+        await message.answer("❌ Неверный формат. Используйте: /top или /top <количество>")
+    except Exception as e:
+        logger.error(f"Ошибка при получении рейтинга: {e}")
+        await message.answer("❌ Произошла ошибка при получении рейтинга.")
+
+
+@router.message(Command("cache_stats"))
+async def cache_stats_handler(message: Message):
+    """
+    Показывает статистику кэша балансов.
+    Пример использования: /cache_stats
+    """
+    stats = balance_cache.stats()
+    total = stats['hits'] + stats['misses']
+    hit_rate = stats['hits'] / total * 100 if total else 0.0
+
+    text = f"""🗄 Кэш балансов
+
+⚙️ Включен: {'да' if stats['enabled'] else 'нет'}
+📦 Записей: {stats['size']}
+✅ Попаданий: {stats['hits']}
+❌ Промахов: {stats['misses']}
+🎯 Hit rate: {hit_rate:.1f}%
+"""
+    await message.answer(text)
+
+
+@router.message(Command("reconcile_stats"))
+async def reconcile_stats_handler(message: Message):
+    """
+    Показывает состояние сверки балансов с журналом операций.
+    Пример использования: /reconcile_stats
+    """
+    stats = balance_reconciler.stats()
+    last_run = stats['last_run_at'].strftime('%d.%m.%Y %H:%M:%S') if stats['last_run_at'] else 'еще не было'
+
+    text = f"""🔎 Сверка балансов с журналом
+
+⚙️ Включена: {'да' if stats['enabled'] else 'нет'}
+🛠 Исправление: {'да' if stats['repair'] else 'только отметка'}
+📍 Позиция в журнале: {stats['last_operation_id']}
+📊 Учтено строк: {stats['rows_total']}
+⚡️ Скорость: {stats['rows_per_sec']:.0f} строк/с
+🔁 На повторной проверке: {stats['suspects']}
+🚩 Отмечено расхождений: {stats['flagged_total']}
+✅ Исправлено: {stats['repaired_total']}
+🕒 Последний цикл: {last_run}
+"""
+    await message.answer(text)
+
+
+# Размер страницы истории операций в /user_stats
+USER_STATS_PAGE_SIZE = 10
+USER_STATS_CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+async def _operations_page(session: AsyncSession, user_id: int, cursor: tuple = None):
+    """
+    Возвращает страницу операций пользователя (новые сначала) и курсор
+    следующей страницы (created_at, id) или None, если страница последняя.
+    """
+    stmt = (
+        select(AICoinOperation)
+        .where(AICoinOperation.user_id == user_id)
+        .order_by(AICoinOperation.created_at.desc(), AICoinOperation.id.desc())
+        .limit(USER_STATS_PAGE_SIZE + 1)
+    )
+    if cursor:
+        stmt = stmt.where(
+            tuple_(AICoinOperation.created_at, AICoinOperation.id) < tuple_(*cursor)
+        )
+    result = await session.execute(stmt)
+    operations = result.scalars().all()
+
+    if len(operations) <= USER_STATS_PAGE_SIZE:
+        return operations, None
+    operations = operations[:USER_STATS_PAGE_SIZE]
+    return operations, (operations[-1].created_at, operations[-1].id)
+
+
+def _format_operations(operations) -> str:
+    text = ""
+    for op in operations:
+        op_type = "➕" if op.operation_type.value == 'earned' else "➖"
+        text += f"\n{op_type} {op.amount:+d} монет - {op.reason}"
+        if op.created_at:
+            text += f" ({op.created_at.strftime('%d.%m.%Y %H:%M')})"
+    return text
+
+
+def _next_page_keyboard(user_id: int, cursor: tuple):
+    if not cursor:
+        return None
+    created_at, operation_id = cursor
+    return InlineKeyboardMarkup(
+        inline_keyboard=[[
+            InlineKeyboardButton(
+                text="➡️ Следующие операции",
+                callback_data=(
+                    f"user_stats_page_{user_id}_"
+                    f"{created_at.strftime(USER_STATS_CURSOR_FORMAT)}_{operation_id}"
+                ),
+            )
+        ]]
+    )
+
+
 @router.message(Command("user_stats"))
-async def user_stats_handler(message: Message):
+async def user_stats_handler(message: Message, session: AsyncSession):
     """
     Показывает статистику операций с монетами пользователя.
     Пример использования: /user_stats или /user_stats 123456789
@@ -104,28 +299,36 @@ async def user_stats_handler(message: Message):
         else:
             telegram_id = message.from_user.id
 
-        async with async_session() as session:
-            # Находим пользователя
-            user_result = await session.execute(
-                select(User).where(User.telegram_id == telegram_id)
-            )
-            user = user_result.scalar_one_or_none()
+        # Находим пользователя
+        user_result = await session.execute(
+            select(User).where(User.telegram_id == telegram_id)
+        )
+        user = user_result.scalar_one_or_none()
 
-            if not user:
-                await message.answer(f"❌ Пользователь с ID {telegram_id} не найден.")
-                return
+        if not user:
+            await message.answer(f"❌ Пользователь с ID {telegram_id} не найден.")
+            return
 
-            # Получаем все операции пользователя
-            operations_result = await session.execute(
-                select(AICoinOperation)
-                .where(AICoinOperation.user_id == user.id)
-                .order_by(AICoinOperation.created_at.desc())
+        # Итоги считаются в БД одним агрегирующим запросом
+        totals_result = await session.execute(
+            select(
+                AICoinOperation.operation_type,
+                func.coalesce(func.sum(func.abs(AICoinOperation.amount)), 0),
+                func.count(),
             )
-            operations = operations_result.scalars().all()
+            .where(AICoinOperation.user_id == user.id)
+            .group_by(AICoinOperation.operation_type)
+        )
+        totals = {
+            operation_type.value: (amount, operations_count)
+            for operation_type, amount, operations_count in totals_result
+        }
+        total_earned = totals.get('earned', (0, 0))[0]
+        total_spent = totals.get('spent', (0, 0))[0]
+        total_operations = sum(operations_count for _, operations_count in totals.values())
 
-        # Подсчитываем статистику
-        total_earned = sum(op.amount for op in operations if op.operation_type.value == 'earned')
-        total_spent = sum(abs(op.amount) for op in operations if op.operation_type.value == 'spent')
+        # Первая страница последних операций
+        operations, cursor = await _operations_page(session, user.id)
 
         # Формируем текст сообщения
         text = f"""📊 Статистика операций с монетами 🪙
@@ -137,24 +340,50 @@ async def user_stats_handler(message: Message):
 📈 Статистика:
 ✅ Всего заработано: {total_earned} монет
 ❌ Всего потрачено: {total_spent} монет
-📝 Всего операций: {len(operations)}
+📝 Всего операций: {total_operations}
 
 📜 Последние операции:
 """
 
         if operations:
-            for op in operations[:10]:  # Показываем последние 10 операций
-                op_type = "➕" if op.operation_type.value == 'earned' else "➖"
-                text += f"\n{op_type} {op.amount:+d} монет - {op.reason}"
-                if op.created_at:
-                    text += f" ({op.created_at.strftime('%d.%m.%Y %H:%M')})"
+            text += _format_operations(operations)
         else:
             text += "\nНет операций"
 
-        await message.answer(text)
+        await message.answer(text, reply_markup=_next_page_keyboard(user.id, cursor))
 
     except ValueError:
         await message.answer("❌ Неверный формат. Используйте: /user_stats или /user_stats <telegram_id>")
     except Exception as e:
         logger.error(f"Ошибка при получении статистики: {e}")
         await message.answer("❌ Произошла ошибка при получении статистики.")
+
+
+@router.callback_query(F.data.startswith("user_stats_page_"))
+async def user_stats_page_handler(callback: CallbackQuery, session: AsyncSession):
+    """
+    Показывает следующую страницу операций из /user_stats.
+    Курсор (created_at, id) последней показанной операции передается в callback_data.
+    """
+    await callback.answer()
+
+    try:
+        _, user_id, created_at, operation_id = callback.data.rsplit("_", 3)
+        cursor = (
+            datetime.strptime(created_at, USER_STATS_CURSOR_FORMAT),
+            int(operation_id),
+        )
+        operations, next_cursor = await _operations_page(session, int(user_id), cursor)
+
+        if not operations:
+            await callback.message.answer("📜 Больше операций нет.")
+            return
+
+        await callback.message.answer(
+            "📜 Операции (продолжение):\n" + _format_operations(operations),
+            reply_markup=_next_page_keyboard(int(user_id), next_cursor)
+        )
+
+    except Exception as e:
+        logger.error(f"Ошибка при получении страницы операций: {e}")
+        await callback.message.answer("❌ Произошла ошибка при получении операций.")
@@ -0,0 +1,47 @@
+from aiogram import Router, F
+from aiogram.types import CallbackQuery
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import User
+from coin_service import add_coins
+from content import DIRECTION_BONUS, VIDEO_NOT_FOUND_TEXT, content_registry
+
+router = Router()
+
+
+@router.callback_query(F.data.in_({"direction_personal", "direction_business"}))
+async def direction_handler(callback: CallbackQuery, session: AsyncSession):
+    """
+    Обрабатывает выбор направления (личное или бизнес).
+    Видео, текст и клавиатура берутся из готового пакета направления.
+    """
+    await callback.answer()
+    pack = content_registry.direction(callback.data)
+
+    stmt = update(User).where(
+        User.telegram_id == callback.from_user.id
+    ).values(direction=pack.direction)
+    await session.execute(stmt)
+
+    # Начисляем +50 монет при выборе направления
+    await add_coins(
+        telegram_id=callback.from_user.id,
+        amount=DIRECTION_BONUS,
+        reason="выбор направления",
+        description=pack.bonus_description,
+        session=session
+    )
+    await session.commit()
+
+    if not callback.message:
+        return
+
+    if not pack.video:
+        await callback.message.answer(VIDEO_NOT_FOUND_TEXT)
+        return
+
+    await callback.message.answer_video(**pack.video)
+    await callback.message.answer(
+        pack.text, reply_markup=pack.keyboard, parse_mode="HTML"
+    )
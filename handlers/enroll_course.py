@@ -3,7 +3,6 @@ import os
 import uuid
 import json
 import logging
-from datetime import datetime
 from aiogram import Router, F
 from aiogram.types import (
     CallbackQuery,
@@ -11,163 +10,78 @@ from aiogram.types import (
     InlineKeyboardMarkup
 )
 from dotenv import load_dotenv
-from sqlalchemy import select, text
-from yookassa import Configuration
-from yookassa import Payment as YooKassaPayment  # noqa: F401
+from sqlalchemy import insert, select, text
 
 from database import async_session
-from models import User, Course, Payment, PaymentStatus, course_registrations
+from models import User, Payment, PaymentStatus, course_registrations
+from course_offer import course_offer_cache
+from media_registry import COURSE_PHOTO, media_registry
+from payment_gateway import payment_gateway
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
 router = Router()
 
-# Настройка ЮКассы
-Configuration.account_id = os.getenv('PAYMENT_SHOP_ID')
-Configuration.secret_key = os.getenv('PAYMENT_SECRET_KEY')
-
-logger.info(f"YooKassa Configuration: account_id={Configuration.account_id}, secret_key={'***' if Configuration.secret_key else 'NOT SET'}")
-
 
 @router.callback_query(F.data == "enroll_course")
 async def enroll_course_handler(callback: CallbackQuery):
     """Обработчик кнопки записи на полный курс"""
-    photo_url = (
-        "https://image2url.com/images/"
-        "1763093675664-50aea332-8b0b-4d62-89ac-d06086940beb.jpeg"
-    )
-
     await callback.answer()
 
     if not callback.message:
         return
 
-    async with async_session() as session:
+    try:
+        # Берем готовое предложение курса (подпись и клавиатура собраны заранее)
+        offer = await course_offer_cache.get()
+
         try:
-            # Ищем активный курс
-            stmt = select(Course).where(
-                Course.is_active.is_(True),
-                Course.start_date > datetime.now()
-            ).order_by(Course.start_date.asc()).limit(1)
-            result = await session.execute(stmt)
-            course = result.scalar_one_or_none()
-
-            if course:
-                course_date = course.start_date.strftime('%d.%m.%Y')
-                course_time = course.start_date.strftime('%H:%M')
-                caption = (
-                    f"🚀 Полный курс по ИИ\n"
-                    f"📅 Дата старта: {course_date} в {course_time} МСК\n"
-                    f"💰 Цена: {float(course.price):.2f} ₽\n\n"
-                    f"Что вы получите:\n"
-                    f"4 интенсивных вебинара по 1.5 часа в прямом эфире\n"
-                    f"Каждый день — новый модуль с практическими навыками\n"
-                    f"📚 Программа курса:\n"
-                    f"День 1: Основы AI и умные чат-боты\n\n"
-                    f"Что такое LLM и как они работают (простым языком)\n"
-                    f"Топовые нейросети: Claude Sonnet, DeepSeek, Qwen, Perplexity\n"
-                    f"Создание эффективных промптов для рабочих задач\n"
-                    f"Чат-боты для автоматизации клиентской поддержки\n"
-                    f"✅ Результат: экономия 5-10 часов в неделю\n\n"
-                    f"День 2: AI для контента — изображения и видео\n\n"
-                    f"Генерация изображений: Midjourney, DALL-E, Stable Diffusion, Flux\n"
-                    f"Создание видео: Runway, Pika, Kling AI\n"
-                    f"Контент для соцсетей, рекламы и презентаций\n"
-                    f"✅ Результат: профессиональный контент без дизайнера\n\n"
-                    f"День 3: 3D-аватары и виртуальные презентации\n\n"
-                    f"Создание AI-аватаров для видео\n"
-                    f"Виртуальные ассистенты и спикеры\n"
-                    f"Применение в обучении, продажах и маркетинге\n"
-                    f"✅ Результат: масштабирование личного бренда\n\n"
-                    f"День 4: Автоматизация бизнес-процессов с N8N\n\n"
-                    f"No-code автоматизация рабочих процессов\n"
-                    f"Интеграция AI с CRM, почтой, мессенджерами\n"
-                    f"Создание автоматических воронок\n"
-                    f"✅ Результат: автоматизация до 70% рутины\n\n\n"
-                    f"🎁 Бонусы участникам:\n"
-                    f"✔️ Все записи вебинаров в личном кабинете\n"
-                    f"✔️ Доступ в закрытую группу с дополнительными материалами\n"
-                    f"✔️ Готовые шаблоны промптов и чек-листы\n"
-                    f"✔️ Поддержка и ответы на вопросы в чате участников\n"
-                    f"✔️ База знаний с инструкциями и кейсами\n\n"
-                    f"⏰ Формат проведения:\n"
-                    f"🔴 Прямые эфиры каждый будний день в течение недели\n"
-                    f"📹 Время: 20:00 МСК (1.5 часа)\n"
-                    f"🔄 Гибкий график: можете выбрать удобный поток каждую неделю\n\n"
-                    f"👥 Для кого этот курс:\n\n"
-                    f"Для специалистов — повышение личной эффективности\n"
-                    f"Для владельцев бизнеса — автоматизация и масштабирование\n"
-                    f"Для начинающих — с нуля до уверенного применения AI\n\n"
-                    f"Никакого программирования! Только практические инструменты, которые работают уже сегодня.\n\n"
-                    f"Цена курса: {float(course.price):.2f} ₽\n"
-                    f"Старт ближайшего потока: {course_date}"
-                )
-            else:
-                caption = "Подробности об обучении позже..."
-
-            # Создаем клавиатуру с кнопками
-            keyboard = InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [
-                        InlineKeyboardButton(
-                            text="💬 Получить консультацию и задать вопрос",
-                            url="https://t.me/LevinMSK"
-                        )
-                    ],
-                    [
-                        InlineKeyboardButton(
-                            text="💳 Получить доступ к курсу",
-                            callback_data="purchase_course"
-                        )
-                    ]
-                ]
+            await media_registry.answer_photo(
+                callback.message,
+                COURSE_PHOTO,
+                caption=offer.caption,
+                reply_markup=offer.keyboard,
+                parse_mode="HTML"
             )
-
-            try:
-                await callback.message.answer_photo(
-                    photo=photo_url,
-                    caption=caption,
-                    reply_markup=keyboard,
-                    parse_mode="HTML"
-                )
-            except Exception:
-                # Если фото не отправилось, отправляем текст с кнопками
-                await callback.message.answer(
-                    caption,
-                    reply_markup=keyboard,
-                    parse_mode="HTML"
-                )
-
         except Exception:
-            # Если ошибка, отправляем базовое сообщение
-            keyboard = InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [
-                        InlineKeyboardButton(
-                            text="🙋‍♂️ Получить консультацию или задать вопрос",
-                            url="https://t.me/LevinMSK"
-                        )
-                    ],
-                    [
-                        InlineKeyboardButton(
-                            text="🚀 Записаться на курс",
-                            callback_data="purchase_course"
-                        )
-                    ]
+            # Если фото не отправилось, отправляем текст с кнопками
+            await callback.message.answer(
+                offer.caption,
+                reply_markup=offer.keyboard,
+                parse_mode="HTML"
+            )
+
+    except Exception:
+        # Если ошибка, отправляем базовое сообщение
+        keyboard = InlineKeyboardMarkup(
+            inline_keyboard=[
+                [
+                    InlineKeyboardButton(
+                        text="🙋‍♂️ Получить консультацию или задать вопрос",
+                        url="https://t.me/LevinMSK"
+                    )
+                ],
+                [
+                    InlineKeyboardButton(
+                        text="🚀 Записаться на курс",
+                        callback_data="purchase_course"
+                    )
                 ]
+            ]
+        )
+        try:
+            await media_registry.answer_photo(
+                callback.message,
+                COURSE_PHOTO,
+                caption="Подробности об обучении позже...",
+                reply_markup=keyboard
+            )
+        except Exception:
+            await callback.message.answer(
+                "Подробности об обучении позже...",
+                reply_markup=keyboard
             )
-            try:
-                await callback.message.answer_photo(
-                    photo=photo_url,
-                    caption="Подробности об обучении позже...",
-                    reply_markup=keyboard
-                )
-            except Exception:
-                await callback.message.answer(
-                    "Подробности об обучении позже...",
-                    reply_markup=keyboard
-                )
 
 
 @router.callback_query(F.data == "purchase_course")
@@ -183,8 +97,10 @@ async def purchase_course_handler(callback: CallbackQuery):
     default_webhook = "https://lexi.neuronaikids.ru/webhook"
     webhook_url = os.getenv('WEBHOOK_URL', default_webhook)
 
-    async with async_session() as session:
-        try:
+    try:
+        # Транзакции короткие: соединение с БД не держится, пока ждем ЮКассу.
+        # Чтение и проверки - в первой транзакции, запись платежа - во второй
+        async with async_session() as session:
             # 1. Получаем или создаем пользователя
             stmt = select(User).where(User.telegram_id == telegram_id)
             result = await session.execute(stmt)
@@ -199,15 +115,11 @@ async def purchase_course_handler(callback: CallbackQuery):
                 session.add(user)
                 await session.flush()  # Получаем ID пользователя
 
-            # 2. Ищем активный курс
-            stmt = select(Course).where(
-                Course.is_active.is_(True),
-                Course.start_date > datetime.now()
-            ).order_by(Course.start_date.asc()).limit(1)
-            result = await session.execute(stmt)
-            course = result.scalar_one_or_none()
+            # 2. Берем активный курс из кэша предложения
+            course = (await course_offer_cache.get()).course
 
             if not course:
+                await session.commit()
                 await callback.message.answer(
                     "❌ В данный момент нет доступных курсов для покупки."
                 )
@@ -222,178 +134,179 @@ async def purchase_course_handler(callback: CallbackQuery):
             result = await session.execute(stmt)
             existing_registration = result.first()
 
-            if existing_registration:
-                await callback.message.answer(
-                    f"✅ Вы уже зарегистрированы на курс "
-                    f"<b>{course.course_name}</b>!\n\n"
-                    f"📅 Дата старта: "
-                    f"{course.start_date.strftime('%d.%m.%Y в %H:%M')} МСК",
-                    parse_mode="HTML"
-                )
-                return
-
             # 4. Проверяем, нет ли уже успешного платежа
             # Используем SQL cast для правильного сравнения enum
-            status_value = PaymentStatus.SUCCEEDED.value
-            stmt = select(Payment).where(
-                Payment.user_id == user.id,
-                Payment.course_id == course.id,
-                text(f"payments.status = '{status_value}'::payment_status")
-            )
-            result = await session.execute(stmt)
-            existing_payment = result.scalar_one_or_none()
-
-            if existing_payment:
-                await callback.message.answer(
-                    f"✅ У вас уже есть оплаченный доступ к курсу "
-                    f"<b>{course.course_name}</b>!\n\n"
-                    f"📅 Дата старта: "
-                    f"{course.start_date.strftime('%d.%m.%Y в %H:%M')} МСК",
-                    parse_mode="HTML"
+            existing_payment = None
+            if not existing_registration:
+                status_value = PaymentStatus.SUCCEEDED.value
+                stmt = select(Payment).where(
+                    Payment.user_id == user.id,
+                    Payment.course_id == course.id,
+                    text(f"payments.status = '{status_value}'::payment_status")
                 )
-                return
+                result = await session.execute(stmt)
+                existing_payment = result.scalar_one_or_none()
+
+            # Фиксируем нового пользователя и отпускаем соединение
+            await session.commit()
 
-            # 5. Создаем уникальный ID платежа для ЮКассы
-            yookassa_payment_id = str(uuid.uuid4())
-            logger.info(f"Creating payment for user {telegram_id}, payment_id: {yookassa_payment_id}")
-
-            # 6. Создаем платеж через API ЮКассы
-            # Для receipt ОБЯЗАТЕЛЬНО нужен email или телефон покупателя
-            customer_data = {}
-            # Пробуем получить email или телефон (если доступны)
-            user_email = getattr(callback.from_user, 'email', None)
-            user_phone = getattr(callback.from_user, 'phone', None)
-
-            # ВСЕГДА заполняем customer_data
-            if user_email:
-                customer_data["email"] = user_email
-            elif user_phone:
-                customer_data["phone"] = user_phone
+        if existing_registration:
+            await callback.message.answer(
+                f"✅ Вы уже зарегистрированы на курс "
+                f"<b>{course.course_name}</b>!\n\n"
+                f"📅 Дата старта: "
+                f"{course.start_date.strftime('%d.%m.%Y в %H:%M')} МСК",
+                parse_mode="HTML"
+            )
+            return
+
+        if existing_payment:
+            await callback.message.answer(
+                f"✅ У вас уже есть оплаченный доступ к курсу "
+                f"<b>{course.course_name}</b>!\n\n"
+                f"📅 Дата старта: "
+                f"{course.start_date.strftime('%d.%m.%Y в %H:%M')} МСК",
+                parse_mode="HTML"
+            )
+            return
+
+        # 5. Создаем уникальный ID платежа для ЮКассы
+        yookassa_payment_id = str(uuid.uuid4())
+        logger.info(f"Creating payment for user {telegram_id}, payment_id: {yookassa_payment_id}")
+
+        # 6. Создаем платеж через API ЮКассы
+        # Для receipt ОБЯЗАТЕЛЬНО нужен email или телефон покупателя
+        customer_data = {}
+        # Пробуем получить email или телефон (если доступны)
+        user_email = getattr(callback.from_user, 'email', None)
+        user_phone = getattr(callback.from_user, 'phone', None)
+
+        # ВСЕГДА заполняем customer_data
+        if user_email:
+            customer_data["email"] = user_email
+        elif user_phone:
+            customer_data["phone"] = user_phone
+        else:
+            # Если нет email и телефона, используем дефолтный email или создаем временный
+            default_email = os.getenv('DEFAULT_CUSTOMER_EMAIL', '')
+            if default_email:
+                customer_data["email"] = default_email
+                logger.info(f"Using default customer email: {default_email}")
             else:
-                # Если нет email и телефона, используем дефолтный email или создаем временный
-                default_email = os.getenv('DEFAULT_CUSTOMER_EMAIL', '')
-                if default_email:
-                    customer_data["email"] = default_email
-                    logger.info(f"Using default customer email: {default_email}")
-                else:
-                    # Создаем временный email на основе telegram_id
-                    customer_data["email"] = f"user_{telegram_id}@telegram.local"
-                    logger.warning(f"No DEFAULT_CUSTOMER_EMAIL, using temporary: {customer_data['email']}")
-            
-            payment_data = {
-                "amount": {
-                    "value": f"{float(course.price):.2f}",
-                    "currency": "RUB"
-                },
-                "confirmation": {
-                    "type": "redirect",
-                    "return_url": webhook_url
-                },
-                "capture": True,
-                "description": f"Оплата курса: {course.course_name}",
-                "receipt": {
-                    "customer": customer_data,
-                    "items": [
-                        {
-                            "description": course.course_name,
-                            "quantity": "1.00",
-                            "amount": {
-                                "value": f"{float(course.price):.2f}",
-                                "currency": "RUB"
-                            },
-                            "vat_code": 1,  # НДС не облагается (для образовательных услуг)
-                            "payment_subject": "service",  # Обязательное поле: услуга
-                            "payment_mode": "full_prepayment"  # Обязательное поле: способ расчета
-                        }
-                    ]
-                },
-                "metadata": {
-                    "user_id": str(user.id),
-                    "telegram_id": str(telegram_id),
-                    "user_name": user_name,
-                    "course_id": str(course.id),
-                    "course_name": course.course_name
-                }
+                # Создаем временный email на основе telegram_id
+                customer_data["email"] = f"user_{telegram_id}@telegram.local"
+                logger.warning(f"No DEFAULT_CUSTOMER_EMAIL, using temporary: {customer_data['email']}")
+
+        payment_data = {
+            "amount": {
+                "value": f"{float(course.price):.2f}",
+                "currency": "RUB"
+            },
+            "confirmation": {
+                "type": "redirect",
+                "return_url": webhook_url
+            },
+            "capture": True,
+            "description": f"Оплата курса: {course.course_name}",
+            "receipt": {
+                "customer": customer_data,
+                "items": [
+                    {
+                        "description": course.course_name,
+                        "quantity": "1.00",
+                        "amount": {
+                            "value": f"{float(course.price):.2f}",
+                            "currency": "RUB"
+                        },
+                        "vat_code": 1,  # НДС не облагается (для образовательных услуг)
+                        "payment_subject": "service",  # Обязательное поле: услуга
+                        "payment_mode": "full_prepayment"  # Обязательное поле: способ расчета
+                    }
+                ]
+            },
+            "metadata": {
+                "user_id": str(user.id),
+                "telegram_id": str(telegram_id),
+                "user_name": user_name,
+                "course_id": str(course.id),
+                "course_name": course.course_name
             }
+        }
 
-            # Создаем платеж через API ЮКассы с обработкой ошибок
-            logger.info(f"Sending payment request to YooKassa: amount={course.price}, customer={customer_data}")
-            try:
-                yookassa_payment = YooKassaPayment.create(payment_data, yookassa_payment_id)
-                logger.info(f"Payment created successfully: {yookassa_payment.id}, status={yookassa_payment.status}")
-
-                # Проверяем, что платеж создан успешно
-                if not yookassa_payment or not hasattr(yookassa_payment, 'confirmation'):
-                    logger.error("Payment created but no confirmation object")
-                    raise ValueError("Платеж создан, но отсутствует объект подтверждения")
+        # Создаем платеж через API ЮКассы с обработкой ошибок
+        logger.info(f"Sending payment request to YooKassa: amount={course.price}, customer={customer_data}")
+        try:
+            # Асинхронный запрос к API: цикл событий не блокируется
+            yookassa_payment = await payment_gateway.create_payment(
+                payment_data, yookassa_payment_id
+            )
+            logger.info(f"Payment created successfully: {yookassa_payment.id}, status={yookassa_payment.status}")
 
-                # Проверяем наличие ссылки на оплату
-                if not hasattr(yookassa_payment.confirmation, 'confirmation_url'):
-                    logger.error("Payment confirmation has no URL")
-                    raise ValueError("Отсутствует ссылка на оплату")
+            # Проверяем наличие ссылки на оплату
+            if not yookassa_payment.confirmation.confirmation_url:
+                logger.error("Payment confirmation has no URL")
+                raise ValueError("Отсутствует ссылка на оплату")
 
-                logger.info(f"Payment URL: {yookassa_payment.confirmation.confirmation_url}")
+            logger.info(f"Payment URL: {yookassa_payment.confirmation.confirmation_url}")
 
-            except Exception as api_error:
-                logger.error(f"YooKassa API Error: {type(api_error).__name__}: {api_error}", exc_info=True)
-                raise ValueError(f"Ошибка при создании платежа в YooKassa: {str(api_error)}")
+        except Exception as api_error:
+            logger.error(f"YooKassa API Error: {type(api_error).__name__}: {api_error}", exc_info=True)
+            raise ValueError(f"Ошибка при создании платежа в YooKassa: {str(api_error)}")
 
-            # 7. Сохраняем платеж в БД
-            # Используем прямое SQL для правильного сохранения enum
-            from sqlalchemy import insert
-            result = await session.execute(
+        # 7. Сохраняем платеж в БД (новая короткая транзакция)
+        # Используем прямое SQL для правильного сохранения enum
+        async with async_session() as session:
+            await session.execute(
                 insert(Payment).values(
                     user_id=user.id,
                     course_id=course.id,
-                    payment_id=yookassa_payment_id,
+                    # Храним ID платежа от ЮКассы: по нему приходят уведомления
+                    payment_id=yookassa_payment.id,
                     amount=course.price,
                     currency="RUB",
                     status=text(f"'{PaymentStatus.PENDING.value}'::payment_status"),
                     payment_metadata=json.dumps(yookassa_payment.metadata or {})
-                ).returning(Payment.id)
+                )
             )
-            payment_db_id = result.scalar_one()
             await session.commit()
-            
-            # Платеж успешно сохранен в БД, объект не нужен для дальнейшей работы
-
-            # 8. Получаем ссылку на оплату
-            payment_url = yookassa_payment.confirmation.confirmation_url
-
-            # 9. Отправляем пользователю ссылку на оплату
-            keyboard = InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [
-                        InlineKeyboardButton(
-                            text="💳 Получить доступ к курсу",
-                            url=payment_url
-                        )
-                    ]
-                ]
-            )
-
-            course_date = course.start_date.strftime('%d.%m.%Y')
-            course_time = course.start_date.strftime('%H:%M')
 
-            await callback.message.answer(
-                f"🎯 Вы приняли правильное решение!\n\n"
-                f"🚀 <b>{course.course_name}</b>\n"
-                f"📅 Старт: {course_date} в {course_time} МСК\n"
-                f"💰 Всего {float(course.price):.2f} ₽\n\n"
-                f"Это меньше, чем 1 час работы дизайнера,\n"
-                f"а навыки останутся с Вами навсегда!\n\n"
-                f"🎁 <b>Бонусом получите:</b>\n"
-                f"- Записи всех вебинаров\n"
-                f"- Доступ в закрытую группу\n"
-                f"- Готовые шаблоны и промпты\n\n"
-                f"Получитие доступ уже сейчас 👇",
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
-
-        except Exception as e:
-            await session.rollback()
-            await callback.message.answer(
-                f"❌ Произошла ошибка при создании платежа. "
-                f"Попробуйте позже.\n\nОшибка: {str(e)}"
-            )
+        # 8. Получаем ссылку на оплату
+        payment_url = yookassa_payment.confirmation.confirmation_url
+
+        # 9. Отправляем пользователю ссылку на оплату
+        keyboard = InlineKeyboardMarkup(
+            inline_keyboard=[
+                [
+                    InlineKeyboardButton(
+                        text="💳 Получить доступ к курсу",
+                        url=payment_url
+                    )
+                ]
+            ]
+        )
+
+        course_date = course.start_date.strftime('%d.%m.%Y')
+        course_time = course.start_date.strftime('%H:%M')
+
+        await callback.message.answer(
+            f"🎯 Вы приняли правильное решение!\n\n"
+            f"🚀 <b>{course.course_name}</b>\n"
+            f"📅 Старт: {course_date} в {course_time} МСК\n"
+            f"💰 Всего {float(course.price):.2f} ₽\n\n"
+            f"Это меньше, чем 1 час работы дизайнера,\n"
+            f"а навыки останутся с Вами навсегда!\n\n"
+            f"🎁 <b>Бонусом получите:</b>\n"
+            f"- Записи всех вебинаров\n"
+            f"- Доступ в закрытую группу\n"
+            f"- Готовые шаблоны и промпты\n\n"
+            f"Получитие доступ уже сейчас 👇",
+            reply_markup=keyboard,
+            parse_mode="HTML"
+        )
+
+    except Exception as e:
+        # Сессии уже закрыты: незафиксированная транзакция откатилась при выходе
+        await callback.message.answer(
+            f"❌ Произошла ошибка при создании платежа. "
+            f"Попробуйте позже.\n\nОшибка: {str(e)}"
+        )
@@ -1,13 +1,16 @@
 
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
-from sqlalchemy import select, func
-from sqlalchemy.orm import selectinload
+from sqlalchemy import exists, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import async_session
-from models import User, Webinar
-from keyboards import _get_additional_buttons
-from coin_service import add_coins, get_balance
+from models import User, Webinar, webinar_registrations
+from content import content_registry
+from coin_service import add_coins
+from leaderboard import rank_line
+from media_registry import REGISTRATION_CONFIRMED_PHOTO, media_registry
+from webinar_schedule import webinar_schedule
 
 router = Router()
 
@@ -16,30 +19,26 @@ async def show_next_webinar_handler(callback: CallbackQuery):
     """
     Показывает следующий вебинар и кнопку для подтверждения регистрации.
     """
-    async with async_session() as session:
-        # Находим следующий предстоящий вебинар
-        webinar_result = await session.execute(
-            select(Webinar).where(Webinar.webinar_date > func.now()).order_by(Webinar.webinar_date.asc()).limit(1)
-        )
-        next_webinar = webinar_result.scalar_one_or_none()
-
-        if not next_webinar:
-            await callback.message.answer("К сожалению, сейчас нет запланированных вебинаров.")
-            await callback.answer()
-            return
-
-        keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text="✨ ПОДТВЕРДИТЬ УЧАСТИЕ ✨",
-                        callback_data=f"confirm_registration_{next_webinar.id}",
-                    )
-                ]
+    # Находим следующий предстоящий вебинар в расписании (без запроса к БД)
+    next_webinar = webinar_schedule.next_webinar()
+
+    if not next_webinar:
+        await callback.message.answer("К сожалению, сейчас нет запланированных вебинаров.")
+        await callback.answer()
+        return
+
+    keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="✨ ПОДТВЕРДИТЬ УЧАСТИЕ ✨",
+                    callback_data=f"confirm_registration_{next_webinar.id}",
+                )
             ]
-        )
-        await callback.message.answer(
-            f"""🏁 Финишная прямая!
+        ]
+    )
+    await callback.message.answer(
+        f"""🏁 Финишная прямая!
 
 🗓 Дата: {next_webinar.webinar_date.strftime('%d.%m.%Y')}
 ⏰ Время: {next_webinar.webinar_date.strftime('%H:%M')} МСК
@@ -49,91 +48,75 @@ async def show_next_webinar_handler(callback: CallbackQuery):
 
 За это действие я начислю еще +100 монет! 🪙
 """,
-            reply_markup=keyboard,
-            parse_mode="HTML"
-        )
+        reply_markup=keyboard,
+        parse_mode="HTML"
+    )
     await callback.answer()
 
 
 @router.callback_query(F.data.startswith("confirm_registration_"))
-async def confirm_registration_handler(callback: CallbackQuery):
+async def confirm_registration_handler(callback: CallbackQuery, session: AsyncSession):
     """
     Подтверждает регистрацию пользователя на вебинар.
     """
     webinar_id = int(callback.data.split("_")[-1])
     
-    async with async_session() as session:
-        # Находим пользователя
-        user_result = await session.execute(
-            select(User).options(selectinload(User.webinars)).where(User.telegram_id == callback.from_user.id)
+    # Регистрируем пользователя одним запросом: INSERT ... SELECT находит
+    # пользователя и вебинар, а ON CONFLICT делает повторное нажатие безопасным
+    registration_result = await session.execute(
+        insert(webinar_registrations)
+        .from_select(
+            ['user_id', 'webinar_id'],
+            select(User.id, Webinar.id).where(
+                User.telegram_id == callback.from_user.id,
+                Webinar.id == webinar_id
+            )
         )
-        user = user_result.scalar_one_or_none()
-
-        # Находим вебинар
-        webinar = await session.get(Webinar, webinar_id)
-
-        if not user or not webinar:
+        .on_conflict_do_nothing()
+        .returning(webinar_registrations.c.user_id)
+    )
+
+    if registration_result.first() is None:
+        # Строка не вставлена: регистрация уже есть либо нет пользователя или вебинара
+        already_registered = await session.scalar(
+            select(exists().where(
+                webinar_registrations.c.webinar_id == webinar_id,
+                webinar_registrations.c.user_id == select(User.id).where(
+                    User.telegram_id == callback.from_user.id
+                ).scalar_subquery()
+            ))
+        )
+        await session.commit()
+        if already_registered:
+            await callback.message.answer("Вы уже зарегистрированы на этот вебинар.")
+        else:
             await callback.message.answer("Произошла ошибка. Попробуйте снова.")
-            await callback.answer()
-            return
+        await callback.answer()
+        return
 
-        # Проверяем, не зарегистрирован ли пользователь уже
-        if webinar in user.webinars:
-            await callback.message.answer("Вы уже зарегистрированы на этот вебинар.")
-            await callback.answer()
-            return
-        
-        # Регистрируем пользователя
-        user.webinars.append(webinar)
-        await session.commit()
+    # Начисляем +100 монет только за новую регистрацию (в той же транзакции)
+    balance = await add_coins(
+        telegram_id=callback.from_user.id,
+        amount=100,
+        reason="подтверждение регистрации",
+        description="Бонус за подтверждение регистрации на вебинар",
+        session=session
+    )
 
-        # Начисляем +100 монет при подтверждении регистрации
-        await add_coins(
-            telegram_id=callback.from_user.id,
-            amount=100,
-            reason="подтверждение регистрации",
-            description="Бонус за подтверждение регистрации на вебинар"
-        )
+    # Фиксируем транзакцию и возвращаем соединение в пул до отправки сообщений
+    await session.commit()
 
-        inline_keyboard = []
-        # if webinar.webinar_link: # Используем webinar.webinar_link, а не upcoming_registration.webinar_link
-        #     inline_keyboard.append([
-        #         InlineKeyboardButton(
-        #             text="🎥 Ссылка на вебинар",
-        #             url=webinar.webinar_link,
-        #         )
-        #     ])
-        inline_keyboard.append([
-            InlineKeyboardButton(
-                text="🔐 Закрытая группа по ИИ",
-                url="https://t.me/+VxGcD_UbVJE5NTNi"
-            )
-        ])
-        
-        # Добавляем дополнительные кнопки
-        inline_keyboard.extend(_get_additional_buttons())
-
-        inline_keyboard.append([
-            InlineKeyboardButton(
-                text="ℹ️ Информация о спикере",
-                callback_data="speaker_info"
-            )
-        ])
-        keyboard = InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
+    keyboard = content_registry.member_keyboard()
 
-        # Отправляем изображение
-        image_url = (
-            "https://image2url.com/images/1763061053554-10bed84f-dbf9-44ba-"
-            "b230-8fc9a1549a99.jpeg"
-        )
-        await callback.message.answer_photo(image_url)
+    # Отправляем изображение (по file_id, если оно уже загружено)
+    await media_registry.answer_photo(callback.message, REGISTRATION_CONFIRMED_PHOTO)
 
-        # Отправляем текст сообщения
-        balance = await get_balance(callback.from_user.id)
-        text = f"""🎉 УРА! ТЫ В СПИСКЕ УЧАСТНИКОВ!
+    # Отправляем текст сообщения
+    text = f"""🎉 УРА! ТЫ В СПИСКЕ УЧАСТНИКОВ!
 
 ✅ Регистрация пройдена.
 💰 Твой баланс: {balance} AI-Coins (Ты сможешь обменять их на скидку или бонусы в конце вебинара).
+{rank_line(callback.from_user.id)}
 
 📲 Что дальше:
 Ссылку на вход я пришлю в этот бот:
@@ -145,8 +128,9 @@ async def confirm_registration_handler(callback: CallbackQuery):
 
 👇 Вступай прямо сейчас, пока ссылка активна"""
 
-        await callback.message.answer(
-            text, reply_markup=keyboard, parse_mode="HTML"
-        )
-    
+    await callback.message.answer(
+        text, reply_markup=keyboard, parse_mode="HTML"
+    )
+
+
     await callback.answer()
@@ -1,14 +1,14 @@
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
 
+from media_registry import SPEAKER_PHOTO, media_registry
+
 router = Router()
 
 @router.callback_query(F.data == "speaker_info")
 async def speaker_info_handler(callback: CallbackQuery):
     # Показываем картинку и текст о спикере
-    await callback.message.answer_photo(
-        photo="https://image2url.com/images/1763964646699-74dde895-3472-407b-bf15-37b6b97df485.jpg"
-    )
+    await media_registry.answer_photo(callback.message, SPEAKER_PHOTO)
     text = (
         "🎯 Алексей Левин - руководитель проектов в области искусственного интеллекта и цифровой трансформации бизнеса.\n"
         "Магистр Московского технического университета связи и информатики по направлению «Архитектура информационных систем».\n"
@@ -0,0 +1,249 @@
+"""
+Рейтинг пользователей по балансу AI монет в памяти процесса.
+
+Пользователи хранятся в отсортированном списке (SortedList) пар
+(-баланс, telegram_id), то есть по позиции в рейтинге. Место пользователя
+(1 + число пользователей с большим балансом) находится бинарным поиском, а
+изменение баланса - удаление и вставка пары, все за O(log N), где N - число
+пользователей, независимо от величины балансов. Top-N - первые N элементов.
+
+Рейтинг загружается из БД целиком только при старте, дальше обновляется
+функциями coin_service после фиксации транзакции. Изменения, сделанные
+другими экземплярами бота, подхватываются инкрементально раз в
+LEADERBOARD_RECONCILE_INTERVAL: перечитываются балансы пользователей с
+новыми операциями в журнале (ai_coin_operations после запомненной позиции)
+и очередная страница таблицы users по id, так что со временем сверяется
+каждый пользователь, в том числе новые пользователи без операций.
+
+Операции моложе lag секунд позиция в журнале не проходит: id выдается до
+фиксации транзакции, и меньший id может появиться в журнале позже большего.
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from sortedcontainers import SortedList
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from database import async_session
+from models import AICoinOperation, User
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Ключ в session.info, под которым копятся новые балансы до фиксации транзакции
+_PENDING_KEY = 'pending_leaderboard'
+
+
+class Leaderboard:
+    """Рейтинг по балансу с запросами места и top-N за логарифмическое время."""
+
+    def __init__(self, enabled: bool, reconcile_interval: float = 60.0,
+                 batch_size: int = 5000, sweep_size: int = 1000, lag: float = 60.0):
+        self.enabled = enabled
+        self.reconcile_interval = reconcile_interval
+        self.batch_size = batch_size
+        self.sweep_size = sweep_size
+        self.lag = lag
+
+        self._balances = {}          # telegram_id -> баланс
+        self._ranked = SortedList()  # (-баланс, telegram_id) в порядке рейтинга
+        self._reloading = None  # Изменения, пришедшие во время чтения из БД
+        self._operation_position = 0  # Последняя учтенная операция журнала
+        self._sweep_position = 0      # Последний сверенный users.id
+        self._task = None
+
+    def __len__(self):
+        return len(self._balances)
+
+    def update(self, telegram_id: int, balance: int):
+        """Обновляет баланс пользователя в рейтинге."""
+        if not self.enabled:
+            return
+
+        balance = max(int(balance), 0)
+        if self._reloading is not None:
+            self._reloading[telegram_id] = balance
+
+        old_balance = self._balances.get(telegram_id)
+        if old_balance == balance:
+            return
+        if old_balance is not None:
+            self._ranked.remove((-old_balance, telegram_id))
+        self._ranked.add((-balance, telegram_id))
+        self._balances[telegram_id] = balance
+
+    def rank(self, telegram_id: int):
+        """
+        Возвращает место пользователя (пользователи с равным балансом делят место).
+
+        Returns:
+            Место, начиная с 1, или None, если пользователя нет в рейтинге
+        """
+        balance = self._balances.get(telegram_id)
+        if balance is None:
+            return None
+        # (-balance,) меньше любой пары с тем же балансом: слева только большие балансы
+        return self._ranked.bisect_left((-balance,)) + 1
+
+    def top(self, limit: int) -> list:
+        """Возвращает до limit пар (telegram_id, баланс) по убыванию баланса."""
+        return [
+            (telegram_id, -negative_balance)
+            for negative_balance, telegram_id in self._ranked.islice(0, limit)
+        ]
+
+    def _apply_rows(self, rows):
+        """Применяет прочитанные балансы, кроме перезаписанных локально во время чтения."""
+        changed = self._reloading or {}
+        for telegram_id, balance in rows:
+            if telegram_id not in changed:
+                self.update(telegram_id, balance or 0)
+
+    async def reload(self):
+        """Загружает рейтинг из таблицы users целиком (при старте)."""
+        if not self.enabled:
+            return
+
+        self._reloading = {}
+        try:
+            async with async_session() as session:
+                # Позиция берется до чтения балансов: операции после нее перечитаются
+                position = await session.scalar(select(func.max(AICoinOperation.id)))
+                result = await session.execute(
+                    select(User.telegram_id, User.ai_coins_balance)
+                )
+                rows = result.all()
+
+            balances = {row.telegram_id: max(row.ai_coins_balance or 0, 0) for row in rows}
+            # Изменения, зафиксированные во время чтения, новее снимка
+            balances.update(self._reloading)
+
+            self._balances = balances
+            self._ranked = SortedList(
+                (-balance, telegram_id) for telegram_id, balance in balances.items()
+            )
+            self._operation_position = position or 0
+            self._sweep_position = 0
+        finally:
+            self._reloading = None
+        logger.info(f"Рейтинг загружен: {len(self._balances)} пользователей")
+
+    async def refresh(self) -> int:
+        """
+        Перечитывает балансы пользователей с новыми операциями в журнале и
+        очередную страницу таблицы users.
+
+        Returns:
+            Количество перечитанных пользователей
+        """
+        if not self.enabled:
+            return 0
+
+        cutoff = datetime.now() - timedelta(seconds=self.lag)
+        self._reloading = {}
+        try:
+            async with async_session() as session:
+                result = await session.execute(
+                    select(AICoinOperation.id, AICoinOperation.user_id, AICoinOperation.created_at)
+                    .where(AICoinOperation.id > self._operation_position)
+                    .order_by(AICoinOperation.id)
+                    .limit(self.batch_size)
+                )
+                operations = result.all()
+                user_ids = {operation.user_id for operation in operations}
+
+                changed_rows = []
+                if user_ids:
+                    result = await session.execute(
+                        select(User.telegram_id, User.ai_coins_balance)
+                        .where(User.id.in_(user_ids))
+                    )
+                    changed_rows = result.all()
+
+                result = await session.execute(
+                    select(User.id, User.telegram_id, User.ai_coins_balance)
+                    .where(User.id > self._sweep_position)
+                    .order_by(User.id)
+                    .limit(self.sweep_size)
+                )
+                page = result.all()
+
+            self._apply_rows(changed_rows)
+            self._apply_rows((row.telegram_id, row.ai_coins_balance) for row in page)
+        finally:
+            self._reloading = None
+
+        # Позиция проходит только подряд идущие операции старше lag
+        for operation in operations:
+            if operation.created_at > cutoff:
+                break
+            self._operation_position = operation.id
+        # Страница неполная - обход таблицы начинается заново
+        self._sweep_position = page[-1].id if len(page) == self.sweep_size else 0
+        return len(changed_rows) + len(page)
+
+    async def _reconcile_periodically(self):
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Ошибка сверки рейтинга: {e}", exc_info=True)
+
+    async def start(self):
+        """Загружает рейтинг и запускает периодическую сверку с БД."""
+        if not self.enabled:
+            return
+        await self.reload()
+        if self._task is None:
+            self._task = asyncio.create_task(self._reconcile_periodically())
+
+    async def stop(self):
+        """Останавливает периодическую сверку."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+leaderboard = Leaderboard(
+    enabled=os.getenv('LEADERBOARD_ENABLED', '1') == '1',
+    reconcile_interval=float(os.getenv('LEADERBOARD_RECONCILE_INTERVAL', '60')),
+    batch_size=int(os.getenv('LEADERBOARD_RECONCILE_BATCH_SIZE', '5000')),
+    sweep_size=int(os.getenv('LEADERBOARD_RECONCILE_SWEEP_SIZE', '1000')),
+)
+
+
+def rank_line(telegram_id: int) -> str:
+    """Строка с местом пользователя для сообщений о балансе (пустая, если места нет)."""
+    rank = leaderboard.rank(telegram_id)
+    if rank is None:
+        return ""
+    return f"🏆 Место в рейтинге: {rank} из {len(leaderboard)}"
+
+
+def update_on_commit(session: AsyncSession, telegram_id: int, balance: int):
+    """Откладывает обновление рейтинга до фиксации транзакции сессии."""
+    session.info.setdefault(_PENDING_KEY, {})[telegram_id] = balance
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_committed_balances(session):
+    balances = session.info.pop(_PENDING_KEY, None)
+    if balances:
+        for telegram_id, balance in balances.items():
+            leaderboard.update(telegram_id, balance)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_rolled_back_balances(session):
+    session.info.pop(_PENDING_KEY, None)
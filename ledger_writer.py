@@ -0,0 +1,156 @@
+"""
+Отложенная (write-behind) запись операций с AI монетами.
+
+Изменение баланса всегда выполняется синхронно в coin_service, а строки
+для ai_coin_operations копятся в памяти процесса и записываются пачками
+(многострочным INSERT) по размеру пачки или по таймеру.
+
+Включается переменной окружения LEDGER_WRITE_BEHIND=1.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+from sqlalchemy import event, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from database import async_session
+from models import AICoinOperation
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Ключ в session.info, под которым копятся строки до фиксации транзакции
+_PENDING_KEY = 'pending_ledger_rows'
+
+
+class LedgerWriter:
+    """Буфер операций с монетами с пакетной записью в БД."""
+
+    def __init__(self, enabled: bool, batch_size: int = 500, flush_interval: float = 1.0):
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        # Элементы очереди: (время постановки, строка для INSERT)
+        self._queue = deque()
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self.flushed_total = 0
+
+    def enqueue_many(self, rows: list):
+        """Ставит строки ai_coin_operations в очередь на запись."""
+        now = time.monotonic()
+        self._queue.extend((now, row) for row in rows)
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+
+    def lag(self) -> dict:
+        """
+        Показывает, насколько запись в БД отстает от операций.
+
+        Returns:
+            Словарь с количеством ожидающих строк и возрастом самой старой (сек)
+        """
+        oldest_age = time.monotonic() - self._queue[0][0] if self._queue else 0.0
+        return {
+            'pending': len(self._queue),
+            'oldest_age': oldest_age,
+            'flushed_total': self.flushed_total,
+        }
+
+    async def flush(self):
+        """Записывает все накопленные строки в БД пачками по batch_size."""
+        async with self._flush_lock:
+            while self._queue:
+                batch = [
+                    self._queue.popleft()
+                    for _ in range(min(self.batch_size, len(self._queue)))
+                ]
+                try:
+                    async with async_session() as session:
+                        await session.execute(
+                            insert(AICoinOperation), [row for _, row in batch]
+                        )
+                        await session.commit()
+                except Exception as e:
+                    # Возвращаем пачку в начало очереди, чтобы не потерять операции
+                    self._queue.extendleft(reversed(batch))
+                    logger.error(f"Ошибка при записи операций с монетами: {e}")
+                    raise
+
+                self.flushed_total += len(batch)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+            except Exception:
+                # Ошибка уже залогирована, повторим на следующем тике
+                continue
+
+    async def start(self):
+        """Запускает фоновую запись (если write-behind включен)."""
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(
+                f"Write-behind журнал монет включен: batch_size={self.batch_size}, "
+                f"flush_interval={self.flush_interval}s"
+            )
+
+    async def stop(self):
+        """Останавливает фоновую запись и сбрасывает остаток очереди в БД."""
+        if self._task is not None:
+            # Не прерываем запись пачки на середине: после отмены INSERT неизвестно,
+            # записана ли пачка, и ее нельзя ни вернуть в очередь, ни отбросить
+            async with self._flush_lock:
+                self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self._queue:
+            await self.flush()
+
+
+ledger_writer = LedgerWriter(
+    enabled=os.getenv('LEDGER_WRITE_BEHIND', '0') == '1',
+    batch_size=int(os.getenv('LEDGER_BATCH_SIZE', '500')),
+    flush_interval=float(os.getenv('LEDGER_FLUSH_INTERVAL', '1.0')),
+)
+
+
+def enqueue_on_commit(session: AsyncSession, row: dict):
+    """
+    Откладывает строку ai_coin_operations до фиксации транзакции сессии.
+
+    После COMMIT строка попадает в очередь ledger_writer, при ROLLBACK
+    отбрасывается вместе с изменением баланса.
+    """
+    session.info.setdefault(_PENDING_KEY, []).append(row)
+
+
+@event.listens_for(Session, 'after_commit')
+def _enqueue_committed_rows(session):
+    rows = session.info.pop(_PENDING_KEY, None)
+    if rows:
+        ledger_writer.enqueue_many(rows)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_rolled_back_rows(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -8,17 +8,32 @@ import os
 from aiogram import Bot, Dispatcher
 from aiogram.filters import Command
 from aiogram.enums import ParseMode
-from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
+from aiogram.types import Message
+from aiohttp import web
 from dotenv import load_dotenv
-from sqlalchemy import select
-from sqlalchemy.dialects.postgresql import insert
-from datetime import datetime
-
-from database import async_session
-from models import User, Webinar
-from handlers import personal_direction, business_direction, registration, admin, additional_actions, enroll_course, speaker_info
-from keyboards import _get_additional_buttons
-from coin_service import add_coins, get_balance
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from middlewares.callback_debounce import callback_debounce
+from middlewares.handler_context import HandlerContextMiddleware
+from middlewares.metrics import MetricsMiddleware
+from middlewares.unit_of_work import UnitOfWorkMiddleware
+from update_workers import update_workers
+from metrics import BotApiMetricsMiddleware, start_metrics_server
+from bot_session import PriorityAiohttpSession
+from handlers import direction, registration, admin, additional_actions, enroll_course, speaker_info
+from content import content_registry
+from coin_service import grant_first_visit_bonus
+from ledger_writer import ledger_writer
+from leaderboard import leaderboard
+from balance_reconciler import balance_reconciler
+from media_registry import REGISTERED_WELCOME_PHOTO, WELCOME_PHOTO, media_registry
+from webinar_schedule import webinar_schedule
+from webhook_server import (
+    BOT_MODE, check_webhook_settings, register_webhook, setup_telegram_webhook, start_http_server,
+)
+from payment_notifications import setup_payment_notifications
+from payment_gateway import payment_gateway
+from scheduler import job_scheduler
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -36,13 +51,36 @@ if not BOT_TOKEN:
     logger.error("BOT_TOKEN не найден! Создайте файл .env с токеном бота.")
     exit(1)
 
-bot = Bot(token=BOT_TOKEN)
+# Прием уведомлений об оплате от ЮКассы
+YOOKASSA_NOTIFICATIONS = os.getenv('YOOKASSA_NOTIFICATIONS', '0') == '1'
+
+# Сессия Bot API: пул соединений, приоритет ответов над рассылками, повторы 429/5xx
+bot = Bot(token=BOT_TOKEN, session=PriorityAiohttpSession())
+bot.session.middleware(BotApiMetricsMiddleware())
 dp = Dispatcher()
 
+# Очереди воркеров по пользователям: порядок обновлений одного пользователя
+# и ограничение параллельности (регистрируется первым)
+if update_workers.enabled:
+    dp.update.outer_middleware(update_workers)
+
+# Метрики: задержка обработчиков, SQL-запросы и вызовы Bot API на обновление
+dp.update.outer_middleware(MetricsMiddleware())
+
+# Одна сессия БД на обновление (аргумент session в обработчиках)
+dp.update.outer_middleware(UnitOfWorkMiddleware())
+
+# Имя обработчика для лога медленных запросов
+dp.message.middleware(HandlerContextMiddleware())
+dp.callback_query.middleware(HandlerContextMiddleware())
+
+# Повторные нажатия той же кнопки отбрасываются (CALLBACK_DEBOUNCE_WINDOW);
+# с пулом воркеров - еще при поступлении, до постановки в очередь
+dp.callback_query.middleware(callback_debounce)
+
 # Подключение роутеров
 dp.include_router(admin.router)
-dp.include_router(personal_direction.router)
-dp.include_router(business_direction.router)
+dp.include_router(direction.router)
 dp.include_router(registration.router)
 dp.include_router(additional_actions.router)
 dp.include_router(enroll_course.router)
@@ -50,63 +88,46 @@ dp.include_router(speaker_info.router)
 
 # Обработчик команды /start
 @dp.message(Command("start"))
-async def cmd_start(message: Message):
+async def cmd_start(message: Message, session: AsyncSession):
     """
     Приветственное сообщение при старте бота.
     Проверяет, записан ли пользователь на вебинар.
     """
-    async with async_session() as session:
-        # 1. Проверяем, есть ли у пользователя регистрация на будущий вебинар
-        stmt = select(Webinar).join(User.webinars).where(
-            User.telegram_id == message.from_user.id,
-            Webinar.webinar_date > datetime.now()
-        ).order_by(Webinar.webinar_date.asc()).limit(1)
+    # 1. Проверяем, есть ли у пользователя регистрация на будущий вебинар
+    # (предстоящие вебинары берутся из расписания в памяти)
+    upcoming_registration = await webinar_schedule.next_registered_webinar(
+        session, message.from_user.id
+    )
+
+    # Если регистрации нет, в той же транзакции убеждаемся, что пользователь
+    # существует, и начисляем +100 монет при первом входе (баланс == 0)
+    if not upcoming_registration:
+        await grant_first_visit_bonus(
+            session,
+            telegram_id=message.from_user.id,
+            user_name=message.from_user.username,
+            amount=100,
+            reason="регистрация",
+            description="Бонус за регистрацию при первом входе /start"
+        )
+
+    # Фиксируем транзакцию и возвращаем соединение в пул до отправки сообщений
+    await session.commit()
+
+    # 2. Если регистрация найдена, показываем специальное сообщение
+    if upcoming_registration:
+        keyboard = content_registry.member_keyboard(upcoming_registration.webinar_link)
         
-        result = await session.execute(stmt)
-        upcoming_registration = result.scalar_one_or_none()
-
-        # 2. Если регистрация найдена, показываем специальное сообщение
-        if upcoming_registration:
-            inline_keyboard = []
-            if upcoming_registration.webinar_link:
-                inline_keyboard.append([
-                    InlineKeyboardButton(
-                        text="🎥 Ссылка на вебинар",
-                        url=upcoming_registration.webinar_link,
-                    )
-                ])
-            inline_keyboard.append([
-                InlineKeyboardButton(
-                    text="🔐 Закрытая группа по ИИ",
-                    url="https://t.me/+VxGcD_UbVJE5NTNi"
-                )
-            ])
-            
-            # Добавляем дополнительные кнопки
-            inline_keyboard.extend(_get_additional_buttons())
-
-            inline_keyboard.append([
-                InlineKeyboardButton(
-                    text="ℹ️ Информация о спикере",
-                    callback_data="speaker_info"
-                )
-            ])
-            keyboard = InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
-            
-            # Отправляем изображение
-            image_url = (
-                "https://image2url.com/images/1763063078779-"
-                "f4fbaecb-7fe2-4524-99d5-e65417d77473.jpeg"
-            )
-            await message.answer_photo(image_url)
-
-            # Форматируем дату и время из базы данных
-            webinar_date = upcoming_registration.webinar_date.strftime(
-                '%d.%m.%Y'
-            )
-            webinar_time = upcoming_registration.webinar_date.strftime('%H:%M')
-            
-            text = f"""🎉 <b>Приветсвую тебя, {message.from_user.first_name}!</b>
+        # Отправляем изображение (по file_id, если оно уже загружено)
+        await media_registry.answer_photo(message, REGISTERED_WELCOME_PHOTO)
+
+        # Форматируем дату и время из базы данных
+        webinar_date = upcoming_registration.webinar_date.strftime(
+            '%d.%m.%Y'
+        )
+        webinar_time = upcoming_registration.webinar_date.strftime('%H:%M')
+        
+        text = f"""🎉 <b>Приветсвую тебя, {message.from_user.first_name}!</b>
 Отлично, что вернулся, скоро мы начинаем большое путешествие в мир ИИ! 
 
 <b>Ты зарегистрирован на вебинар: 📅 {webinar_date} в {webinar_time} МСК</b>
@@ -123,50 +144,15 @@ async def cmd_start(message: Message):
 
 ⚡ До встречи! Готовься к мощным знаниям! 🚀"""
 
-            await message.answer(
-                text,
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
-            return
-
-    # 3. Если регистрация не найдена, запускаем стандартный флоу
-    # Сначала убедимся, что пользователь существует в базе
-    async with async_session() as session:
-        insert_stmt = insert(User).values(
-            telegram_id=message.from_user.id,
-            user_name=message.from_user.username
-        ).on_conflict_do_nothing(index_elements=['telegram_id'])
-        await session.execute(insert_stmt)
-        await session.commit()
-
-    # Начисляем +100 монет при первом входе (вход считается новым, если баланс == 0)
-    current_balance = await get_balance(message.from_user.id)
-    if current_balance == 0:
-        await add_coins(
-            telegram_id=message.from_user.id,
-            amount=100,
-            reason="регистрация",
-            description="Бонус за регистрацию при первом входе /start"
+        await message.answer(
+            text,
+            reply_markup=keyboard,
+            parse_mode="HTML"
         )
+        return
 
-    # Показываем стандартное приветствие
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(
-                    text="🧑‍💻 Для личной эффективности (+50 🪙)",
-                    callback_data="direction_personal",
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text="💼 Для бизнеса и масштабирования (+50 🪙)",
-                    callback_data="direction_business",
-                )
-            ],
-        ]
-    )
+    # 3. Если регистрация не найдена, показываем стандартное приветствие
+    keyboard = content_registry.start_keyboard
 
     caption = (
         "👋 Привет!\n"
@@ -180,11 +166,9 @@ async def cmd_start(message: Message):
         "Для каких целей ты хочешь освоить ИИ?"
     )
 
-    await message.answer_photo(
-        photo=(
-            "https://image2url.com/images/"
-            "1762884119936-b5ace70c-3771-4df5-8930-b265953e1e77.jpeg"
-        ),
+    await media_registry.answer_photo(
+        message,
+        WELCOME_PHOTO,
         caption=caption,
         parse_mode=ParseMode.HTML,
         reply_markup=keyboard,
@@ -225,17 +209,76 @@ async def main():
     logger.info("🤖 Бот запускается...")
     logger.info("Я бот и помогу тебе!")
 
+    http_runner = None
     try:
-        # Удаление вебхуков (на случай если были установлены)
-        await bot.delete_webhook(drop_pending_updates=True)
-
-        # Запуск бота
-        logger.info("✅ Бот успешно запущен и готов к работе!")
-        await dp.start_polling(bot)
+        if BOT_MODE == 'webhook':
+            # Без общего секрета и адреса вебхук не запускаем
+            check_webhook_settings()
+
+        # HTTP-сервер метрик Prometheus (если задан METRICS_PORT)
+        start_metrics_server()
+
+        # Фоновая запись журнала монет (если включен write-behind)
+        await ledger_writer.start()
+
+        # Загрузка расписания вебинаров в память
+        await webinar_schedule.start()
+
+        # Рейтинг пользователей по балансу монет
+        await leaderboard.start()
+
+        # Фоновая сверка балансов с журналом операций
+        await balance_reconciler.start()
+
+        # Реестр file_id картинок (и предзагрузка, если задан MEDIA_PRELOAD_CHAT_ID)
+        await media_registry.start(bot)
+
+        # Планировщик напоминаний о вебинарах
+        await job_scheduler.start(bot)
+
+        # Воркеры обработки обновлений
+        update_workers.start()
+
+        # HTTP-сервер: вебхук Telegram и/или уведомления ЮКассы
+        app = web.Application()
+        if BOT_MODE == 'webhook':
+            setup_telegram_webhook(app, bot, dp)
+        if YOOKASSA_NOTIFICATIONS:
+            setup_payment_notifications(app, bot)
+        if app.router.routes():
+            http_runner = await start_http_server(app)
+
+        if BOT_MODE == 'webhook':
+            # Прием обновлений через HTTP-эндпоинт
+            await register_webhook(bot, dp)
+            logger.info("✅ Бот успешно запущен и готов к работе!")
+            await asyncio.Event().wait()
+        else:
+            # Удаление вебхуков (на случай если были установлены)
+            await bot.delete_webhook(drop_pending_updates=True)
+
+            # Запуск бота
+            logger.info("✅ Бот успешно запущен и готов к работе!")
+            # С пулом воркеров обновления не нужно запускать отдельными задачами:
+            # постановка в очередь быстрая, а при заполненной очереди polling ждет
+            await dp.start_polling(bot, handle_as_tasks=not update_workers.enabled)
 
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")
     finally:
+        if http_runner:
+            await http_runner.cleanup()
+
+        # Дообрабатываем принятые обновления
+        await update_workers.stop()
+
+        # Сбрасываем в БД накопленные операции с монетами
+        await ledger_writer.stop()
+        await webinar_schedule.stop()
+        await leaderboard.stop()
+        await balance_reconciler.stop()
+        await job_scheduler.stop()
+        await payment_gateway.close()
         await bot.session.close()
 
 
@@ -0,0 +1,184 @@
+"""
+Реестр file_id медиафайлов, отправляемых ботом.
+
+При первой отправке по URL (или из локального файла) Telegram сам скачивает
+картинку, что при медленном хостинге занимает секунды. Реестр запоминает
+file_id из ответа в таблице media_files и дальше отправляет файл по file_id.
+
+Если задан MEDIA_PRELOAD_CHAT_ID, при старте бота все медиа из PRELOAD_MEDIA,
+которых еще нет в реестре, отправляются в этот служебный чат (и сразу
+удаляются), поэтому ни один пользователь не ждет загрузки.
+"""
+
+import hashlib
+import logging
+import os
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+from dotenv import load_dotenv
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from database import async_session
+from models import MediaFile
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+MEDIA_PRELOAD_CHAT_ID = os.getenv('MEDIA_PRELOAD_CHAT_ID')
+
+# Картинки воронки
+WELCOME_PHOTO = (
+    "https://image2url.com/images/"
+    "1762884119936-b5ace70c-3771-4df5-8930-b265953e1e77.jpeg"
+)
+REGISTERED_WELCOME_PHOTO = (
+    "https://image2url.com/images/1763063078779-"
+    "f4fbaecb-7fe2-4524-99d5-e65417d77473.jpeg"
+)
+REGISTRATION_CONFIRMED_PHOTO = (
+    "https://image2url.com/images/1763061053554-10bed84f-dbf9-44ba-"
+    "b230-8fc9a1549a99.jpeg"
+)
+SPEAKER_PHOTO = (
+    "https://image2url.com/images/"
+    "1763964646699-74dde895-3472-407b-bf15-37b6b97df485.jpg"
+)
+COURSE_PHOTO = (
+    "https://image2url.com/images/"
+    "1763093675664-50aea332-8b0b-4d62-89ac-d06086940beb.jpeg"
+)
+
+# Медиа для загрузки при старте: (тип, URL или путь к файлу)
+PRELOAD_MEDIA = [
+    ('photo', WELCOME_PHOTO),
+    ('photo', REGISTERED_WELCOME_PHOTO),
+    ('photo', REGISTRATION_CONFIRMED_PHOTO),
+    ('photo', SPEAKER_PHOTO),
+    ('photo', COURSE_PHOTO),
+]
+
+
+def source_key(source: str) -> str:
+    """Ключ реестра: URL как есть, для локального файла - хэш содержимого."""
+    if os.path.isfile(source):
+        digest = hashlib.sha256()
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return f"sha256:{digest.hexdigest()}"
+    return source
+
+
+def _uploaded_file(message: Message, media_type: str):
+    """Возвращает (file_id, file_unique_id) медиа из отправленного сообщения."""
+    if media_type == 'photo' and message.photo:
+        # Берем самый большой размер
+        photo = message.photo[-1]
+        return photo.file_id, photo.file_unique_id
+    if media_type == 'video' and message.video:
+        return message.video.file_id, message.video.file_unique_id
+    return None, None
+
+
+class MediaRegistry:
+    """Кэш file_id в памяти с хранением в таблице media_files."""
+
+    def __init__(self):
+        self._file_ids = {}  # ключ источника -> file_id
+        self._keys = {}      # путь/URL -> ключ (хэш файла считается один раз)
+
+    def _key(self, source: str) -> str:
+        key = self._keys.get(source)
+        if key is None:
+            key = self._keys[source] = source_key(source)
+        return key
+
+    def file_id(self, source: str):
+        """Возвращает сохраненный file_id или None."""
+        return self._file_ids.get(self._key(source))
+
+    async def load(self):
+        """Загружает реестр из БД."""
+        async with async_session() as session:
+            result = await session.execute(select(MediaFile.source, MediaFile.file_id))
+            self._file_ids = dict(result.all())
+        logger.info(f"Реестр медиа загружен: {len(self._file_ids)} файлов")
+
+    async def _remember(self, key: str, media_type: str, sent: Message):
+        if not isinstance(sent, Message):
+            return
+        file_id, file_unique_id = _uploaded_file(sent, media_type)
+        if not file_id:
+            return
+        self._file_ids[key] = file_id
+
+        values = {'media_type': media_type, 'file_id': file_id, 'file_unique_id': file_unique_id}
+        try:
+            async with async_session() as session:
+                await session.execute(
+                    insert(MediaFile)
+                    .values(source=key, **values)
+                    .on_conflict_do_update(
+                        index_elements=['source'],
+                        set_={**values, 'updated_at': func.now()}
+                    )
+                )
+                await session.commit()
+        except Exception as e:
+            # file_id останется в памяти, в БД попадет при следующей загрузке
+            logger.error(f"Не удалось сохранить file_id для {key}: {e}")
+
+    async def _send(self, send, media_type: str, source: str, **kwargs) -> Message:
+        """
+        Отправляет медиа функцией send(photo=.../video=..., **kwargs): по file_id,
+        если он известен, иначе по URL/файлу с сохранением полученного file_id.
+        """
+        key = self._key(source)
+        file_id = self._file_ids.get(key)
+        if file_id:
+            try:
+                return await send(**{media_type: file_id}, **kwargs)
+            except TelegramBadRequest as e:
+                # file_id мог стать недействительным (например, после смены бота)
+                logger.warning(f"file_id для {key} отклонен ({e}), загружаем заново")
+                self._file_ids.pop(key, None)
+
+        media = FSInputFile(source) if os.path.isfile(source) else source
+        sent = await send(**{media_type: media}, **kwargs)
+        await self._remember(key, media_type, sent)
+        return sent
+
+    async def answer_photo(self, message: Message, source: str, **kwargs) -> Message:
+        """Аналог message.answer_photo(source, ...) с повторным использованием file_id."""
+        return await self._send(message.answer_photo, 'photo', source, **kwargs)
+
+    async def answer_video(self, message: Message, source: str, **kwargs) -> Message:
+        """Аналог message.answer_video(source, ...) с повторным использованием file_id."""
+        return await self._send(message.answer_video, 'video', source, **kwargs)
+
+    async def preload(self, bot: Bot, chat_id: int):
+        """Загружает в Telegram медиа из PRELOAD_MEDIA, которых нет в реестре."""
+        senders = {'photo': bot.send_photo, 'video': bot.send_video}
+        for media_type, source in PRELOAD_MEDIA:
+            if self.file_id(source):
+                continue
+            try:
+                sent = await self._send(
+                    senders[media_type], media_type, source,
+                    chat_id=chat_id, disable_notification=True
+                )
+                await bot.delete_message(chat_id, sent.message_id)
+            except TelegramAPIError as e:
+                logger.error(f"Не удалось предзагрузить {source}: {e}")
+
+    async def start(self, bot: Bot):
+        """Загружает реестр и, если задан MEDIA_PRELOAD_CHAT_ID, предзагружает медиа."""
+        await self.load()
+        if MEDIA_PRELOAD_CHAT_ID:
+            await self.preload(bot, int(MEDIA_PRELOAD_CHAT_ID))
+
+
+media_registry = MediaRegistry()
@@ -0,0 +1,178 @@
+"""
+Метрики бота в формате Prometheus.
+
+- задержка обработки обновлений по обработчикам;
+- количество SQL-запросов на обновление (по событиям движка SQLAlchemy);
+- количество и задержка вызовов Bot API (middleware сессии бота);
+- глубина очередей воркеров и время ожидания обновлений в них;
+- скорость сверки балансов с журналом и найденные расхождения.
+
+Метрики отдаются HTTP-сервером prometheus_client на METRICS_PORT
+(0 - сервер не запускается).
+"""
+
+import logging
+import os
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from dotenv import load_dotenv
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from sqlalchemy import event
+
+from database import engine
+from balance_cache import balance_cache
+from ledger_writer import ledger_writer
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+HANDLER_LATENCY = Histogram(
+    'bot_handler_latency_seconds',
+    'Время обработки обновления',
+    ['handler'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+UPDATE_DB_STATEMENTS = Histogram(
+    'bot_update_db_statements',
+    'Количество SQL-запросов на одно обновление',
+    ['handler'],
+    buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 50),
+)
+UPDATE_API_CALLS = Histogram(
+    'bot_update_api_calls',
+    'Количество вызовов Bot API на одно обновление',
+    ['handler'],
+    buckets=(0, 1, 2, 3, 4, 5, 8, 10, 20),
+)
+UPDATE_ERRORS = Counter(
+    'bot_update_errors_total',
+    'Обновления, завершившиеся исключением',
+    ['handler'],
+)
+DB_STATEMENTS = Counter(
+    'bot_db_statements_total',
+    'SQL-запросы по обработчикам',
+    ['handler'],
+)
+API_CALLS = Counter(
+    'bot_api_calls_total',
+    'Вызовы Bot API',
+    ['method'],
+)
+API_ERRORS = Counter(
+    'bot_api_errors_total',
+    'Ошибки вызовов Bot API',
+    ['method'],
+)
+API_LATENCY = Histogram(
+    'bot_api_latency_seconds',
+    'Задержка вызовов Bot API',
+    ['method'],
+    buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+UPDATE_QUEUE_DEPTH = Gauge(
+    'bot_update_queue_depth',
+    'Обновления в очереди воркера',
+    ['worker'],
+)
+UPDATE_QUEUE_WAIT = Histogram(
+    'bot_update_queue_wait_seconds',
+    'Время ожидания обновления в очереди воркера',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+UPDATE_QUEUE_FULL = Counter(
+    'bot_update_queue_full_total',
+    'Постановки в заполненную очередь (сработало обратное давление)',
+)
+CALLBACK_DUPLICATES = Counter(
+    'bot_callback_duplicates_total',
+    'Повторные нажатия кнопок, отброшенные без обработки',
+    ['handler'],
+)
+CALLBACK_SAVED_SECONDS = Counter(
+    'bot_callback_saved_seconds_total',
+    'Оценка сэкономленного времени обработчиков (средняя длительность x отброшенные)',
+    ['handler'],
+)
+RECONCILE_ROWS = Counter(
+    'bot_reconcile_rows_total',
+    'Строки журнала монет, учтенные сверкой балансов',
+)
+RECONCILE_ROWS_PER_SEC = Gauge(
+    'bot_reconcile_rows_per_second',
+    'Скорость последнего цикла сверки балансов, строк журнала в секунду',
+)
+RECONCILE_MISMATCHES = Counter(
+    'bot_reconcile_mismatches_total',
+    'Подтвержденные расхождения баланса с журналом',
+    ['action'],
+)
+
+Gauge('bot_balance_cache_hits', 'Попадания в кэш балансов').set_function(
+    lambda: balance_cache.hits
+)
+Gauge('bot_balance_cache_misses', 'Промахи кэша балансов').set_function(
+    lambda: balance_cache.misses
+)
+Gauge('bot_ledger_pending_rows', 'Операции с монетами, ожидающие записи').set_function(
+    lambda: ledger_writer.lag()['pending']
+)
+Gauge('bot_ledger_lag_seconds', 'Возраст самой старой неподтвержденной операции').set_function(
+    lambda: ledger_writer.lag()['oldest_age']
+)
+
+
+@dataclass
+class UpdateStats:
+    """Счетчики одного обновления (заполняются по ходу обработки)."""
+
+    handler: str = '-'
+    db_statements: int = 0
+    api_calls: int = 0
+
+
+current_update_stats: ContextVar[UpdateStats] = ContextVar('current_update_stats', default=None)
+
+
+@event.listens_for(engine.sync_engine, 'after_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    stats = current_update_stats.get()
+    if stats is not None:
+        stats.db_statements += 1
+        DB_STATEMENTS.labels(stats.handler).inc()
+    else:
+        DB_STATEMENTS.labels('background').inc()
+
+
+class BotApiMetricsMiddleware(BaseRequestMiddleware):
+    """Считает вызовы Bot API и их задержку."""
+
+    async def __call__(self, make_request, bot: Bot, method):
+        method_name = type(method).__name__
+        stats = current_update_stats.get()
+        if stats is not None:
+            stats.api_calls += 1
+
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            API_ERRORS.labels(method_name).inc()
+            raise
+        finally:
+            API_CALLS.labels(method_name).inc()
+            API_LATENCY.labels(method_name).observe(time.perf_counter() - started)
+
+
+def start_metrics_server():
+    """Запускает HTTP-сервер с метриками (если задан METRICS_PORT)."""
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT, addr=METRICS_HOST)
+        logger.info(f"Метрики Prometheus: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
@@ -0,0 +1 @@
+from . import callback_debounce, handler_context, metrics, unit_of_work
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import CallbackQuery
+from dotenv import load_dotenv
+
+from metrics import CALLBACK_DUPLICATES, CALLBACK_SAVED_SECONDS
+from middlewares.handler_context import handler_name
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+CALLBACK_DEBOUNCE_WINDOW = float(os.getenv('CALLBACK_DEBOUNCE_WINDOW', '2'))
+CALLBACK_DEBOUNCE_SIZE = int(os.getenv('CALLBACK_DEBOUNCE_SIZE', '10000'))
+
+
+class CallbackDebounceMiddleware(BaseMiddleware):
+    """
+    Отбрасывает повторные нажатия той же кнопки тем же пользователем
+    в течение window секунд (включая нажатия, пришедшие, пока первое
+    еще обрабатывается). На дубликат сразу отвечается пустым
+    callback.answer(), чтобы у пользователя погас индикатор загрузки.
+
+    С пулом воркеров (update_workers) решение принимается при поступлении
+    обновления, до постановки в очередь (check_arrival): иначе окно
+    отсчитывалось бы от начала обработки, и повтор, ждущий в очереди за
+    медленным обработчиком, проходил бы. Без пула проверка выполняется
+    здесь, перед обработчиком.
+
+    Ключи (пользователь, callback_data) хранятся в OrderedDict не более
+    maxsize штук, самые старые вытесняются. Для оценки сэкономленной
+    работы запоминается средняя длительность каждого обработчика.
+    """
+
+    def __init__(self, window: float = CALLBACK_DEBOUNCE_WINDOW,
+                 maxsize: int = CALLBACK_DEBOUNCE_SIZE):
+        self.window = window
+        self.maxsize = maxsize
+
+        # (user_id, data) -> [момент, до которого повторы отбрасываются, имя обработчика]
+        self._recent = OrderedDict()
+        # ID нажатий, пропущенных проверкой при поступлении
+        self._admitted = OrderedDict()
+        # Имя обработчика -> скользящее среднее длительности (сек)
+        self._durations = {}
+        # Ответы на отброшенные при поступлении нажатия
+        self._answers = set()
+
+    def _is_duplicate(self, key: tuple) -> bool:
+        now = time.monotonic()
+        entry = self._recent.get(key)
+        if entry is not None and entry[0] > now:
+            return True
+
+        self._recent[key] = [now + self.window, entry[1] if entry else None]
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.maxsize:
+            self._recent.popitem(last=False)
+        return False
+
+    def _count_duplicate(self, name: str):
+        CALLBACK_DUPLICATES.labels(name).inc()
+        CALLBACK_SAVED_SECONDS.labels(name).inc(self._durations.get(name, 0.0))
+
+    async def _answer(self, event: CallbackQuery):
+        try:
+            await event.answer()
+        except TelegramAPIError as e:
+            logger.debug(f"Не удалось ответить на повторное нажатие: {e}")
+
+    def check_arrival(self, event: CallbackQuery) -> bool:
+        """
+        Проверяет нажатие при поступлении, до постановки в очередь.
+
+        Returns:
+            True, если это повтор: он отброшен, ответ отправляется в фоне
+        """
+        if not self.window:
+            return False
+
+        key = (event.from_user.id, event.data)
+        if self._is_duplicate(key):
+            # Имя обработчика известно, если первое нажатие уже обработано
+            self._count_duplicate(self._recent[key][1] or '-')
+            task = asyncio.create_task(self._answer(event))
+            self._answers.add(task)
+            task.add_done_callback(self._answers.discard)
+            return True
+
+        self._admitted[event.id] = None
+        while len(self._admitted) > self.maxsize:
+            self._admitted.popitem(last=False)
+        return False
+
+    async def __call__(
+        self,
+        handler: Callable[[CallbackQuery, Dict[str, Any]], Awaitable[Any]],
+        event: CallbackQuery,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not self.window or not isinstance(event, CallbackQuery):
+            return await handler(event, data)
+
+        name = handler_name(data)
+        key = (event.from_user.id, event.data)
+        if event.id in self._admitted:
+            # Нажатие уже проверено при поступлении
+            del self._admitted[event.id]
+        elif self._is_duplicate(key):
+            self._count_duplicate(name)
+            await self._answer(event)
+            return None
+
+        entry = self._recent.get(key)
+        if entry is not None:
+            entry[1] = name
+
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            duration = time.perf_counter() - started
+            average = self._durations.get(name)
+            self._durations[name] = duration if average is None else 0.9 * average + 0.1 * duration
+
+
+callback_debounce = CallbackDebounceMiddleware()
@@ -0,0 +1,42 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from database import current_handler
+from metrics import current_update_stats
+
+
+def handler_name(data: Dict[str, Any]) -> str:
+    """Возвращает имя обработчика в виде module.function."""
+    handler = data.get('handler')
+    if handler is None:
+        return '-'
+    callback = handler.callback
+    return f"{callback.__module__}.{callback.__name__}"
+
+
+class HandlerContextMiddleware(BaseMiddleware):
+    """
+    Запоминает имя выполняемого обработчика в current_handler,
+    чтобы лог медленных запросов и метрики показывали, откуда пришел запрос.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        name = handler_name(data)
+        token = current_handler.set(name)
+
+        # Подписываем метрики обновления именем обработчика
+        stats = current_update_stats.get()
+        if stats is not None:
+            stats.handler = name
+
+        try:
+            return await handler(event, data)
+        finally:
+            current_handler.reset(token)
@@ -0,0 +1,42 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from metrics import (
+    HANDLER_LATENCY,
+    UPDATE_API_CALLS,
+    UPDATE_DB_STATEMENTS,
+    UPDATE_ERRORS,
+    UpdateStats,
+    current_update_stats,
+)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Внешний middleware на dp.update: измеряет время обработки обновления,
+    количество SQL-запросов и вызовов Bot API. Имя обработчика подставляет
+    HandlerContextMiddleware.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        stats = UpdateStats()
+        token = current_update_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            UPDATE_ERRORS.labels(stats.handler).inc()
+            raise
+        finally:
+            current_update_stats.reset(token)
+            HANDLER_LATENCY.labels(stats.handler).observe(time.perf_counter() - started)
+            UPDATE_DB_STATEMENTS.labels(stats.handler).observe(stats.db_statements)
+            UPDATE_API_CALLS.labels(stats.handler).observe(stats.api_calls)
@@ -0,0 +1,35 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from database import async_session
+
+
+class UnitOfWorkMiddleware(BaseMiddleware):
+    """
+    Открывает одну сессию БД на обновление и передает ее обработчикам
+    как аргумент session. После обработчика транзакция фиксируется,
+    при исключении - откатывается.
+
+    Сессия берет соединение из пула только при первом запросе, поэтому
+    обновления без работы с БД пул не занимают. Обработчик может сам
+    вызвать session.commit() перед долгими вызовами Bot API, чтобы
+    вернуть соединение в пул раньше.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        async with async_session() as session:
+            data['session'] = session
+            try:
+                result = await handler(event, data)
+            except Exception:
+                await session.rollback()
+                raise
+            await session.commit()
+            return result
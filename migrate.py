@@ -0,0 +1,363 @@
+"""
+Версионные миграции схемы БД.
+
+Миграции лежат в migrations/versions и применяются по возрастанию номера:
+- NNNN_name.sql - SQL-скрипт;
+- NNNN_name.py - модуль с функцией upgrade(connection), которой передается
+  AsyncConnection (так таблицы создаются по метаданным models.py).
+
+Примененные версии хранятся в таблице schema_migrations вместе с
+контрольной суммой файла. Изменение уже примененной миграции считается
+ошибкой: исправление оформляется новой миграцией. Одновременно миграции
+применяет только один процесс (advisory-блокировка).
+
+statement_timeout рабочего пула (DB_STATEMENT_TIMEOUT_MS) на миграции не
+действует: их соединения выполняются с statement_timeout = 0, иначе
+построение индекса на большой таблице отменялось бы по таймауту.
+
+SQL-миграция с первой строкой "-- migrate: no-transaction" выполняется по
+одной команде вне транзакции (нужно для CREATE INDEX CONCURRENTLY). Команды
+такой миграции должны быть повторяемыми (IF NOT EXISTS): после сбоя она
+выполняется заново целиком. Невалидный индекс, оставшийся от прерванного
+CREATE INDEX CONCURRENTLY, удаляется перед повторным построением.
+
+Команда check сравнивает индексы из models.py с индексами в БД по набору
+колонок и выводит отсутствующие.
+
+Запуск:
+    python migrate.py            # применить новые миграции
+    python migrate.py status     # состояние миграций
+    python migrate.py check      # индексы models.py, которых нет в БД
+"""
+
+import argparse
+import asyncio
+import hashlib
+import importlib.util
+import logging
+import re
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
+from sqlalchemy.pool import NullPool
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).parent / 'migrations' / 'versions'
+NO_TRANSACTION_MARKER = '-- migrate: no-transaction'
+
+# Ключ advisory-блокировки миграций
+MIGRATION_LOCK_ID = 7_411_202_401
+
+_FILE_PATTERN = re.compile(r'^(\d{4})_(\w+)\.(sql|py)$')
+_CONCURRENT_INDEX = re.compile(
+    r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)',
+    re.IGNORECASE
+)
+
+_CREATE_MIGRATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR NOT NULL,
+    checksum VARCHAR(64) NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    duration_ms INTEGER NOT NULL
+)
+"""
+
+# Индексы текущей схемы: таблица и колонки ключа по порядку
+_DATABASE_INDEXES = """
+SELECT t.relname AS table_name,
+       array_agg(a.attname ORDER BY k.ord) AS columns
+FROM pg_index i
+JOIN pg_class t ON t.oid = i.indrelid
+JOIN pg_namespace n ON n.oid = t.relnamespace
+CROSS JOIN LATERAL unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, ord)
+JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+WHERE n.nspname = current_schema() AND i.indisvalid
+GROUP BY i.indexrelid, t.relname
+"""
+
+
+class MigrationError(Exception):
+    """Ошибка применения миграций."""
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    path: Path
+    checksum: str
+
+    @property
+    def is_sql(self) -> bool:
+        return self.path.suffix == '.sql'
+
+    @property
+    def transactional(self) -> bool:
+        if not self.is_sql:
+            return True
+        first_line = self.path.read_text(encoding='utf-8').lstrip().split('\n', 1)[0]
+        return first_line.strip().lower() != NO_TRANSACTION_MARKER
+
+
+def discover(directory: Path = MIGRATIONS_DIR) -> list:
+    """Возвращает миграции каталога по возрастанию версии."""
+    migrations = {}
+    for path in sorted(directory.iterdir()):
+        match = _FILE_PATTERN.match(path.name)
+        if not match:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise MigrationError(
+                f"Две миграции с версией {version}: {migrations[version].path.name} и {path.name}"
+            )
+        migrations[version] = Migration(
+            version=version,
+            name=match.group(2),
+            path=path,
+            checksum=hashlib.sha256(path.read_bytes()).hexdigest(),
+        )
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def split_statements(sql: str) -> list:
+    """
+    Делит SQL-скрипт на команды по ";" с учетом строк, идентификаторов в
+    кавычках, $$-блоков и комментариев.
+    """
+    statements = []
+    current = []
+    i, length = 0, len(sql)
+    while i < length:
+        char = sql[i]
+        if sql.startswith('--', i):
+            end = sql.find('\n', i)
+            i = length if end == -1 else end + 1
+            current.append('\n')
+            continue
+        if sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            i = length if end == -1 else end + 2
+            current.append(' ')
+            continue
+        if char in ("'", '"'):
+            end = i + 1
+            while end < length:
+                if sql[end] == char:
+                    if sql.startswith(char * 2, end):
+                        end += 2  # Экранированная кавычка
+                        continue
+                    break
+                end += 1
+            current.append(sql[i:end + 1])
+            i = end + 1
+            continue
+        if char == '$':
+            tag = re.match(r'\$\w*\$', sql[i:])
+            if tag:
+                end = sql.find(tag.group(0), i + len(tag.group(0)))
+                end = length if end == -1 else end + len(tag.group(0))
+                current.append(sql[i:end])
+                i = end
+                continue
+        if char == ';':
+            statement = ''.join(current).strip()
+            if statement:
+                statements.append(statement)
+            current = []
+            i += 1
+            continue
+        current.append(char)
+        i += 1
+
+    statement = ''.join(current).strip()
+    if statement:
+        statements.append(statement)
+    return statements
+
+
+def _load_upgrade(migration: Migration):
+    spec = importlib.util.spec_from_file_location(
+        f"migration_{migration.version:04d}_{migration.name}", migration.path
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    upgrade = getattr(module, 'upgrade', None)
+    if upgrade is None:
+        raise MigrationError(f"В {migration.path.name} нет функции upgrade(connection)")
+    return upgrade
+
+
+class MigrationRunner:
+    """Применяет миграции из каталога к БД движка engine."""
+
+    def __init__(self, engine: AsyncEngine, directory: Path = MIGRATIONS_DIR):
+        self.engine = engine
+        self.directory = directory
+
+    async def _applied(self, conn: AsyncConnection) -> dict:
+        await conn.exec_driver_sql(_CREATE_MIGRATIONS_TABLE)
+        result = await conn.execute(
+            text("SELECT version, name, checksum FROM schema_migrations")
+        )
+        return {row.version: row for row in result}
+
+    def _verify(self, migrations: list, applied: dict):
+        """Проверяет, что примененные миграции не изменились."""
+        known = {migration.version: migration for migration in migrations}
+        for version, row in applied.items():
+            migration = known.get(version)
+            if migration is None:
+                logger.warning(f"Миграция {version:04d}_{row.name} применена, но файла нет")
+            elif migration.checksum != row.checksum:
+                raise MigrationError(
+                    f"Миграция {migration.path.name} изменена после применения "
+                    f"(контрольная сумма не совпадает). Оформите изменение новой миграцией."
+                )
+
+    async def _record(self, conn: AsyncConnection, migration: Migration, duration_ms: int):
+        await conn.execute(
+            text(
+                "INSERT INTO schema_migrations (version, name, checksum, duration_ms) "
+                "VALUES (:version, :name, :checksum, :duration_ms)"
+            ),
+            {
+                'version': migration.version,
+                'name': migration.name,
+                'checksum': migration.checksum,
+                'duration_ms': duration_ms,
+            }
+        )
+
+    async def _drop_invalid_index(self, conn: AsyncConnection, index_name: str):
+        """Удаляет невалидный индекс, оставшийся от прерванного CONCURRENTLY."""
+        invalid = await conn.scalar(
+            text("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+            {'name': index_name}
+        )
+        if invalid:
+            logger.warning(f"Индекс {index_name} невалиден (прерванное построение), пересоздаем")
+            await conn.exec_driver_sql(f'DROP INDEX CONCURRENTLY IF EXISTS "{index_name}"')
+
+    async def _apply(self, lock_conn: AsyncConnection, migration: Migration):
+        started = time.perf_counter()
+        if migration.transactional:
+            async with self.engine.begin() as conn:
+                await conn.exec_driver_sql('SET LOCAL statement_timeout = 0')
+                if migration.is_sql:
+                    for statement in split_statements(migration.path.read_text(encoding='utf-8')):
+                        await conn.exec_driver_sql(statement)
+                else:
+                    await _load_upgrade(migration)(conn)
+                await self._record(conn, migration, int((time.perf_counter() - started) * 1000))
+            return
+
+        # Вне транзакции: соединение с блокировкой работает в режиме AUTOCOMMIT
+        for statement in split_statements(migration.path.read_text(encoding='utf-8')):
+            index = _CONCURRENT_INDEX.match(statement)
+            if index:
+                await self._drop_invalid_index(lock_conn, index.group(1))
+            await lock_conn.exec_driver_sql(statement)
+        await self._record(lock_conn, migration, int((time.perf_counter() - started) * 1000))
+
+    async def upgrade(self) -> list:
+        """Применяет новые миграции и возвращает их список."""
+        migrations = discover(self.directory)
+        applied_now = []
+        async with self.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+            # Без таймаута: ожидание блокировки и CREATE INDEX CONCURRENTLY бывают долгими
+            await conn.exec_driver_sql('SET statement_timeout = 0')
+            await conn.execute(text("SELECT pg_advisory_lock(:id)"), {'id': MIGRATION_LOCK_ID})
+            try:
+                applied = await self._applied(conn)
+                self._verify(migrations, applied)
+                for migration in migrations:
+                    if migration.version in applied:
+                        continue
+                    logger.info(f"Применяется миграция {migration.path.name}")
+                    try:
+                        await self._apply(conn, migration)
+                    except Exception as e:
+                        raise MigrationError(f"Миграция {migration.path.name} не применена: {e}") from e
+                    applied_now.append(migration)
+            finally:
+                await conn.execute(text("SELECT pg_advisory_unlock(:id)"), {'id': MIGRATION_LOCK_ID})
+                # Соединение вернется в пул: восстанавливаем таймаут из настроек подключения
+                await conn.exec_driver_sql('RESET statement_timeout')
+        return applied_now
+
+    async def status(self) -> list:
+        """Возвращает пары (миграция, состояние): applied / pending / changed."""
+        migrations = discover(self.directory)
+        async with self.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+            applied = await self._applied(conn)
+
+        states = []
+        for migration in migrations:
+            row = applied.get(migration.version)
+            if row is None:
+                states.append((migration, 'pending'))
+            elif row.checksum != migration.checksum:
+                states.append((migration, 'changed'))
+            else:
+                states.append((migration, 'applied'))
+        return states
+
+    async def missing_indexes(self, metadata) -> list:
+        """Индексы metadata, для которых в БД нет индекса с тем же набором колонок."""
+        async with self.engine.connect() as conn:
+            result = await conn.execute(text(_DATABASE_INDEXES))
+            existing = {(row.table_name, tuple(row.columns)) for row in result}
+
+        missing = []
+        for table in metadata.sorted_tables:
+            for index in table.indexes:
+                columns = tuple(column.name for column in index.columns)
+                if (table.name, columns) not in existing:
+                    missing.append(f"{table.name}.{index.name} ({', '.join(columns)})")
+        return missing
+
+
+async def main(args):
+    from database import DATABASE_URL
+    from models import Base
+
+    # Отдельный движок без statement_timeout и пула рабочего процесса
+    engine = create_async_engine(DATABASE_URL, poolclass=NullPool)
+    runner = MigrationRunner(engine)
+    try:
+        if args.command == 'status':
+            for migration, state in await runner.status():
+                print(f"{state:8} {migration.path.name}")
+        elif args.command == 'check':
+            missing = await runner.missing_indexes(Base.metadata)
+            for index in missing:
+                print(f"Нет индекса: {index}")
+            if missing:
+                raise SystemExit(1)
+            print("Все индексы models.py есть в БД")
+        else:
+            applied = await runner.upgrade()
+            if applied:
+                for migration in applied:
+                    print(f"Применена {migration.path.name}")
+            else:
+                print("Новых миграций нет")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    parser.add_argument('command', nargs='?', default='upgrade',
+                        choices=['upgrade', 'status', 'check'])
+    asyncio.run(main(parser.parse_args()))
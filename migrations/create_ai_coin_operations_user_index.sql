@@ -0,0 +1,4 @@
+-- Индекс для истории операций пользователя (/user_stats):
+-- последние операции и keyset-пагинация по (created_at, id)
+CREATE INDEX IF NOT EXISTS ix_ai_coin_operations_user_id_created_at
+    ON ai_coin_operations(user_id, created_at DESC, id DESC);
@@ -7,12 +7,14 @@ CREATE TABLE IF NOT EXISTS ai_coin_operations (
     reason VARCHAR(255),
     description TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL,
-    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-    INDEX idx_user_id (user_id),
-    INDEX idx_created_at (created_at),
-    INDEX idx_operation_type (operation_type)
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
+-- В PostgreSQL индексы создаются отдельными командами, а не внутри CREATE TABLE
+CREATE INDEX IF NOT EXISTS idx_ai_coin_operations_user_id ON ai_coin_operations(user_id);
+CREATE INDEX IF NOT EXISTS idx_ai_coin_operations_created_at ON ai_coin_operations(created_at);
+CREATE INDEX IF NOT EXISTS idx_ai_coin_operations_operation_type ON ai_coin_operations(operation_type);
+
 -- Добавляем колонку ai_coins_balance в таблицу users, если её еще нет
 ALTER TABLE users ADD COLUMN IF NOT EXISTS ai_coins_balance INTEGER DEFAULT 0 NOT NULL;
 
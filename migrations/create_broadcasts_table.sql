@@ -0,0 +1,12 @@
+-- Таблица прогресса рассылок (контрольные точки для продолжения после сбоя)
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id SERIAL PRIMARY KEY,
+    broadcast_key VARCHAR NOT NULL UNIQUE,
+    webinar_id INTEGER REFERENCES webinars(id) ON DELETE CASCADE,
+    status VARCHAR NOT NULL DEFAULT 'running',
+    last_user_id INTEGER NOT NULL DEFAULT 0,
+    sent_count INTEGER NOT NULL DEFAULT 0,
+    failed_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,10 @@
+-- file_id медиафайлов, уже загруженных в Telegram (ключ - URL или хэш файла)
+CREATE TABLE IF NOT EXISTS media_files (
+    id SERIAL PRIMARY KEY,
+    source VARCHAR NOT NULL UNIQUE,
+    media_type VARCHAR NOT NULL,
+    file_id VARCHAR NOT NULL,
+    file_unique_id VARCHAR,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,17 @@
+-- Таблица отложенных заданий (напоминания о вебинарах)
+CREATE TABLE IF NOT EXISTS scheduled_jobs (
+    id SERIAL PRIMARY KEY,
+    job_type VARCHAR NOT NULL,
+    dedup_key VARCHAR NOT NULL UNIQUE,
+    webinar_id INTEGER REFERENCES webinars(id) ON DELETE CASCADE,
+    run_at TIMESTAMP NOT NULL,
+    status VARCHAR NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    locked_until TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- Индекс для выборки ближайших заданий исполнителями
+CREATE INDEX IF NOT EXISTS ix_scheduled_jobs_status_run_at ON scheduled_jobs(status, run_at);
@@ -0,0 +1,10 @@
+-- Типы ENUM, на которые ссылаются модели (в models.py create_type=False)
+DO $$
+BEGIN
+    IF to_regtype('payment_status') IS NULL THEN
+        CREATE TYPE payment_status AS ENUM ('pending', 'succeeded', 'canceled', 'failed');
+    END IF;
+    IF to_regtype('coin_operation_type') IS NULL THEN
+        CREATE TYPE coin_operation_type AS ENUM ('earned', 'spent', 'refund');
+    END IF;
+END $$;
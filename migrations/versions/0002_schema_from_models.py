@@ -0,0 +1,13 @@
+"""
+Таблицы по метаданным models.py.
+
+create_all создает только отсутствующие таблицы (вместе с их индексами),
+существующие не изменяются. Поэтому новые индексы и колонки существующих
+таблиц добавляются отдельными миграциями.
+"""
+
+from models import Base
+
+
+async def upgrade(connection):
+    await connection.run_sync(Base.metadata.create_all)
@@ -0,0 +1,24 @@
+-- migrate: no-transaction
+-- Индексы горячих запросов. CONCURRENTLY строит индекс без блокировки записи
+-- в таблицу, но не работает внутри транзакции, поэтому миграция выполняется
+-- по одной команде вне транзакции.
+
+-- Ближайшие вебинары (webinar_schedule, scheduler)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_webinars_webinar_date
+    ON webinars (webinar_date);
+
+-- Ближайший активный курс (course_offer)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_courses_is_active_start_date
+    ON courses (is_active, start_date);
+
+-- Проверка оплаты курса (enroll_course)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_payments_user_id_course_id_status
+    ON payments (user_id, course_id, status);
+
+-- История операций пользователя (/user_stats)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_ai_coin_operations_user_id_created_at
+    ON ai_coin_operations (user_id, created_at DESC, id DESC);
+
+-- Участники вебинара (рассылки): первичный ключ начинается с user_id
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_webinar_registrations_webinar_id_user_id
+    ON webinar_registrations (webinar_id, user_id);
@@ -0,0 +1,15 @@
+-- Состояние инкрементальной сверки балансов с журналом операций
+CREATE TABLE IF NOT EXISTS ledger_reconcile_state (
+    name VARCHAR PRIMARY KEY,
+    last_operation_id BIGINT NOT NULL DEFAULT 0,
+    last_swept_user_id INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Суммы операций пользователей до позиции сверки и найденные расхождения
+CREATE TABLE IF NOT EXISTS user_ledger_sums (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    ledger_sum BIGINT NOT NULL DEFAULT 0,
+    mismatch BIGINT,
+    checked_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
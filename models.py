@@ -1,7 +1,7 @@
 
 from sqlalchemy import (
     Column, Integer, String, BigInteger, DateTime, func, Table,
-    ForeignKey, Numeric, Boolean, Text, Enum
+    ForeignKey, Numeric, Boolean, Text, Enum, Index
 )
 from sqlalchemy.orm import declarative_base, relationship
 from database import engine
@@ -28,7 +28,9 @@ class CoinOperationType(enum.Enum):
 # Association Table for User and Webinar (many-to-many)
 webinar_registrations = Table('webinar_registrations', Base.metadata,
     Column('user_id', Integer, ForeignKey('users.id'), primary_key=True),
-    Column('webinar_id', Integer, ForeignKey('webinars.id'), primary_key=True)
+    Column('webinar_id', Integer, ForeignKey('webinars.id'), primary_key=True),
+    # Участники вебинара (получатели рассылки): первичный ключ начинается с user_id
+    Index('ix_webinar_registrations_webinar_id_user_id', 'webinar_id', 'user_id')
 )
 
 # Association Table for User and Course (many-to-many)
@@ -75,7 +77,7 @@ class Webinar(Base):
     __tablename__ = 'webinars'
 
     id = Column(Integer, primary_key=True)
-    webinar_date = Column(DateTime, nullable=False)
+    webinar_date = Column(DateTime, nullable=False, index=True)
     topic = Column(String, default="Общий вебинар")
     webinar_link = Column(String, nullable=True)
 
@@ -113,6 +115,11 @@ class Course(Base):
     # Relationship to payments
     payments = relationship('Payment', back_populates='course')
 
+    __table_args__ = (
+        # Ближайший активный курс
+        Index('ix_courses_is_active_start_date', 'is_active', 'start_date'),
+    )
+
     def __repr__(self):
         return f"<Course(id={self.id}, name='{self.course_name}', price={self.price})>"
 
@@ -141,6 +148,11 @@ class Payment(Base):
     user = relationship('User', back_populates='payments')
     course = relationship('Course', back_populates='payments')
 
+    __table_args__ = (
+        # Проверка оплаты курса пользователем
+        Index('ix_payments_user_id_course_id_status', 'user_id', 'course_id', 'status'),
+    )
+
     def __repr__(self):
         return (
             f"<Payment(id={self.id}, payment_id='{self.payment_id}', "
@@ -167,6 +179,14 @@ class AICoinOperation(Base):
     # Relationships
     user = relationship('User', back_populates='coin_operations')
 
+    __table_args__ = (
+        # Последние операции пользователя с keyset-пагинацией по (created_at, id)
+        Index(
+            'ix_ai_coin_operations_user_id_created_at',
+            'user_id', created_at.desc(), id.desc()
+        ),
+    )
+
     def __repr__(self):
         return (
             f"<AICoinOperation(user_id={self.user_id}, amount={self.amount}, "
@@ -174,6 +194,96 @@ class AICoinOperation(Base):
         )
 
 
+class ScheduledJob(Base):
+    """Отложенное задание (напоминания о вебинарах и т.п.)"""
+    __tablename__ = 'scheduled_jobs'
+
+    id = Column(Integer, primary_key=True)
+    job_type = Column(String, nullable=False)  # Тип задания, например "webinar_reminder_1h"
+    dedup_key = Column(String, unique=True, nullable=False)  # Защита от повторного создания
+    webinar_id = Column(Integer, ForeignKey('webinars.id'), nullable=True)
+    run_at = Column(DateTime, nullable=False)
+    status = Column(String, default='pending', nullable=False)  # pending / running / done / failed
+    attempts = Column(Integer, default=0, nullable=False)
+    locked_until = Column(DateTime, nullable=True)  # Срок аренды задания исполнителем
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index('ix_scheduled_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+    def __repr__(self):
+        return (
+            f"<ScheduledJob(id={self.id}, type='{self.job_type}', "
+            f"run_at='{self.run_at}', status='{self.status}')>"
+        )
+
+
+class Broadcast(Base):
+    """Прогресс рассылки (контрольная точка для продолжения после сбоя)"""
+    __tablename__ = 'broadcasts'
+
+    id = Column(Integer, primary_key=True)
+    broadcast_key = Column(String, unique=True, nullable=False)  # Например, dedup_key задания
+    webinar_id = Column(Integer, ForeignKey('webinars.id'), nullable=True)
+    status = Column(String, default='running', nullable=False)  # running / done
+    last_user_id = Column(Integer, default=0, nullable=False)  # Последний обработанный users.id
+    sent_count = Column(Integer, default=0, nullable=False)
+    failed_count = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+
+    def __repr__(self):
+        return (
+            f"<Broadcast(key='{self.broadcast_key}', status='{self.status}', "
+            f"sent={self.sent_count}, failed={self.failed_count})>"
+        )
+
+
+class MediaFile(Base):
+    """file_id загруженного в Telegram медиафайла (чтобы не загружать его повторно)"""
+    __tablename__ = 'media_files'
+
+    id = Column(Integer, primary_key=True)
+    source = Column(String, unique=True, nullable=False)  # URL или sha256:<хэш> локального файла
+    media_type = Column(String, nullable=False)  # photo / video
+    file_id = Column(String, nullable=False)
+    file_unique_id = Column(String, nullable=True)
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+
+    def __repr__(self):
+        return f"<MediaFile(source='{self.source}', type='{self.media_type}')>"
+
+
+class LedgerReconcileState(Base):
+    """Позиция сверки балансов с журналом ai_coin_operations"""
+    __tablename__ = 'ledger_reconcile_state'
+
+    name = Column(String, primary_key=True)
+    last_operation_id = Column(BigInteger, default=0, nullable=False)  # Учтенные операции: id <= last_operation_id
+    last_swept_user_id = Column(Integer, default=0, nullable=False)  # Курсор обхода всех пользователей
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+
+    def __repr__(self):
+        return f"<LedgerReconcileState(name='{self.name}', last_operation_id={self.last_operation_id})>"
+
+
+class UserLedgerSum(Base):
+    """Сумма операций пользователя из журнала до позиции сверки"""
+    __tablename__ = 'user_ledger_sums'
+
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    ledger_sum = Column(BigInteger, default=0, nullable=False)
+    mismatch = Column(BigInteger, nullable=True)  # Подтвержденное расхождение (баланс - журнал)
+    checked_at = Column(DateTime, default=func.now(), nullable=False)
+
+    def __repr__(self):
+        return f"<UserLedgerSum(user_id={self.user_id}, ledger_sum={self.ledger_sum}, mismatch={self.mismatch})>"
+
+
 async def create_tables():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
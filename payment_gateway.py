@@ -0,0 +1,218 @@
+"""
+Асинхронный клиент API ЮКассы.
+
+Запросы идут через общий пул соединений aiohttp и не блокируют цикл событий.
+Сетевые ошибки, таймауты и ответы 5xx/429 повторяются; создание платежа
+повторяется с тем же ключом идемпотентности, поэтому повтор не создает
+второй платеж.
+
+Для локальной проверки есть FakePaymentGateway (PAYMENT_GATEWAY=fake),
+который отвечает без обращения к ЮКассе с настраиваемой задержкой.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import uuid
+from dataclasses import dataclass, field, replace
+from decimal import Decimal
+
+import aiohttp
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+YOOKASSA_API_URL = os.getenv('YOOKASSA_API_URL', 'https://api.yookassa.ru/v3')
+
+
+class PaymentGatewayError(Exception):
+    """Ошибка при обращении к платежному шлюзу."""
+
+
+@dataclass(frozen=True)
+class GatewayConfirmation:
+    confirmation_url: str = None
+
+
+@dataclass(frozen=True)
+class GatewayPayment:
+    """Платеж, созданный в ЮКассе (поля как у yookassa.Payment)."""
+
+    id: str
+    status: str
+    confirmation: GatewayConfirmation
+    metadata: dict = field(default_factory=dict)
+    amount: Decimal = None
+    currency: str = None
+
+    @classmethod
+    def from_response(cls, data: dict) -> 'GatewayPayment':
+        confirmation = data.get('confirmation') or {}
+        amount = data.get('amount') or {}
+        return cls(
+            id=data['id'],
+            status=data.get('status'),
+            confirmation=GatewayConfirmation(confirmation.get('confirmation_url')),
+            metadata=data.get('metadata') or {},
+            amount=Decimal(amount['value']) if amount.get('value') else None,
+            currency=amount.get('currency'),
+        )
+
+
+class YooKassaGateway:
+    """Клиент API ЮКассы с пулом соединений, таймаутами и повторами."""
+
+    def __init__(self, shop_id: str, secret_key: str, api_url: str,
+                 timeout: float = 10.0, retries: int = 3, pool_size: int = 20):
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.pool_size = pool_size
+        self._auth = aiohttp.BasicAuth(shop_id or '', secret_key or '')
+        self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                auth=self._auth,
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def create_payment(self, payment_data: dict, idempotency_key: str) -> GatewayPayment:
+        """
+        Создает платеж в ЮКассе.
+
+        Args:
+            payment_data: Тело запроса POST /payments
+            idempotency_key: Ключ идемпотентности (одинаковый для всех повторов)
+
+        Returns:
+            Объект GatewayPayment
+        """
+        return await self._request(
+            'POST', '/payments', json=payment_data,
+            headers={'Idempotence-Key': idempotency_key},
+        )
+
+    async def get_payment(self, payment_id: str) -> GatewayPayment:
+        """Запрашивает актуальное состояние платежа (GET /payments/{id})."""
+        return await self._request('GET', f"/payments/{payment_id}")
+
+    async def _request(self, method: str, path: str, json: dict = None,
+                       headers: dict = None) -> GatewayPayment:
+        session = self._get_session()
+
+        for attempt in range(1, self.retries + 1):
+            try:
+                async with session.request(
+                    method, f"{self.api_url}{path}", json=json, headers=headers
+                ) as response:
+                    try:
+                        data = await response.json(content_type=None)
+                    except ValueError:
+                        # Балансировщик перед API отвечает на 502/504 HTML-страницей
+                        data = None
+
+                    if response.status < 300 and isinstance(data, dict):
+                        return GatewayPayment.from_response(data)
+
+                    # 4xx (кроме 429) повторять бессмысленно
+                    if 400 <= response.status < 500 and response.status != 429:
+                        raise PaymentGatewayError(
+                            f"ЮКасса вернула {response.status}: "
+                            f"{data.get('description') if isinstance(data, dict) else data}"
+                        )
+                    error = PaymentGatewayError(
+                        f"ЮКасса вернула {response.status}"
+                        + ("" if isinstance(data, dict) else " (ответ не в формате JSON)")
+                    )
+
+            except PaymentGatewayError:
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = PaymentGatewayError(f"Сетевая ошибка ЮКассы: {type(e).__name__}: {e}")
+
+            if attempt == self.retries:
+                raise error
+
+            # Экспоненциальная пауза с джиттером перед повтором
+            delay = 0.5 * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            logger.warning(f"{error}, повтор {attempt}/{self.retries - 1} через {delay:.2f} с")
+            await asyncio.sleep(delay)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+class FakePaymentGateway:
+    """Локальная заглушка ЮКассы с искусственной задержкой ответа."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._payments = {}  # ключ идемпотентности -> ID платежа
+        self._by_id = {}
+
+    async def create_payment(self, payment_data: dict, idempotency_key: str) -> GatewayPayment:
+        await asyncio.sleep(self.latency)
+
+        # Как и ЮКасса, на повтор с тем же ключом возвращаем тот же платеж
+        if idempotency_key not in self._payments:
+            # Формат ID как у ЮКассы (не UUID4, как ключ идемпотентности)
+            random_hex = uuid.uuid4().hex
+            payment_id = f"{random_hex[:8]}-000f-5000-8000-{random_hex[8:20]}"
+            amount = payment_data.get('amount') or {}
+            self._by_id[payment_id] = GatewayPayment(
+                id=payment_id,
+                status='pending',
+                confirmation=GatewayConfirmation(
+                    f"https://yoomoney.example/checkout/{payment_id}"
+                ),
+                metadata=payment_data.get('metadata') or {},
+                amount=Decimal(amount['value']) if amount.get('value') else None,
+                currency=amount.get('currency'),
+            )
+            self._payments[idempotency_key] = payment_id
+        return self._by_id[self._payments[idempotency_key]]
+
+    async def get_payment(self, payment_id: str) -> GatewayPayment:
+        await asyncio.sleep(self.latency)
+        if payment_id not in self._by_id:
+            raise PaymentGatewayError(f"ЮКасса вернула 404: платеж {payment_id} не найден")
+        return self._by_id[payment_id]
+
+    def set_status(self, payment_id: str, status: str):
+        """Меняет статус платежа, как если бы пользователь оплатил или отменил его."""
+        self._by_id[payment_id] = replace(self._by_id[payment_id], status=status)
+
+    async def close(self):
+        pass
+
+
+def _create_gateway():
+    if os.getenv('PAYMENT_GATEWAY', 'yookassa') == 'fake':
+        latency = float(os.getenv('PAYMENT_FAKE_LATENCY', '0'))
+        logger.warning(f"Используется заглушка ЮКассы (задержка {latency} с)")
+        return FakePaymentGateway(latency=latency)
+
+    shop_id = os.getenv('PAYMENT_SHOP_ID')
+    secret_key = os.getenv('PAYMENT_SECRET_KEY')
+    logger.info(
+        f"YooKassa Configuration: account_id={shop_id}, "
+        f"secret_key={'***' if secret_key else 'NOT SET'}"
+    )
+    return YooKassaGateway(
+        shop_id=shop_id,
+        secret_key=secret_key,
+        api_url=YOOKASSA_API_URL,
+        timeout=float(os.getenv('PAYMENT_API_TIMEOUT', '10')),
+        retries=int(os.getenv('PAYMENT_API_RETRIES', '3')),
+        pool_size=int(os.getenv('PAYMENT_API_POOL_SIZE', '20')),
+    )
+
+
+payment_gateway = _create_gateway()
@@ -0,0 +1,346 @@
+"""
+Прием уведомлений ЮКассы и идемпотентное проведение платежей.
+
+Эндпоинт принимает уведомления payment.succeeded / payment.canceled.
+Телу уведомления не доверяем: по ID из него платеж запрашивается заново
+через API (GET /payments/{id}), и в очередь ставится ответ API - статус,
+сумма, валюта и метаданные. Очередь сбрасывается пачками: все уведомления
+пачки проводятся одним запросом в одной транзакции (групповой коммит), а
+ответ ЮКассе отправляется только после COMMIT. Если запрос к API или запись
+не удались, ЮКасса получает 500 и повторит уведомление.
+
+Проведение идемпотентно: статус меняется только у платежей в статусе
+pending, у которых сумма и валюта совпадают с ответом API; регистрация на
+курс добавляется через ON CONFLICT DO NOTHING.
+
+Платежи, созданные до перехода на ID ЮКассы, хранят в payment_id ключ
+идемпотентности (UUID4, у ID ЮКассы другой формат), и уведомление их по ID
+не находит. Только для успешной оплаты такой платеж сопоставляется по
+user_id и course_id из метаданных (последний pending с той же суммой), и
+его payment_id заменяется на ID ЮКассы. Отмена по метаданным не проводится,
+а payment_id с ID ЮКассы никогда не перезаписывается.
+
+Если пачка не провелась, ее платежи проводятся по одному, чтобы ошибка в
+одном платеже не возвращала 500 на все уведомления пачки.
+"""
+
+import asyncio
+import ipaddress
+import logging
+import os
+
+from aiohttp import web
+from aiogram import Bot
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+from database import async_session
+from payment_gateway import GatewayPayment, PaymentGatewayError, payment_gateway
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+YOOKASSA_NOTIFICATION_PATH = os.getenv('YOOKASSA_NOTIFICATION_PATH', '/yookassa/notification')
+# Дополнительный фильтр по IP отправителя. За прокси request.remote - адрес
+# прокси, поэтому подлинность уведомления проверяется запросом к API
+YOOKASSA_CHECK_IP = os.getenv('YOOKASSA_CHECK_IP', '0') == '1'
+PAYMENT_SETTLE_BATCH_SIZE = int(os.getenv('PAYMENT_SETTLE_BATCH_SIZE', '200'))
+PAYMENT_SETTLE_INTERVAL = float(os.getenv('PAYMENT_SETTLE_INTERVAL', '0.05'))
+# Сколько сообщений об оплате отправляется пользователям одновременно
+PAYMENT_NOTIFY_CONCURRENCY = int(os.getenv('PAYMENT_NOTIFY_CONCURRENCY', '10'))
+
+# Адреса, с которых ЮКасса отправляет уведомления
+YOOKASSA_NETWORKS = [
+    ipaddress.ip_network(network)
+    for network in os.getenv(
+        'YOOKASSA_NETWORKS',
+        '185.71.76.0/27,185.71.77.0/27,77.75.153.0/25,77.75.156.11/32,'
+        '77.75.156.35/32,77.75.154.128/25,2a02:5180::/32'
+    ).split(',')
+]
+
+# События ЮКассы, которые проводим
+EVENTS = {'payment.succeeded', 'payment.canceled'}
+
+# Итоговые статусы платежа в ответе API
+FINAL_STATUSES = {'succeeded', 'canceled'}
+
+# Ключ идемпотентности (UUID4), который старые записи хранят в payment_id
+LEGACY_PAYMENT_ID_PATTERN = '^[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}$'
+
+# Один запрос на пачку: переводим pending-платежи в итоговый статус и
+# регистрируем оплативших пользователей на курс. Платеж ищется по ID
+# ЮКассы, а успешная оплата без такого ID - среди старых записей по метаданным
+SETTLE_PAYMENTS_SQL = text("""
+WITH v AS (
+    SELECT *
+    FROM unnest(
+        CAST(:payment_ids AS varchar[]),
+        CAST(:statuses AS payment_status[]),
+        CAST(:amounts AS numeric[]),
+        CAST(:currencies AS varchar[]),
+        CAST(:user_ids AS integer[]),
+        CAST(:course_ids AS integer[])
+    ) AS v(payment_id, status, amount, currency, user_id, course_id)
+),
+by_id AS (
+    SELECT p.id, v.payment_id, v.status, false AS legacy
+    FROM v
+    JOIN payments p ON p.payment_id = v.payment_id
+    WHERE p.status = 'pending'::payment_status
+      AND p.amount = v.amount
+      AND p.currency = v.currency
+),
+legacy AS (
+    SELECT DISTINCT ON (v.payment_id) p.id, v.payment_id, v.status, true AS legacy
+    FROM v
+    JOIN payments p ON p.user_id = v.user_id AND p.course_id = v.course_id
+    WHERE v.status = 'succeeded'::payment_status
+      AND p.status = 'pending'::payment_status
+      AND p.amount = v.amount
+      AND p.currency = v.currency
+      AND p.payment_id ~ :legacy_pattern
+      AND NOT EXISTS (SELECT 1 FROM payments known WHERE known.payment_id = v.payment_id)
+    ORDER BY v.payment_id, p.created_at DESC
+),
+target AS (
+    -- Одна старая запись может подойти нескольким платежам пачки
+    SELECT DISTINCT ON (id) *
+    FROM (SELECT * FROM by_id UNION ALL SELECT * FROM legacy) matched
+    ORDER BY id, legacy
+),
+settled AS (
+    UPDATE payments p
+    SET status = t.status,
+        payment_id = CASE WHEN t.legacy THEN t.payment_id ELSE p.payment_id END,
+        paid_at = CASE WHEN t.status = 'succeeded'::payment_status
+                       THEN COALESCE(p.paid_at, now()) ELSE p.paid_at END
+    FROM target t
+    WHERE p.id = t.id
+      AND p.status = 'pending'::payment_status
+    RETURNING p.payment_id, p.user_id, p.course_id, p.status
+),
+registered AS (
+    INSERT INTO course_registrations (user_id, course_id, registration_date)
+    SELECT user_id, course_id, now()
+    FROM settled
+    WHERE status = 'succeeded'::payment_status
+    ON CONFLICT DO NOTHING
+    RETURNING user_id, course_id
+)
+SELECT s.payment_id, CAST(s.status AS varchar) AS status,
+       u.telegram_id, c.course_name, c.course_link
+FROM settled s
+JOIN users u ON u.id = s.user_id
+JOIN courses c ON c.id = s.course_id
+""")
+
+
+class PaymentSettler:
+    """Очередь уведомлений с пакетным проведением платежей."""
+
+    def __init__(self, bot: Bot, batch_size: int, interval: float):
+        self.bot = bot
+        self.batch_size = batch_size
+        self.interval = interval
+
+        # Элементы очереди: (платеж из API, future для ответа ЮКассе)
+        self._queue = asyncio.Queue()
+        self._task = None
+        self._notify_semaphore = asyncio.Semaphore(PAYMENT_NOTIFY_CONCURRENCY)
+        self._notify_tasks = set()
+
+    async def settle(self, payment: GatewayPayment):
+        """Ставит проверенный платеж в очередь и ждет фиксации его пачки."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((payment, future))
+        await future
+
+    async def _next_batch(self) -> list:
+        batch = [await self._queue.get()]
+        # Даем короткое окно, чтобы собрать всплеск уведомлений в одну пачку
+        await asyncio.sleep(self.interval)
+        while len(batch) < self.batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _flush(self, payments: list) -> list:
+        async with async_session() as session:
+            result = await session.execute(
+                SETTLE_PAYMENTS_SQL,
+                {
+                    'payment_ids': [payment.id for payment in payments],
+                    'statuses': [payment.status for payment in payments],
+                    'amounts': [payment.amount for payment in payments],
+                    'currencies': [payment.currency for payment in payments],
+                    'user_ids': [_metadata_id(payment, 'user_id') for payment in payments],
+                    'course_ids': [_metadata_id(payment, 'course_id') for payment in payments],
+                    'legacy_pattern': LEGACY_PAYMENT_ID_PATTERN,
+                }
+            )
+            settled = result.all()
+            await session.commit()
+        return settled
+
+    async def _flush_each(self, payments: list, error: Exception) -> tuple:
+        """
+        Проводит платежи неудавшейся пачки по одному.
+
+        Returns:
+            (проведенные строки, ID платежа -> ошибка)
+        """
+        if len(payments) == 1:
+            return [], {payments[0].id: error}
+
+        settled, errors = [], {}
+        for payment in payments:
+            try:
+                settled.extend(await self._flush([payment]))
+            except Exception as e:
+                logger.error(f"Ошибка при проведении платежа {payment.id}: {e}", exc_info=True)
+                errors[payment.id] = e
+        return settled, errors
+
+    async def _notify_user(self, row):
+        if row.status != 'succeeded':
+            return
+        async with self._notify_semaphore:
+            await self._send_confirmation(row)
+
+    async def _send_confirmation(self, row):
+        text_message = (
+            f"✅ Оплата получена! Вы зарегистрированы на курс "
+            f"<b>{row.course_name}</b>."
+        )
+        if row.course_link:
+            text_message += f"\n\n🔗 Ссылка на курс: {row.course_link}"
+        try:
+            await self.bot.send_message(row.telegram_id, text_message, parse_mode="HTML")
+        except Exception as e:
+            logger.error(f"Не удалось уведомить пользователя {row.telegram_id} об оплате: {e}")
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+
+            # Повторы одного платежа в пачке проводим один раз (первый ответ API побеждает)
+            payments, futures = {}, {}
+            for payment, future in batch:
+                payments.setdefault(payment.id, payment)
+                futures.setdefault(payment.id, []).append(future)
+
+            try:
+                settled = await self._flush(list(payments.values()))
+                errors = {}
+            except Exception as e:
+                logger.error(f"Ошибка при проведении пачки платежей: {e}", exc_info=True)
+                settled, errors = await self._flush_each(list(payments.values()), e)
+
+            logger.info(
+                f"Проведено платежей: {len(settled)} из {len(payments)} "
+                f"(уведомлений в пачке: {len(batch)}, ошибок: {len(errors)})"
+            )
+
+            for payment_id, payment_futures in futures.items():
+                for future in payment_futures:
+                    if future.done():
+                        continue
+                    if payment_id in errors:
+                        future.set_exception(errors[payment_id])
+                    else:
+                        future.set_result(None)
+
+            # Сообщения пользователям отправляются в фоне, не задерживая
+            # проведение следующей пачки
+            for row in settled:
+                task = asyncio.create_task(self._notify_user(row))
+                self._notify_tasks.add(task)
+                task.add_done_callback(self._notify_tasks.discard)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Даем дойти уже начатым сообщениям об оплате
+        if self._notify_tasks:
+            await asyncio.gather(*self._notify_tasks, return_exceptions=True)
+
+
+def _metadata_id(payment: GatewayPayment, key: str):
+    """ID из метаданных платежа (нужен для сопоставления старых записей)."""
+    try:
+        return int(payment.metadata.get(key))
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_trusted(request: web.Request) -> bool:
+    if not YOOKASSA_CHECK_IP:
+        return True
+    try:
+        address = ipaddress.ip_address(request.remote)
+    except (TypeError, ValueError):
+        return False
+    return any(address in network for network in YOOKASSA_NETWORKS)
+
+
+async def handle_notification(request: web.Request) -> web.Response:
+    """Обрабатывает HTTP-уведомление ЮКассы."""
+    if not _is_trusted(request):
+        logger.warning(f"Уведомление ЮКассы с недоверенного адреса {request.remote}")
+        return web.Response(status=403)
+
+    try:
+        data = await request.json()
+        event = data['event']
+        payment_id = str(data['object']['id'])
+    except Exception as e:
+        logger.warning(f"Некорректное уведомление ЮКассы: {e}")
+        return web.Response(status=400)
+
+    if event not in EVENTS:
+        # Остальные события (waiting_for_capture, refund.*) не обрабатываем
+        return web.Response()
+
+    # Статус, сумму и валюту берем из API, а не из тела уведомления
+    try:
+        payment = await request.app['payment_gateway'].get_payment(payment_id)
+    except PaymentGatewayError as e:
+        logger.warning(f"Не удалось проверить платеж {payment_id} из уведомления: {e}")
+        return web.Response(status=500)
+
+    if payment.status not in FINAL_STATUSES:
+        logger.warning(
+            f"Уведомление {event} для платежа {payment_id}, "
+            f"но по данным API его статус {payment.status}"
+        )
+        return web.Response()
+
+    try:
+        await request.app['payment_settler'].settle(payment)
+    except Exception:
+        return web.Response(status=500)
+
+    return web.Response()
+
+
+def setup_payment_notifications(app: web.Application, bot: Bot):
+    """Добавляет в aiohttp-приложение эндпоинт уведомлений ЮКассы."""
+    settler = PaymentSettler(
+        bot,
+        batch_size=PAYMENT_SETTLE_BATCH_SIZE,
+        interval=PAYMENT_SETTLE_INTERVAL,
+    )
+    app['payment_settler'] = settler
+    app['payment_gateway'] = payment_gateway
+    app.router.add_post(YOOKASSA_NOTIFICATION_PATH, handle_notification)
+    app.on_startup.append(lambda _: settler.start())
+    app.on_cleanup.append(lambda _: settler.stop())
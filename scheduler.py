@@ -0,0 +1,347 @@
+"""
+Планировщик отложенных заданий с хранением в БД (таблица scheduled_jobs).
+
+Исполнители забирают наступившие задания через FOR UPDATE SKIP LOCKED и
+берут их в аренду на JOB_LEASE_SECONDS, поэтому несколько экземпляров
+бота не выполнят одно задание дважды. Пока задание выполняется, аренда
+продлевается фоновым пульсом. При штатной остановке взятые задания
+возвращаются в очередь сразу, а если экземпляр упал, задание снова станет
+доступно после окончания аренды (не позже чем через JOB_LEASE_SECONDS).
+
+Взятые задания выполняются параллельно, каждое своей задачей (не больше
+JOB_BATCH_SIZE одновременно): долгая рассылка по большому вебинару не
+задерживает напоминания о других вебинарах. Когда задание завершается,
+планировщик сразу берет следующие.
+
+Между проверками планировщик спит до ближайшего run_at (но не дольше
+JOB_MAX_SLEEP), а после создания новых заданий будится сразу.
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+
+from aiogram import Bot
+from dotenv import load_dotenv
+from sqlalchemy import case, func, or_, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import async_session
+from models import ScheduledJob, Webinar
+from broadcast import broadcast_engine, webinar_attendees
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '60'))
+JOB_MAX_SLEEP = float(os.getenv('JOB_MAX_SLEEP', '60'))
+JOB_BATCH_SIZE = int(os.getenv('JOB_BATCH_SIZE', '10'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+
+# Час утреннего напоминания в день вебинара
+WEBINAR_MORNING_REMINDER_HOUR = int(os.getenv('WEBINAR_MORNING_REMINDER_HOUR', '10'))
+
+
+async def schedule_webinar_reminders(session: AsyncSession, webinar: Webinar) -> int:
+    """
+    Создает задания-напоминания для вебинара: утром в день эфира и за 1 час.
+
+    Повторный вызов для того же вебинара новых заданий не создает.
+    Фиксация транзакции остается за вызывающим кодом.
+
+    Returns:
+        Количество запланированных напоминаний
+    """
+    hour_before = webinar.webinar_date - timedelta(hours=1)
+    morning = webinar.webinar_date.replace(
+        hour=WEBINAR_MORNING_REMINDER_HOUR, minute=0, second=0, microsecond=0
+    )
+
+    reminders = [('webinar_reminder_1h', hour_before)]
+    # Утреннее напоминание имеет смысл, только если оно раньше часового
+    if morning < hour_before:
+        reminders.append(('webinar_reminder_morning', morning))
+
+    now = datetime.now()
+    rows = [
+        {
+            'job_type': job_type,
+            'dedup_key': f"{job_type}:{webinar.id}",
+            'webinar_id': webinar.id,
+            'run_at': run_at,
+        }
+        for job_type, run_at in reminders
+        if run_at > now
+    ]
+    if not rows:
+        return 0
+
+    await session.execute(
+        insert(ScheduledJob).values(rows).on_conflict_do_nothing(index_elements=['dedup_key'])
+    )
+    return len(rows)
+
+
+async def schedule_upcoming_reminders() -> int:
+    """
+    Создает недостающие напоминания для всех предстоящих вебинаров.
+
+    Returns:
+        Количество вебинаров, для которых выполнено планирование
+    """
+    async with async_session() as session:
+        result = await session.execute(
+            select(Webinar).where(Webinar.webinar_date > datetime.now())
+        )
+        webinars = result.scalars().all()
+        for webinar in webinars:
+            await schedule_webinar_reminders(session, webinar)
+        await session.commit()
+    return len(webinars)
+
+
+async def send_webinar_reminder(bot: Bot, job: ScheduledJob):
+    """Рассылает напоминание о вебинаре всем зарегистрированным участникам."""
+    async with async_session() as session:
+        webinar = await session.get(Webinar, job.webinar_id)
+        if not webinar:
+            logger.warning(f"Вебинар {job.webinar_id} для задания {job.id} не найден")
+            return
+        if webinar.webinar_date <= datetime.now():
+            # Бот был недоступен, и напоминание опоздало - не отправляем его после старта
+            logger.warning(f"Задание {job.id} пропущено: вебинар {webinar.id} уже начался")
+            return
+
+    if job.job_type == 'webinar_reminder_morning':
+        text = (
+            f"☀️ Доброе утро! Сегодня в {webinar.webinar_date.strftime('%H:%M')} МСК "
+            f"стартует наш вебинар по ИИ.\n\n"
+        )
+    else:
+        text = "⏰ Вебинар начнется через 1 час!\n\n"
+    if webinar.webinar_link:
+        text += f"🎥 Ссылка на вебинар: {webinar.webinar_link}"
+    else:
+        text += "🎥 Ссылку на вход я пришлю сюда перед началом."
+
+    # Ключ рассылки = ключ задания: повтор задания продолжит рассылку, а не начнет заново
+    await broadcast_engine.run(
+        bot,
+        webinar_attendees(webinar.id),
+        text,
+        broadcast_key=job.dedup_key,
+        webinar_id=webinar.id,
+    )
+
+
+# Тип задания -> обработчик
+JOB_HANDLERS = {
+    'webinar_reminder_1h': send_webinar_reminder,
+    'webinar_reminder_morning': send_webinar_reminder,
+}
+
+
+class JobScheduler:
+    """Исполнитель заданий из таблицы scheduled_jobs."""
+
+    def __init__(self):
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._heartbeat_task = None
+        self._bot = None
+        # ID заданий, взятых в аренду этим экземпляром и еще не завершенных
+        self._claimed = set()
+        # Задачи выполняемых заданий
+        self._jobs = set()
+
+    def wake(self):
+        """Будит планировщик (например, после создания новых заданий)."""
+        self._wakeup.set()
+
+    async def _claim(self, limit: int = JOB_BATCH_SIZE) -> list:
+        """Забирает в аренду наступившие задания (и задания с истекшей арендой)."""
+        now = datetime.now()
+        due = (
+            select(ScheduledJob.id)
+            .where(or_(
+                (ScheduledJob.status == 'pending') & (ScheduledJob.run_at <= now),
+                (ScheduledJob.status == 'running') & (ScheduledJob.locked_until < now),
+            ))
+            .order_by(ScheduledJob.run_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        async with async_session() as session:
+            result = await session.execute(
+                update(ScheduledJob)
+                .where(ScheduledJob.id.in_(due))
+                .values(
+                    status='running',
+                    attempts=ScheduledJob.attempts + 1,
+                    locked_until=now + timedelta(seconds=JOB_LEASE_SECONDS),
+                )
+                .returning(ScheduledJob)
+            )
+            jobs = result.scalars().all()
+            await session.commit()
+        self._claimed.update(job.id for job in jobs)
+        return jobs
+
+    async def _finish(self, job: ScheduledJob, error: Exception = None):
+        if error is None:
+            values = {'status': 'done', 'finished_at': datetime.now(), 'locked_until': None}
+        elif job.attempts >= JOB_MAX_ATTEMPTS:
+            values = {'status': 'failed', 'finished_at': datetime.now(), 'last_error': str(error)}
+        else:
+            # Возвращаем задание в очередь с паузой перед повтором
+            values = {
+                'status': 'pending',
+                'run_at': datetime.now() + timedelta(seconds=60 * job.attempts),
+                'locked_until': None,
+                'last_error': str(error),
+            }
+
+        async with async_session() as session:
+            await session.execute(
+                update(ScheduledJob).where(ScheduledJob.id == job.id).values(**values)
+            )
+            await session.commit()
+        self._claimed.discard(job.id)
+
+    async def _renew_leases(self):
+        """Продлевает аренду выполняемых заданий."""
+        if not self._claimed:
+            return
+        async with async_session() as session:
+            await session.execute(
+                update(ScheduledJob)
+                .where(ScheduledJob.id.in_(list(self._claimed)), ScheduledJob.status == 'running')
+                .values(locked_until=datetime.now() + timedelta(seconds=JOB_LEASE_SECONDS))
+            )
+            await session.commit()
+
+    async def _heartbeat(self):
+        # Продлеваем заранее: аренда не истечет, даже если один пульс не прошел
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                await self._renew_leases()
+            except Exception as e:
+                logger.error(f"Не удалось продлить аренду заданий: {e}", exc_info=True)
+
+    async def _release(self):
+        """Возвращает в очередь невыполненные задания этого экземпляра."""
+        if not self._claimed:
+            return
+        async with async_session() as session:
+            # Прерванная остановкой попытка не считается
+            await session.execute(
+                update(ScheduledJob)
+                .where(ScheduledJob.id.in_(list(self._claimed)), ScheduledJob.status == 'running')
+                .values(
+                    status='pending',
+                    locked_until=None,
+                    attempts=func.greatest(ScheduledJob.attempts - 1, 0),
+                )
+            )
+            await session.commit()
+        logger.info(f"Возвращено в очередь заданий: {len(self._claimed)}")
+        self._claimed.clear()
+
+    async def _run_job(self, job: ScheduledJob):
+        handler = JOB_HANDLERS.get(job.job_type)
+        if handler is None:
+            await self._finish(job, ValueError(f"Неизвестный тип задания: {job.job_type}"))
+            return
+
+        try:
+            await handler(self._bot, job)
+        except Exception as e:
+            logger.error(f"Ошибка при выполнении задания {job.id}: {e}", exc_info=True)
+            await self._finish(job, e)
+            return
+        await self._finish(job)
+
+    async def _seconds_until_next(self) -> float:
+        """Время до ближайшего задания или конца аренды (не больше JOB_MAX_SLEEP)."""
+        next_at = case(
+            (ScheduledJob.status == 'running', ScheduledJob.locked_until),
+            else_=ScheduledJob.run_at,
+        )
+        async with async_session() as session:
+            result = await session.execute(
+                select(func.min(next_at))
+                .where(ScheduledJob.status.in_(['pending', 'running']))
+            )
+            next_run_at = result.scalar_one_or_none()
+
+        if next_run_at is None:
+            return JOB_MAX_SLEEP
+        delay = (next_run_at - datetime.now()).total_seconds()
+        return min(max(delay, 0.0), JOB_MAX_SLEEP)
+
+    def _job_done(self, task: asyncio.Task):
+        self._jobs.discard(task)
+        # Освободился слот - можно брать следующие задания
+        self.wake()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                free = JOB_BATCH_SIZE - len(self._jobs)
+                jobs = await self._claim(free) if free > 0 else []
+                for job in jobs:
+                    task = asyncio.create_task(self._run_job(job))
+                    self._jobs.add(task)
+                    task.add_done_callback(self._job_done)
+                # Заняли все свободные слоты - возможно, есть еще наступившие задания
+                if jobs and len(jobs) == free:
+                    continue
+                delay = await self._seconds_until_next()
+            except Exception as e:
+                logger.error(f"Ошибка планировщика заданий: {e}", exc_info=True)
+                delay = JOB_MAX_SLEEP
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self, bot: Bot):
+        """Планирует недостающие напоминания и запускает исполнителя заданий."""
+        self._bot = bot
+        await schedule_upcoming_reminders()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def stop(self):
+        """Останавливает исполнителя и возвращает взятые задания в очередь."""
+        for task in (self._task, self._heartbeat_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        self._heartbeat_task = None
+
+        # Прерываем выполняемые задания (рассылка при отмене сохраняет прогресс)
+        jobs = list(self._jobs)
+        for task in jobs:
+            task.cancel()
+        await asyncio.gather(*jobs, return_exceptions=True)
+
+        try:
+            await self._release()
+        except Exception as e:
+            # Задания вернутся в очередь по окончании аренды
+            logger.error(f"Не удалось вернуть задания в очередь: {e}", exc_info=True)
+
+
+job_scheduler = JobScheduler()
@@ -0,0 +1,95 @@
+"""Вспомогательные классы тестов: заглушка Bot API и построение обновлений."""
+
+import asyncio
+from datetime import datetime
+from itertools import count
+
+from aiogram.client.session.base import BaseSession
+from aiogram.types import CallbackQuery, Chat, Message, Update
+from aiogram.types import User as TelegramUser
+from sqlalchemy import event
+
+
+def run(coro):
+    """Выполняет корутину в новом цикле событий и закрывает соединения пула."""
+    from database import engine
+
+    async def wrapper():
+        try:
+            return await coro
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(wrapper())
+
+
+class StubBotSession(BaseSession):
+    """Заглушка сессии Bot API: запоминает методы и отвечает True."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.methods = []
+
+    async def make_request(self, bot, method, timeout=None):
+        self.methods.append(method)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536,
+                             raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+class UpdateFactory:
+    """Строит обновления, привязанные к боту (как после getUpdates)."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._ids = count(1)
+
+    def user(self, telegram_id: int) -> TelegramUser:
+        return TelegramUser(id=telegram_id, is_bot=False, first_name='Test',
+                            username=f"test_{telegram_id}")
+
+    def message(self, telegram_id: int, text: str = None) -> Message:
+        return Message(
+            message_id=next(self._ids), date=datetime.now(),
+            chat=Chat(id=telegram_id, type='private'),
+            from_user=self.user(telegram_id), text=text,
+        ).as_(self.bot)
+
+    def message_update(self, telegram_id: int, text: str) -> Update:
+        return Update(update_id=next(self._ids),
+                      message=self.message(telegram_id, text)).as_(self.bot)
+
+    def callback_update(self, telegram_id: int, data: str) -> Update:
+        return Update(
+            update_id=next(self._ids),
+            callback_query=CallbackQuery(
+                id=str(next(self._ids)), from_user=self.user(telegram_id),
+                chat_instance='test', message=self.message(telegram_id), data=data,
+            ).as_(self.bot),
+        ).as_(self.bot)
+
+
+class StatementCounter:
+    """Считает SQL-запросы движка внутри блока with."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine.sync_engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine.sync_engine, 'before_cursor_execute', self._count)
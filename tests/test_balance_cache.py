@@ -0,0 +1,38 @@
+"""Кэш балансов: устаревшее чтение не должно попадать в кэш."""
+
+from balance_cache import BalanceCache
+
+
+def test_fill_skipped_if_balance_changed_during_read():
+    cache = BalanceCache(enabled=True)
+    token = cache.read_token()          # Чтение из БД началось (видит баланс 100)
+    cache.invalidate(1)                 # Параллельное списание до фиксации
+    cache.set(1, 40)                    # ... и после фиксации
+    cache.fill(1, 100, token)           # Чтение закончилось со старым значением
+    assert cache.get(1) == 40
+
+
+def test_fill_skipped_after_invalidation_without_new_value():
+    cache = BalanceCache(enabled=True)
+    token = cache.read_token()
+    cache.invalidate(1)
+    cache.fill(1, 100, token)
+    assert cache.get(1) is None
+
+
+def test_fill_stored_when_nothing_changed():
+    cache = BalanceCache(enabled=True)
+    cache.invalidate(2)                 # Изменение другого ключа не мешает
+    token = cache.read_token()
+    cache.invalidate(3)
+    cache.fill(1, 100, token)
+    assert cache.get(1) == 100
+
+
+def test_fill_skipped_when_change_history_was_evicted():
+    cache = BalanceCache(enabled=True, maxsize=2)
+    token = cache.read_token()
+    for telegram_id in (1, 2, 3):       # История изменения ключа 1 вытеснена
+        cache.invalidate(telegram_id)
+    cache.fill(1, 100, token)
+    assert cache.get(1) is None
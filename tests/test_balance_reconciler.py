@@ -0,0 +1,169 @@
+"""Позиция сверки балансов с журналом и подтверждение расхождений."""
+
+from sqlalchemy import delete, func, select, text, update
+from sqlalchemy.dialects.postgresql import insert
+
+from support import run
+
+TELEGRAM_IDS = (9_100_000_030, 9_100_000_031)
+
+INSERT_OPERATION_SQL = text("""
+WITH operation AS (
+    INSERT INTO ai_coin_operations (user_id, amount, operation_type, reason)
+    VALUES (:user_id, :amount, 'earned', 'тест сверки')
+    RETURNING id
+)
+UPDATE users SET ai_coins_balance = ai_coins_balance + :amount
+WHERE id = :user_id
+RETURNING (SELECT id FROM operation)
+""")
+
+
+async def _reset():
+    """Новые пользователи без операций, позиция сверки - конец журнала."""
+    from balance_reconciler import STATE_NAME
+    from database import async_session
+    from models import AICoinOperation, LedgerReconcileState, User
+
+    async with async_session() as session:
+        users = select(User.id).where(User.telegram_id.in_(TELEGRAM_IDS))
+        await session.execute(delete(AICoinOperation).where(AICoinOperation.user_id.in_(users)))
+        await session.execute(delete(User).where(User.telegram_id.in_(TELEGRAM_IDS)))
+        result = await session.execute(
+            insert(User)
+            .values([{'telegram_id': telegram_id, 'user_name': 'reconcile'}
+                     for telegram_id in TELEGRAM_IDS])
+            .returning(User.id, User.telegram_id)
+        )
+        user_ids = dict((telegram_id, user_id) for user_id, telegram_id in result)
+
+        position = await session.scalar(
+            select(func.coalesce(func.max(AICoinOperation.id), 0))
+        )
+        await session.execute(
+            insert(LedgerReconcileState)
+            .values(name=STATE_NAME, last_operation_id=position)
+            .on_conflict_do_update(index_elements=['name'],
+                                   set_={'last_operation_id': position})
+        )
+        await session.commit()
+    return [user_ids[telegram_id] for telegram_id in TELEGRAM_IDS], position
+
+
+async def _shift_balance(user_id: int, delta: int):
+    """Меняет баланс в обход журнала."""
+    from database import async_session
+    from models import User
+
+    async with async_session() as session:
+        await session.execute(
+            update(User).where(User.id == user_id)
+            .values(ai_coins_balance=User.ai_coins_balance + delta)
+        )
+        await session.commit()
+
+
+async def _ledger_sums(user_ids) -> dict:
+    from database import async_session
+    from models import User, UserLedgerSum
+
+    async with async_session() as session:
+        result = await session.execute(
+            select(User.id, User.ai_coins_balance, UserLedgerSum.ledger_sum,
+                   UserLedgerSum.mismatch)
+            .outerjoin(UserLedgerSum, UserLedgerSum.user_id == User.id)
+            .where(User.id.in_(user_ids))
+        )
+        return {row.id: (row.ai_coins_balance, row.ledger_sum, row.mismatch) for row in result}
+
+
+def _reconciler(**kwargs):
+    from balance_reconciler import BalanceReconciler
+
+    # Без обхода всех пользователей: проверяются только пользователи из журнала
+    return BalanceReconciler(enabled=True, lag=0, sweep_size=0, **kwargs)
+
+
+def test_position_does_not_pass_operations_of_open_transactions(postgres):
+    async def scenario():
+        user_ids, position = await _reset()
+        reconciler = _reconciler()
+        positions = []
+
+        # Операция незавершенной транзакции получает меньший id, чем следующая
+        async with postgres.connect() as in_flight:
+            pending_id = await in_flight.scalar(
+                INSERT_OPERATION_SQL, {'user_id': user_ids[1], 'amount': 10}
+            )
+            async with postgres.begin() as conn:
+                committed_id = await conn.scalar(
+                    INSERT_OPERATION_SQL, {'user_id': user_ids[0], 'amount': 5}
+                )
+            await reconciler.run_once()
+            positions.append(reconciler.last_operation_id)
+            await in_flight.commit()
+
+        await reconciler.run_once()
+        positions.append(reconciler.last_operation_id)
+
+        # Откаченная операция оставляет пропуск, который позиция проходит,
+        # когда завершены все транзакции, начатые до его обнаружения
+        async with postgres.connect() as rolled_back:
+            await rolled_back.execute(
+                INSERT_OPERATION_SQL, {'user_id': user_ids[1], 'amount': 100}
+            )
+            await rolled_back.rollback()
+        async with postgres.begin() as conn:
+            last_id = await conn.scalar(
+                INSERT_OPERATION_SQL, {'user_id': user_ids[0], 'amount': 5}
+            )
+        await reconciler.run_once()
+        positions.append(reconciler.last_operation_id)
+        await reconciler.run_once()
+        positions.append(reconciler.last_operation_id)
+
+        return (position, pending_id, committed_id, last_id, positions,
+                await _ledger_sums(user_ids), user_ids)
+
+    (position, pending_id, committed_id, last_id, positions,
+     sums, user_ids) = run(scenario())
+    assert pending_id < committed_id
+    assert positions == [position, committed_id, committed_id, last_id]
+    assert sums == {user_ids[0]: (10, 10, None), user_ids[1]: (10, 10, None)}
+
+
+def test_mismatch_is_flagged_or_repaired_only_when_confirmed(postgres):
+    async def scenario():
+        (stable, transient), _ = await _reset()
+        async with postgres.begin() as conn:
+            for user_id in (stable, transient):
+                await conn.execute(INSERT_OPERATION_SQL, {'user_id': user_id, 'amount': 10})
+        await _shift_balance(stable, 7)
+        await _shift_balance(transient, 3)
+
+        reconciler = _reconciler()
+        await reconciler.run_once()
+        first = await _ledger_sums([stable, transient])
+        # Расхождение, исчезнувшее к повторной проверке, не отмечается
+        await _shift_balance(transient, -3)
+        await reconciler.run_once()
+        second = await _ledger_sums([stable, transient])
+
+        repairing = _reconciler(repair=True)
+        async with postgres.begin() as conn:
+            await conn.execute(INSERT_OPERATION_SQL, {'user_id': transient, 'amount': 1})
+        await _shift_balance(transient, 4)
+        await repairing.run_once()
+        await repairing.run_once()
+        repaired = await _ledger_sums([transient])
+
+        return (stable, transient, first, second, reconciler.flagged_total,
+                repaired, repairing.repaired_total)
+
+    stable, transient, first, second, flagged_total, repaired, repaired_total = run(scenario())
+    assert first == {stable: (17, 10, None), transient: (13, 10, None)}
+    assert second == {stable: (17, 10, 7), transient: (10, 10, None)}
+    assert flagged_total == 1
+    # Баланс приведен к журналу: 10 + 1
+    assert repaired == {transient: (11, 11, None)}
+    assert repaired_total == 1
@@ -0,0 +1,119 @@
+"""Повторы запросов Bot API после ошибок сети."""
+
+import asyncio
+
+import aiohttp
+import pytest
+from aiogram import Bot
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramNetworkError
+from aiogram.methods import GetMe, SendMessage
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from support import run
+
+TIMEOUT = 0.2
+
+
+def _requests_after_timeout(call):
+    """Вызывает call(bot) на сервере, который не отвечает дольше таймаута."""
+    from bot_session import PriorityAiohttpSession
+
+    requests = []
+
+    async def bot_api(request: web.Request) -> web.Response:
+        requests.append(request.match_info['method'])
+        await asyncio.sleep(TIMEOUT * 5)
+        return web.json_response({'ok': True, 'result': True})
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', bot_api)
+        async with TestServer(app) as server:
+            session = PriorityAiohttpSession(
+                api=TelegramAPIServer.from_base(str(server.make_url('')).rstrip('/')),
+                timeout=TIMEOUT, max_retries=2, retry_base=0.01,
+            )
+            bot = Bot(token='123456:TEST', session=session)
+            try:
+                with pytest.raises(TelegramNetworkError):
+                    await call(bot)
+            finally:
+                await session.close()
+
+    run(scenario())
+    return requests
+
+
+def test_send_message_is_not_repeated_after_timeout():
+    # Сообщение могло уйти: повтор прислал бы пользователю дубликат
+    requests = _requests_after_timeout(lambda bot: bot.send_message(1, 'test'))
+    assert requests == ['sendMessage']
+
+
+def test_idempotent_method_is_retried_after_timeout():
+    requests = _requests_after_timeout(lambda bot: bot.get_me())
+    assert requests == ['getMe'] * 3
+
+
+def test_connect_error_is_retried_for_any_method():
+    from bot_session import PriorityAiohttpSession
+
+    def network_error(method, cause):
+        try:
+            raise TelegramNetworkError(method=method, message='test') from cause
+        except TelegramNetworkError as e:
+            return e
+
+    send = SendMessage(chat_id=1, text='test')
+    refused = aiohttp.ClientConnectorError(None, OSError(111, 'Connection refused'))
+    assert PriorityAiohttpSession._is_safe_to_retry(send, network_error(send, refused))
+    assert not PriorityAiohttpSession._is_safe_to_retry(
+        send, network_error(send, aiohttp.ServerDisconnectedError())
+    )
+    assert PriorityAiohttpSession._is_safe_to_retry(
+        GetMe(), network_error(GetMe(), aiohttp.ServerDisconnectedError())
+    )
+
+
+def test_bulk_retry_after_is_retried_by_broadcast_only():
+    from broadcast import BroadcastEngine
+    from bot_session import PriorityAiohttpSession
+
+    requests = []
+
+    async def bot_api(request: web.Request) -> web.Response:
+        requests.append(request.match_info['method'])
+        if len(requests) == 1:
+            return web.json_response({
+                'ok': False, 'error_code': 429,
+                'description': 'Too Many Requests: retry after 1',
+                'parameters': {'retry_after': 1},
+            })
+        return web.json_response({'ok': True, 'result': {
+            'message_id': 1, 'date': 0, 'chat': {'id': 1, 'type': 'private'}, 'text': 'test',
+        }})
+
+    async def recipients(after_user_id):
+        yield 1, 1
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', bot_api)
+        async with TestServer(app) as server:
+            session = PriorityAiohttpSession(
+                api=TelegramAPIServer.from_base(str(server.make_url('')).rstrip('/')),
+                max_retries=3,
+            )
+            bot = Bot(token='123456:TEST', session=session)
+            engine = BroadcastEngine(rate=100, per_chat_interval=0, concurrency=1)
+            try:
+                return await engine.run(bot, recipients, 'test')
+            finally:
+                await session.close()
+
+    stats = run(scenario())
+    # Один 429 - один повтор рассылки, без повторов внутри сессии
+    assert requests == ['sendMessage', 'sendMessage']
+    assert (stats.sent, stats.retries) == (1, 1)
@@ -0,0 +1,80 @@
+"""Продолжение прерванной рассылки без повторных сообщений."""
+
+import asyncio
+from types import SimpleNamespace
+
+from support import run
+
+RECIPIENTS = 60
+
+
+def _memory_checkpoint_engine(**kwargs):
+    """BroadcastEngine с контрольными точками в памяти вместо таблицы broadcasts."""
+    from broadcast import BroadcastEngine
+
+    class MemoryCheckpointEngine(BroadcastEngine):
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.checkpoints = {}
+
+        async def _load_checkpoint(self, broadcast_key, webinar_id):
+            return self.checkpoints.setdefault(
+                broadcast_key,
+                SimpleNamespace(status='running', last_user_id=0, sent_count=0, failed_count=0),
+            )
+
+        async def _save_checkpoint(self, broadcast_key, last_user_id, sent, failed,
+                                   done=False):
+            checkpoint = self.checkpoints[broadcast_key]
+            checkpoint.last_user_id = last_user_id
+            checkpoint.sent_count += sent
+            checkpoint.failed_count += failed
+            if done:
+                checkpoint.status = 'done'
+
+    return MemoryCheckpointEngine(**kwargs)
+
+
+class SlowBot:
+    """Бот-заглушка: запоминает получателей, отвечает с задержкой."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.delivered = []
+        self.started = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.started += 1
+        await asyncio.sleep(self.latency * (1 + chat_id % 3))
+        self.delivered.append(chat_id)
+
+
+async def recipients(after_user_id: int):
+    for user_id in range(after_user_id + 1, RECIPIENTS + 1):
+        yield user_id, user_id
+
+
+def test_cancelled_broadcast_resumes_without_duplicates():
+    async def scenario():
+        engine = _memory_checkpoint_engine(rate=1000, per_chat_interval=0, concurrency=10)
+        bot = SlowBot(latency=0.01)
+
+        first = asyncio.create_task(engine.run(bot, recipients, 'test', broadcast_key='resume'))
+        while bot.started < RECIPIENTS // 2:
+            await asyncio.sleep(0.005)
+        first.cancel()
+        try:
+            await first
+        except asyncio.CancelledError:
+            pass
+        interrupted = engine.checkpoints['resume'].last_user_id
+
+        await engine.run(bot, recipients, 'test', broadcast_key='resume')
+        return bot.delivered, interrupted, engine.checkpoints['resume']
+
+    delivered, interrupted, checkpoint = run(scenario())
+    assert 0 < interrupted < RECIPIENTS
+    assert sorted(delivered) == list(range(1, RECIPIENTS + 1))
+    assert (checkpoint.status, checkpoint.last_user_id, checkpoint.sent_count) == (
+        'done', RECIPIENTS, RECIPIENTS
+    )
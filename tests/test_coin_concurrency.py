@@ -0,0 +1,75 @@
+"""Параллельные начисления и списания монет одному пользователю."""
+
+import asyncio
+import random
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from support import run
+
+TELEGRAM_ID = 9_100_000_002
+OPERATIONS = 400
+
+
+async def _reset_user():
+    from database import async_session
+    from models import AICoinOperation, User
+
+    async with async_session() as session:
+        await session.execute(delete(AICoinOperation).where(
+            AICoinOperation.user_id.in_(select(User.id).where(User.telegram_id == TELEGRAM_ID))
+        ))
+        await session.execute(delete(User).where(User.telegram_id == TELEGRAM_ID))
+        await session.execute(insert(User).values(telegram_id=TELEGRAM_ID, user_name='stress'))
+        await session.commit()
+
+
+async def _balance_and_ledger():
+    from database import async_session
+    from models import AICoinOperation, User
+
+    async with async_session() as session:
+        user_id, balance = (await session.execute(
+            select(User.id, User.ai_coins_balance).where(User.telegram_id == TELEGRAM_ID)
+        )).one()
+        ledger_sum, ledger_rows = (await session.execute(
+            select(func.coalesce(func.sum(AICoinOperation.amount), 0), func.count())
+            .where(AICoinOperation.user_id == user_id)
+        )).one()
+    return balance, ledger_sum, ledger_rows
+
+
+def test_parallel_add_and_subtract_keep_balance_equal_to_ledger(postgres):
+    from coin_service import add_coins, add_coins_many, subtract_coins
+
+    random.seed(2)
+    plan = [random.choice(('add', 'subtract', 'bulk')) for _ in range(OPERATIONS)]
+
+    async def operation(kind):
+        if kind == 'add':
+            return kind, await add_coins(TELEGRAM_ID, 10, 'stress')
+        if kind == 'subtract':
+            return kind, await subtract_coins(TELEGRAM_ID, 15, 'stress')
+        balances = await add_coins_many([(TELEGRAM_ID, 5, 'stress bulk')])
+        return kind, balances.get(TELEGRAM_ID)
+
+    async def scenario():
+        await _reset_user()
+        results = await asyncio.gather(*(operation(kind) for kind in plan))
+        return results, await _balance_and_ledger()
+
+    results, (balance, ledger_sum, ledger_rows) = run(scenario())
+
+    returned = [value for _, value in results]
+    spent = sum(1 for kind, value in results if kind == 'subtract' and value != -1)
+    added = sum(10 if kind == 'add' else 5 for kind, _ in results if kind != 'subtract')
+
+    # Ни один промежуточный баланс не ушел в минус, отказ списания - это -1
+    assert all(value == -1 or value >= 0 for value in returned)
+    assert balance >= 0
+    assert balance == ledger_sum == added - 15 * spent
+    # Каждая успешная операция записана в журнал ровно один раз
+    assert ledger_rows == OPERATIONS - sum(
+        1 for kind, value in results if kind == 'subtract' and value == -1
+    )
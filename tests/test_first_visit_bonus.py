@@ -0,0 +1,75 @@
+"""Число SQL-запросов на /start и бонус за первый вход."""
+
+from aiogram import Bot
+from sqlalchemy import delete, select
+
+from support import StatementCounter, StubBotSession, UpdateFactory, run
+
+TELEGRAM_ID = 9_100_000_001
+
+
+class RecordingResult:
+    def __init__(self, value):
+        self.value = value
+
+    def scalar_one_or_none(self):
+        return self.value
+
+
+class RecordingSession:
+    """Сессия, запоминающая выполненные запросы."""
+
+    def __init__(self, bonus_balance):
+        self.bonus_balance = bonus_balance
+        self.statements = []
+        self.info = {}
+
+    async def execute(self, statement, *args, **kwargs):
+        self.statements.append(statement)
+        # Второй запрос - условное начисление бонуса
+        return RecordingResult(self.bonus_balance if len(self.statements) == 2 else None)
+
+
+def test_first_visit_bonus_uses_two_statements():
+    from coin_service import grant_first_visit_bonus
+    from ledger_writer import ledger_writer
+
+    assert not ledger_writer.enabled
+    for bonus_balance in (100, None):  # Новый и вернувшийся пользователь
+        session = RecordingSession(bonus_balance)
+        result = run(grant_first_visit_bonus(session, TELEGRAM_ID, 'test', 100, 'регистрация'))
+        assert result == bonus_balance
+        assert len(session.statements) == 2
+
+
+def test_start_statement_count(postgres):
+    import main
+    from database import async_session
+    from models import AICoinOperation, User
+
+    async def scenario():
+        async with async_session() as session:
+            await session.execute(delete(AICoinOperation).where(
+                AICoinOperation.user_id.in_(select(User.id).where(User.telegram_id == TELEGRAM_ID))
+            ))
+            await session.execute(delete(User).where(User.telegram_id == TELEGRAM_ID))
+            await session.commit()
+
+        bot = Bot(token='123456:TEST', session=StubBotSession())
+        updates = UpdateFactory(bot)
+        counts = []
+        for _ in range(2):  # Первый вход и повторный /start
+            with StatementCounter(postgres) as counter:
+                await main.dp.feed_update(bot, updates.message_update(TELEGRAM_ID, '/start'))
+            counts.append(len(counter.statements))
+
+        async with async_session() as session:
+            balance = await session.scalar(
+                select(User.ai_coins_balance).where(User.telegram_id == TELEGRAM_ID)
+            )
+        return counts, balance
+
+    counts, balance = run(scenario())
+    # upsert пользователя + условное начисление (предстоящих вебинаров нет)
+    assert counts == [2, 2]
+    assert balance == 100
@@ -0,0 +1,42 @@
+"""Рейтинг по балансу: место и top-N против полного пересчета."""
+
+import random
+
+
+def _expected_rank(balances: dict, telegram_id: int) -> int:
+    balance = balances[telegram_id]
+    return 1 + sum(1 for other in balances.values() if other > balance)
+
+
+def test_rank_and_top_match_brute_force_with_large_balances():
+    from leaderboard import Leaderboard
+
+    random.seed(17)
+    board = Leaderboard(enabled=True)
+    balances = {}
+    for _ in range(3000):
+        telegram_id = random.randrange(500)
+        # Редкие огромные балансы не должны влиять на стоимость операций
+        balance = random.choice((random.randrange(50), random.randrange(10 ** 12)))
+        board.update(telegram_id, balance)
+        balances[telegram_id] = balance
+
+    assert len(board) == len(balances)
+    for telegram_id in balances:
+        assert board.rank(telegram_id) == _expected_rank(balances, telegram_id)
+    assert board.rank(10 ** 9) is None
+
+    top = board.top(20)
+    assert [balance for _, balance in top] == sorted(balances.values(), reverse=True)[:20]
+    assert all(balances[telegram_id] == balance for telegram_id, balance in top)
+
+
+def test_equal_balances_share_a_rank():
+    from leaderboard import Leaderboard
+
+    board = Leaderboard(enabled=True)
+    for telegram_id, balance in ((1, 300), (2, 100), (3, 300), (4, -5)):
+        board.update(telegram_id, balance)
+
+    assert [board.rank(telegram_id) for telegram_id in (1, 2, 3, 4)] == [1, 3, 1, 4]
+    assert board.top(2) == [(1, 300), (3, 300)]
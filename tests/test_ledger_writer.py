@@ -0,0 +1,107 @@
+"""Отложенная запись журнала монет: пачки, остановка, ошибки записи."""
+
+import asyncio
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+
+from support import run
+
+TELEGRAM_ID = 9_100_000_050
+REASON = 'тест write-behind'
+
+
+async def _reset_user() -> int:
+    from database import async_session
+    from models import AICoinOperation, User
+
+    async with async_session() as session:
+        await session.execute(delete(AICoinOperation).where(
+            AICoinOperation.user_id.in_(select(User.id).where(User.telegram_id == TELEGRAM_ID))
+        ))
+        await session.execute(delete(User).where(User.telegram_id == TELEGRAM_ID))
+        user_id = await session.scalar(
+            insert(User).values(telegram_id=TELEGRAM_ID, user_name='ledger').returning(User.id)
+        )
+        await session.commit()
+    return user_id
+
+
+async def _persisted(user_id: int) -> list:
+    from database import async_session
+    from models import AICoinOperation
+
+    async with async_session() as session:
+        result = await session.execute(
+            select(AICoinOperation.amount)
+            .where(AICoinOperation.user_id == user_id, AICoinOperation.reason == REASON)
+        )
+        return sorted(result.scalars().all())
+
+
+def _rows(user_id: int, amounts) -> list:
+    return [
+        {'user_id': user_id, 'amount': amount, 'operation_type': 'earned', 'reason': REASON}
+        for amount in amounts
+    ]
+
+
+def test_lag_reports_pending_rows():
+    from ledger_writer import LedgerWriter
+
+    writer = LedgerWriter(enabled=True, batch_size=100)
+    assert writer.lag() == {'pending': 0, 'oldest_age': 0.0, 'flushed_total': 0}
+    writer.enqueue_many(_rows(1, range(3)))
+    lag = writer.lag()
+    assert (lag['pending'], lag['flushed_total']) == (3, 0)
+    assert lag['oldest_age'] >= 0
+
+
+def test_stop_persists_every_row_once(postgres):
+    from ledger_writer import LedgerWriter
+
+    async def scenario():
+        user_id = await _reset_user()
+        writer = LedgerWriter(enabled=True, batch_size=7, flush_interval=0.05)
+        await writer.start()
+        for start in range(0, 100, 10):
+            writer.enqueue_many(_rows(user_id, range(start + 1, start + 11)))
+            await asyncio.sleep(0)
+        # Остановка во время записи: пачки не теряются и не дублируются
+        await writer.stop()
+        return await _persisted(user_id), writer.lag()
+
+    persisted, lag = run(scenario())
+    assert persisted == list(range(1, 101))
+    assert (lag['pending'], lag['flushed_total']) == (0, 100)
+
+
+def test_failed_flush_keeps_the_batch(postgres, monkeypatch):
+    import ledger_writer
+    from ledger_writer import LedgerWriter
+
+    real_session = ledger_writer.async_session
+
+    def broken_session():
+        raise ConnectionError("БД недоступна")
+
+    async def scenario():
+        user_id = await _reset_user()
+        writer = LedgerWriter(enabled=True, batch_size=4)
+        writer.enqueue_many(_rows(user_id, range(1, 11)))
+
+        monkeypatch.setattr(ledger_writer, 'async_session', broken_session)
+        try:
+            await writer.flush()
+        except ConnectionError:
+            pass
+        failed_lag = writer.lag()
+
+        monkeypatch.setattr(ledger_writer, 'async_session', real_session)
+        await writer.flush()
+        return failed_lag, await _persisted(user_id), writer.lag()
+
+    failed_lag, persisted, lag = run(scenario())
+    assert (failed_lag['pending'], failed_lag['flushed_total']) == (10, 0)
+    assert persisted == list(range(1, 11))
+    assert (lag['pending'], lag['flushed_total']) == (0, 10)
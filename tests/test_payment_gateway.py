@@ -0,0 +1,40 @@
+"""Повторы запросов к API ЮКассы."""
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from support import run
+
+
+def test_html_gateway_error_is_retried():
+    from payment_gateway import YooKassaGateway
+
+    calls = []
+
+    async def create_payment(request: web.Request) -> web.Response:
+        calls.append(request.headers.get('Idempotence-Key'))
+        if len(calls) == 1:
+            # Так отвечает балансировщик, когда API недоступен
+            return web.Response(status=502, text='<html><body>502 Bad Gateway</body></html>',
+                                content_type='text/html')
+        return web.json_response({
+            'id': 'payment-1',
+            'status': 'pending',
+            'amount': {'value': '1000.00', 'currency': 'RUB'},
+            'confirmation': {'confirmation_url': 'https://yoomoney.example/checkout/payment-1'},
+        })
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_post('/payments', create_payment)
+        async with TestServer(app) as server:
+            gateway = YooKassaGateway('shop', 'secret', str(server.make_url('')), retries=2)
+            try:
+                return await gateway.create_payment({'amount': {}}, 'key-1')
+            finally:
+                await gateway.close()
+
+    payment = run(scenario())
+    assert payment.id == 'payment-1'
+    # Повтор идет с тем же ключом идемпотентности
+    assert calls == ['key-1', 'key-1']
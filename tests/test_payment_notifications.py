@@ -0,0 +1,132 @@
+"""Проверка уведомлений ЮКассы запросом платежа к API."""
+
+import asyncio
+from decimal import Decimal
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from support import run
+
+COURSE_PAYMENT = {
+    'amount': {'value': '1000.00', 'currency': 'RUB'},
+    'metadata': {'user_id': '7', 'course_id': '3'},
+}
+
+
+class RecordingSettler:
+    """Заглушка PaymentSettler: запоминает платежи, поставленные в очередь."""
+
+    def __init__(self):
+        self.payments = []
+
+    async def settle(self, payment):
+        self.payments.append(payment)
+
+
+async def _post_notifications(gateway, notifications):
+    from payment_notifications import YOOKASSA_NOTIFICATION_PATH, handle_notification
+
+    settler = RecordingSettler()
+    app = web.Application()
+    app['payment_settler'] = settler
+    app['payment_gateway'] = gateway
+    app.router.add_post(YOOKASSA_NOTIFICATION_PATH, handle_notification)
+
+    statuses = []
+    async with TestClient(TestServer(app)) as client:
+        for notification in notifications:
+            response = await client.post(YOOKASSA_NOTIFICATION_PATH, json=notification)
+            statuses.append(response.status)
+    return statuses, settler.payments
+
+
+def test_forged_notification_is_not_settled():
+    from payment_gateway import FakePaymentGateway
+
+    async def scenario():
+        gateway = FakePaymentGateway()
+        payment = await gateway.create_payment(COURSE_PAYMENT, 'key-1')
+        # Платеж еще не оплачен, а уведомление утверждает обратное
+        forged = {
+            'event': 'payment.succeeded',
+            'object': {'id': payment.id, 'status': 'succeeded',
+                       'amount': {'value': '1.00', 'currency': 'RUB'}},
+        }
+        unknown = {'event': 'payment.succeeded', 'object': {'id': 'no-such-payment'}}
+        return await _post_notifications(gateway, [forged, unknown])
+
+    statuses, settled = run(scenario())
+    assert statuses == [200, 500]
+    assert settled == []
+
+
+def test_notification_settles_payment_as_reported_by_api():
+    from payment_gateway import FakePaymentGateway
+
+    async def scenario():
+        gateway = FakePaymentGateway()
+        payment = await gateway.create_payment(COURSE_PAYMENT, 'key-2')
+        gateway.set_status(payment.id, 'succeeded')
+        # Сумма в теле уведомления игнорируется, проводится ответ API
+        notification = {
+            'event': 'payment.succeeded',
+            'object': {'id': payment.id, 'amount': {'value': '1.00', 'currency': 'RUB'}},
+        }
+        return payment.id, await _post_notifications(gateway, [notification])
+
+    payment_id, (statuses, settled) = run(scenario())
+    assert statuses == [200]
+    assert [(p.id, p.status, p.amount, p.currency) for p in settled] == [
+        (payment_id, 'succeeded', Decimal('1000.00'), 'RUB')
+    ]
+
+
+def test_failed_payment_does_not_fail_its_batch():
+    from payment_gateway import FakePaymentGateway
+    from payment_notifications import (
+        YOOKASSA_NOTIFICATION_PATH, PaymentSettler, handle_notification,
+    )
+
+    class FailingSettler(PaymentSettler):
+        """Проведение падает на любой пачке с платежом bad_id."""
+
+        def __init__(self, bad_id):
+            super().__init__(bot=None, batch_size=10, interval=0.2)
+            self.bad_id = bad_id
+            self.flushes = []
+
+        async def _flush(self, payments):
+            self.flushes.append(len(payments))
+            if any(payment.id == self.bad_id for payment in payments):
+                raise RuntimeError("ошибка записи")
+            return []
+
+    async def scenario():
+        gateway = FakePaymentGateway()
+        payments = [await gateway.create_payment(COURSE_PAYMENT, f"key-{n}") for n in range(3)]
+        for payment in payments:
+            gateway.set_status(payment.id, 'succeeded')
+
+        settler = FailingSettler(bad_id=payments[1].id)
+        app = web.Application()
+        app['payment_settler'] = settler
+        app['payment_gateway'] = gateway
+        app.router.add_post(YOOKASSA_NOTIFICATION_PATH, handle_notification)
+        await settler.start()
+        try:
+            async with TestClient(TestServer(app)) as client:
+                responses = await asyncio.gather(*(
+                    client.post(YOOKASSA_NOTIFICATION_PATH, json={
+                        'event': 'payment.succeeded', 'object': {'id': payment.id},
+                    })
+                    for payment in payments
+                ))
+        finally:
+            await settler.stop()
+        return [response.status for response in responses], settler.flushes
+
+    statuses, flushes = run(scenario())
+    # Пачка из трех не провелась, затем каждый платеж проведен отдельно
+    assert flushes == [3, 1, 1, 1]
+    assert statuses == [200, 500, 200]
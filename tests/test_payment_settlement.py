@@ -0,0 +1,189 @@
+"""Проведение платежей по уведомлениям ЮКассы в Postgres."""
+
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+from aiogram import Bot
+from aiogram.methods import SendMessage
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from sqlalchemy import delete, insert, select, text
+
+from support import StubBotSession, run
+
+TELEGRAM_ID = 9_100_000_020
+COURSE_NAMES = ('Курс проведения 1', 'Курс проведения 2')
+
+
+async def _prepare():
+    """Пользователь и два курса без платежей и регистраций."""
+    from database import async_session
+    from models import Course, Payment, User, course_registrations
+
+    async with async_session() as session:
+        users = select(User.id).where(User.telegram_id == TELEGRAM_ID)
+        courses = select(Course.id).where(Course.course_name.in_(COURSE_NAMES))
+        await session.execute(delete(course_registrations).where(
+            course_registrations.c.user_id.in_(users)
+        ))
+        await session.execute(delete(Payment).where(Payment.user_id.in_(users)))
+        await session.execute(delete(Payment).where(Payment.course_id.in_(courses)))
+        await session.execute(delete(Course).where(Course.course_name.in_(COURSE_NAMES)))
+        await session.execute(delete(User).where(User.telegram_id == TELEGRAM_ID))
+
+        user = User(telegram_id=TELEGRAM_ID, user_name='payer')
+        course_list = [
+            Course(course_name=name, price=1000, is_active=True,
+                   start_date=datetime.now() + timedelta(days=1))
+            for name in COURSE_NAMES
+        ]
+        session.add_all([user, *course_list])
+        await session.flush()
+        ids = user.id, [course.id for course in course_list]
+        await session.commit()
+    return ids
+
+
+async def _add_payment(user_id: int, course_id: int, payment_id: str):
+    from database import async_session
+    from models import Payment
+
+    async with async_session() as session:
+        await session.execute(insert(Payment).values(
+            user_id=user_id, course_id=course_id, payment_id=payment_id,
+            amount=1000, currency='RUB',
+            status=text("'pending'::payment_status"),
+        ))
+        await session.commit()
+
+
+async def _payments(user_id: int) -> dict:
+    from database import async_session
+    from models import Payment
+
+    async with async_session() as session:
+        result = await session.execute(
+            select(Payment.payment_id, Payment.course_id, Payment.status)
+            .where(Payment.user_id == user_id)
+        )
+        return {row.payment_id: (row.course_id, row.status.value) for row in result}
+
+
+async def _registrations(user_id: int) -> list:
+    from database import async_session
+    from models import course_registrations
+
+    async with async_session() as session:
+        result = await session.execute(
+            select(course_registrations.c.course_id)
+            .where(course_registrations.c.user_id == user_id)
+        )
+        return sorted(result.scalars().all())
+
+
+async def _create(gateway, user_id: int, course_id: int):
+    return await gateway.create_payment(
+        {
+            'amount': {'value': '1000.00', 'currency': 'RUB'},
+            'metadata': {'user_id': str(user_id), 'course_id': str(course_id)},
+        },
+        str(uuid.uuid4()),
+    )
+
+
+def _notification(payment_id: str, status: str) -> dict:
+    return {'event': f"payment.{status}", 'object': {'id': payment_id, 'status': status}}
+
+
+def test_repeated_and_late_notifications_settle_once(postgres):
+    from payment_gateway import FakePaymentGateway
+    from payment_notifications import YOOKASSA_NOTIFICATION_PATH, setup_payment_notifications
+
+    async def scenario():
+        user_id, (course_id, _) = await _prepare()
+        gateway = FakePaymentGateway()
+        payment = await _create(gateway, user_id, course_id)
+        await _add_payment(user_id, course_id, payment.id)
+
+        bot_session = StubBotSession()
+        app = web.Application()
+        setup_payment_notifications(app, Bot(token='123456:TEST', session=bot_session))
+        app['payment_gateway'] = gateway
+
+        succeeded = _notification(payment.id, 'succeeded')
+        async with TestClient(TestServer(app)) as client:
+            gateway.set_status(payment.id, 'succeeded')
+            # Два повтора в одной пачке и еще один в следующей
+            responses = await asyncio.gather(*(
+                client.post(YOOKASSA_NOTIFICATION_PATH, json=succeeded) for _ in range(2)
+            ))
+            responses.append(await client.post(YOOKASSA_NOTIFICATION_PATH, json=succeeded))
+            # Запоздалая отмена после успешной оплаты
+            gateway.set_status(payment.id, 'canceled')
+            responses.append(await client.post(
+                YOOKASSA_NOTIFICATION_PATH, json=_notification(payment.id, 'canceled')
+            ))
+        statuses = [response.status for response in responses]
+
+        confirmations = [m for m in bot_session.methods if isinstance(m, SendMessage)]
+        return (statuses, await _payments(user_id), await _registrations(user_id),
+                confirmations, payment.id, course_id)
+
+    statuses, payments, registrations, confirmations, payment_id, course_id = run(scenario())
+    assert statuses == [200, 200, 200, 200]
+    assert payments == {payment_id: (course_id, 'succeeded')}
+    assert registrations == [course_id]
+    assert len(confirmations) == 1
+
+
+def test_legacy_payment_is_matched_only_by_successful_payment(postgres):
+    from payment_gateway import FakePaymentGateway
+    from payment_notifications import YOOKASSA_NOTIFICATION_PATH, setup_payment_notifications
+
+    async def scenario():
+        user_id, (course_id, other_course_id) = await _prepare()
+        gateway = FakePaymentGateway()
+
+        # Старая запись: в payment_id ключ идемпотентности
+        legacy_id = str(uuid.uuid4())
+        await _add_payment(user_id, course_id, legacy_id)
+        # Текущий платеж за другой курс, записанный с ID ЮКассы
+        current = await _create(gateway, user_id, other_course_id)
+        await _add_payment(user_id, other_course_id, current.id)
+
+        # Платежи ЮКассы, которых нет в таблице payments
+        orphan_canceled = await _create(gateway, user_id, other_course_id)
+        gateway.set_status(orphan_canceled.id, 'canceled')
+        orphan_succeeded = await _create(gateway, user_id, other_course_id)
+        gateway.set_status(orphan_succeeded.id, 'succeeded')
+        legacy_succeeded = await _create(gateway, user_id, course_id)
+        gateway.set_status(legacy_succeeded.id, 'succeeded')
+
+        app = web.Application()
+        setup_payment_notifications(app, Bot(token='123456:TEST', session=StubBotSession()))
+        app['payment_gateway'] = gateway
+
+        statuses = []
+        async with TestClient(TestServer(app)) as client:
+            for payment, status in ((orphan_canceled, 'canceled'),
+                                    (orphan_succeeded, 'succeeded'),
+                                    (legacy_succeeded, 'succeeded')):
+                response = await client.post(
+                    YOOKASSA_NOTIFICATION_PATH, json=_notification(payment.id, status)
+                )
+                statuses.append(response.status)
+
+        return (statuses, await _payments(user_id), await _registrations(user_id),
+                current.id, legacy_succeeded.id, course_id, other_course_id)
+
+    (statuses, payments, registrations,
+     current_id, legacy_succeeded_id, course_id, other_course_id) = run(scenario())
+    assert statuses == [200, 200, 200]
+    assert payments == {
+        # Платеж с ID ЮКассы не тронут ни отменой, ни чужой оплатой
+        current_id: (other_course_id, 'pending'),
+        # Старая запись проведена и получила ID ЮКассы
+        legacy_succeeded_id: (course_id, 'succeeded'),
+    }
+    assert registrations == [course_id]
@@ -0,0 +1,87 @@
+"""Покупка курса при медленном ответе ЮКассы."""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from aiogram import Bot
+from sqlalchemy import delete, select
+
+from support import StubBotSession, UpdateFactory, run
+
+BUYER_ID = 9_100_000_010
+OTHER_IDS = range(9_100_000_011, 9_100_000_016)
+GATEWAY_LATENCY = 1.0
+
+
+def test_slow_gateway_does_not_hold_a_connection_or_block_updates(postgres, monkeypatch):
+    import main
+    from course_offer import course_offer_cache
+    from database import async_session
+    from handlers import enroll_course
+    from models import AICoinOperation, Course, Payment, User
+    from payment_gateway import FakePaymentGateway
+
+    class SlowGateway(FakePaymentGateway):
+        """Заглушка ЮКассы, запоминающая занятые соединения пула при вызове."""
+
+        def __init__(self):
+            super().__init__(latency=GATEWAY_LATENCY)
+            self.called = asyncio.Event()
+            self.checked_out = None
+
+        async def create_payment(self, payment_data, idempotency_key):
+            self.checked_out = postgres.pool.checkedout()
+            self.called.set()
+            return await super().create_payment(payment_data, idempotency_key)
+
+    gateway = SlowGateway()
+    monkeypatch.setattr(enroll_course, 'payment_gateway', gateway)
+    telegram_ids = [BUYER_ID, *OTHER_IDS]
+
+    async def scenario():
+        async with async_session() as session:
+            users = select(User.id).where(User.telegram_id.in_(telegram_ids))
+            await session.execute(delete(Payment).where(Payment.user_id.in_(users)))
+            await session.execute(delete(AICoinOperation).where(AICoinOperation.user_id.in_(users)))
+            await session.execute(delete(User).where(User.telegram_id.in_(telegram_ids)))
+            await session.execute(delete(Payment).where(Payment.course_id.in_(
+                select(Course.id).where(Course.course_name == 'Тестовый курс')
+            )))
+            await session.execute(delete(Course).where(Course.course_name == 'Тестовый курс'))
+            session.add(Course(course_name='Тестовый курс', price=1000, is_active=True,
+                               start_date=datetime.now() + timedelta(days=1)))
+            await session.commit()
+        course_offer_cache.invalidate()
+
+        bot = Bot(token='123456:TEST', session=StubBotSession())
+        updates = UpdateFactory(bot)
+
+        purchase = asyncio.create_task(
+            main.dp.feed_update(bot, updates.callback_update(BUYER_ID, 'purchase_course'))
+        )
+        await gateway.called.wait()
+
+        # Пока ЮКасса отвечает, обновления других пользователей (с БД) обрабатываются
+        started = asyncio.get_running_loop().time()
+        await asyncio.gather(*(
+            main.dp.feed_update(bot, updates.message_update(telegram_id, '/start'))
+            for telegram_id in OTHER_IDS
+        ))
+        others_elapsed = asyncio.get_running_loop().time() - started
+        purchase_pending = not purchase.done()
+        await purchase
+
+        async with async_session() as session:
+            payment_ids = (await session.execute(
+                select(Payment.payment_id)
+                .join(User, User.id == Payment.user_id)
+                .where(User.telegram_id == BUYER_ID)
+            )).scalars().all()
+        return others_elapsed, purchase_pending, payment_ids
+
+    others_elapsed, purchase_pending, payment_ids = run(scenario())
+    # Во время запроса к ЮКассе обработчик не держит соединение с БД
+    assert gateway.checked_out == 0
+    assert purchase_pending
+    assert others_elapsed < GATEWAY_LATENCY
+    assert len(payment_ids) == 1
@@ -0,0 +1,15 @@
+"""Планы запросов, которые выполняет код бота, на заполненной схеме."""
+
+from support import run
+
+
+def test_hot_paths_avoid_large_seq_scans(postgres):
+    from check_query_plans import check
+
+    result = run(check(users=20_000, schema='query_plan_test'))
+
+    assert result['errors'] == {}
+    assert result['queries']
+    assert result['failed'] == [], {
+        name: result['queries'][name] for name in result['failed']
+    }
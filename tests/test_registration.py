@@ -0,0 +1,65 @@
+"""Подтверждение регистрации на вебинар одним INSERT ... ON CONFLICT."""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from aiogram import Bot
+from sqlalchemy import delete, func, select
+
+from support import StubBotSession, UpdateFactory, run
+
+TELEGRAM_ID = 9_100_000_040
+TOPIC = 'Тестовый вебинар регистрации'
+
+
+def test_concurrent_confirmations_register_and_grant_bonus_once(postgres, monkeypatch):
+    import main
+    from database import async_session
+    from middlewares.callback_debounce import callback_debounce
+    from models import AICoinOperation, User, Webinar, webinar_registrations
+
+    # Оба нажатия должны дойти до обработчика
+    monkeypatch.setattr(callback_debounce, 'window', 0)
+
+    async def scenario():
+        async with async_session() as session:
+            users = select(User.id).where(User.telegram_id == TELEGRAM_ID)
+            webinars = select(Webinar.id).where(Webinar.topic == TOPIC)
+            await session.execute(delete(webinar_registrations).where(
+                webinar_registrations.c.user_id.in_(users)
+                | webinar_registrations.c.webinar_id.in_(webinars)
+            ))
+            await session.execute(delete(AICoinOperation).where(AICoinOperation.user_id.in_(users)))
+            await session.execute(delete(User).where(User.telegram_id == TELEGRAM_ID))
+            await session.execute(delete(Webinar).where(Webinar.topic == TOPIC))
+            webinar = Webinar(webinar_date=datetime.now() + timedelta(days=1), topic=TOPIC)
+            session.add_all([User(telegram_id=TELEGRAM_ID, user_name='registration'), webinar])
+            await session.commit()
+            webinar_id = webinar.id
+
+        bot = Bot(token='123456:TEST', session=StubBotSession())
+        updates = UpdateFactory(bot)
+        await asyncio.gather(*(
+            main.dp.feed_update(
+                bot, updates.callback_update(TELEGRAM_ID, f"confirm_registration_{webinar_id}")
+            )
+            for _ in range(2)
+        ))
+
+        async with async_session() as session:
+            user_id, balance = (await session.execute(
+                select(User.id, User.ai_coins_balance).where(User.telegram_id == TELEGRAM_ID)
+            )).one()
+            registrations = await session.scalar(
+                select(func.count()).select_from(webinar_registrations)
+                .where(webinar_registrations.c.user_id == user_id)
+            )
+            bonuses = await session.scalar(
+                select(func.count()).select_from(AICoinOperation)
+                .where(AICoinOperation.user_id == user_id,
+                       AICoinOperation.reason == 'подтверждение регистрации')
+            )
+        return registrations, bonuses, balance
+
+    registrations, bonuses, balance = run(scenario())
+    assert (registrations, bonuses, balance) == (1, 1, 100)
@@ -0,0 +1,109 @@
+"""Возврат заданий в очередь при остановке планировщика."""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select
+
+from support import StubBotSession, run
+
+JOB_TYPE = 'test_blocking_job'
+
+
+def test_stop_releases_claimed_jobs(postgres, monkeypatch):
+    from aiogram import Bot
+
+    import scheduler
+    from database import async_session
+    from models import ScheduledJob
+
+    started = None
+
+    async def blocking_job(bot, job):
+        started.set()
+        await asyncio.Event().wait()  # Выполняется до остановки
+
+    monkeypatch.setitem(scheduler.JOB_HANDLERS, JOB_TYPE, blocking_job)
+
+    async def scenario():
+        nonlocal started
+        started = asyncio.Event()
+        async with async_session() as session:
+            await session.execute(delete(ScheduledJob).where(ScheduledJob.job_type == JOB_TYPE))
+            session.add(ScheduledJob(job_type=JOB_TYPE, dedup_key=f"{JOB_TYPE}:1",
+                                     run_at=datetime.now() - timedelta(seconds=1)))
+            await session.commit()
+
+        job_scheduler = scheduler.JobScheduler()
+        await job_scheduler.start(Bot(token='123456:TEST', session=StubBotSession()))
+        await asyncio.wait_for(started.wait(), timeout=10)
+        await job_scheduler.stop()
+
+        async with async_session() as session:
+            return (await session.execute(
+                select(ScheduledJob.status, ScheduledJob.locked_until, ScheduledJob.attempts)
+                .where(ScheduledJob.job_type == JOB_TYPE)
+            )).one()
+
+    status, locked_until, attempts = run(scenario())
+    # После перезапуска задание сразу доступно, прерванная попытка не засчитана
+    assert (status, locked_until, attempts) == ('pending', None, 0)
+
+
+def test_long_job_does_not_delay_other_due_jobs(postgres, monkeypatch):
+    from aiogram import Bot
+
+    import scheduler
+    from database import async_session
+    from models import ScheduledJob
+
+    quick_type = 'test_quick_job'
+    started = quick_done = None
+
+    async def blocking_job(bot, job):
+        started.set()
+        await asyncio.Event().wait()  # Долгая рассылка
+
+    async def quick_job(bot, job):
+        quick_done.set()
+
+    monkeypatch.setitem(scheduler.JOB_HANDLERS, JOB_TYPE, blocking_job)
+    monkeypatch.setitem(scheduler.JOB_HANDLERS, quick_type, quick_job)
+
+    async def scenario():
+        nonlocal started, quick_done
+        started, quick_done = asyncio.Event(), asyncio.Event()
+        async with async_session() as session:
+            await session.execute(
+                delete(ScheduledJob).where(ScheduledJob.job_type.in_([JOB_TYPE, quick_type]))
+            )
+            now = datetime.now()
+            session.add_all([
+                ScheduledJob(job_type=JOB_TYPE, dedup_key=f"{JOB_TYPE}:1",
+                             run_at=now - timedelta(seconds=2)),
+                ScheduledJob(job_type=quick_type, dedup_key=f"{quick_type}:1",
+                             run_at=now - timedelta(seconds=1)),
+            ])
+            await session.commit()
+
+        job_scheduler = scheduler.JobScheduler()
+        await job_scheduler.start(Bot(token='123456:TEST', session=StubBotSession()))
+        try:
+            await asyncio.wait_for(started.wait(), timeout=10)
+            await asyncio.wait_for(quick_done.wait(), timeout=10)
+            # Ждем, пока быстрое задание отметится выполненным
+            while len(job_scheduler._jobs) > 1:
+                await asyncio.sleep(0.01)
+        finally:
+            await job_scheduler.stop()
+
+        async with async_session() as session:
+            result = await session.execute(
+                select(ScheduledJob.job_type, ScheduledJob.status)
+                .where(ScheduledJob.job_type.in_([JOB_TYPE, quick_type]))
+            )
+            return dict(result.all())
+
+    statuses = run(scenario())
+    # Быстрое задание выполнено, пока долгое еще шло; долгое вернулось в очередь
+    assert statuses == {quick_type: 'done', JOB_TYPE: 'pending'}
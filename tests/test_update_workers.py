@@ -0,0 +1,52 @@
+"""Повторные нажатия кнопок при очереди воркеров."""
+
+import asyncio
+
+from aiogram import Bot, Dispatcher, F
+from aiogram.methods import AnswerCallbackQuery
+
+from support import StubBotSession, UpdateFactory, run
+
+TELEGRAM_ID = 9_100_000_020
+WINDOW = 0.2
+# Обработка дольше окна: при отсчете окна от начала обработки повтор прошел бы
+HANDLER_DURATION = 0.3
+
+
+def test_duplicate_callback_queued_behind_slow_handler_is_dropped():
+    from middlewares.callback_debounce import CallbackDebounceMiddleware
+    from update_workers import UpdateWorkerPool
+
+    purchases = []
+
+    async def scenario():
+        debounce = CallbackDebounceMiddleware(window=WINDOW)
+        pool = UpdateWorkerPool(workers=1, queue_size=10, debounce=debounce)
+        dp = Dispatcher()
+        dp.update.outer_middleware(pool)
+        dp.callback_query.middleware(debounce)
+
+        @dp.callback_query(F.data == 'slow')
+        async def slow(callback):
+            await asyncio.sleep(HANDLER_DURATION)
+
+        @dp.callback_query(F.data == 'purchase_course')
+        async def purchase(callback):
+            purchases.append(callback.id)
+            await asyncio.sleep(HANDLER_DURATION)
+
+        session = StubBotSession()
+        bot = Bot(token='123456:TEST', session=session)
+        updates = UpdateFactory(bot)
+
+        pool.start()
+        # Оба нажатия ждут в очереди пользователя за медленным обработчиком
+        for data in ('slow', 'purchase_course', 'purchase_course'):
+            await dp.feed_update(bot, updates.callback_update(TELEGRAM_ID, data))
+        await pool.stop()
+        await asyncio.sleep(0)  # Ответ на повтор отправляется в фоне
+        return session.methods
+
+    methods = run(scenario())
+    assert len(purchases) == 1
+    assert sum(isinstance(method, AnswerCallbackQuery) for method in methods) == 1
@@ -0,0 +1,132 @@
+"""
+Обработка обновлений фиксированным пулом воркеров с очередью на каждого.
+
+Внешний middleware на dp.update ставит обновление в очередь воркера,
+выбранного по from_user.id (или по чату), и сразу возвращает управление.
+Поэтому:
+- обновления одного пользователя обрабатываются строго по очереди;
+- разные пользователи обрабатываются параллельно (UPDATE_WORKERS воркеров),
+  и одновременно к пулу соединений БД обращается не больше воркеров;
+- при заполненной очереди (UPDATE_QUEUE_SIZE) постановка ждет, что
+  притормаживает long polling или ответы на вебхук (обратное давление);
+- повторные нажатия кнопок отбрасываются до постановки в очередь
+  (callback_debounce), по времени поступления, а не начала обработки.
+
+Middleware должен регистрироваться первым из внешних, чтобы время ожидания
+в очереди не попадало в метрики обработчиков.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from dotenv import load_dotenv
+
+from metrics import UPDATE_QUEUE_DEPTH, UPDATE_QUEUE_FULL, UPDATE_QUEUE_WAIT
+from middlewares.callback_debounce import CallbackDebounceMiddleware, callback_debounce
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+
+class UpdateWorkerPool(BaseMiddleware):
+    """Пул воркеров с сохранением порядка обновлений каждого пользователя."""
+
+    def __init__(self, workers: int, queue_size: int, drain_timeout: float = 30.0,
+                 debounce: CallbackDebounceMiddleware = None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.drain_timeout = drain_timeout
+        self.debounce = debounce
+
+        self._queues = []
+        self._tasks = []
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def depth(self) -> int:
+        """Количество обновлений, ожидающих обработки во всех очередях."""
+        return sum(queue.qsize() for queue in self._queues)
+
+    def _shard(self, event: Update, data: Dict[str, Any]) -> int:
+        user = data.get('event_from_user')
+        chat = data.get('event_chat')
+        if user is not None:
+            key = user.id
+        elif chat is not None:
+            key = chat.id
+        else:
+            key = event.update_id
+        return key % self.workers
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not self._queues:
+            # Пул не запущен (например, в отдельном скрипте) - обрабатываем сразу
+            return await handler(event, data)
+
+        callback = event.callback_query
+        if callback is not None and self.debounce is not None:
+            if self.debounce.check_arrival(callback):
+                return None
+
+        queue = self._queues[self._shard(event, data)]
+        if queue.full():
+            UPDATE_QUEUE_FULL.inc()
+        await queue.put((time.monotonic(), handler, event, data))
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            enqueued_at, handler, event, data = await queue.get()
+            UPDATE_QUEUE_WAIT.observe(time.monotonic() - enqueued_at)
+            try:
+                await handler(event, data)
+            except Exception as e:
+                logger.error(f"Ошибка при обработке обновления {event.update_id}: {e}", exc_info=True)
+            finally:
+                queue.task_done()
+
+    def start(self):
+        """Запускает воркеры."""
+        if not self.enabled or self._tasks:
+            return
+        self._queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+        for worker, queue in enumerate(self._queues):
+            UPDATE_QUEUE_DEPTH.labels(str(worker)).set_function(queue.qsize)
+        logger.info(f"Пул обработки обновлений: {self.workers} воркеров, очередь {self.queue_size}")
+
+    async def stop(self):
+        """Дожидается обработки принятых обновлений (не дольше drain_timeout) и останавливает воркеры."""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self._queues)),
+                timeout=self.drain_timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Не обработано обновлений при остановке: {self.depth()}")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queues = []
+
+
+update_workers = UpdateWorkerPool(
+    workers=int(os.getenv('UPDATE_WORKERS', '16')),
+    queue_size=int(os.getenv('UPDATE_QUEUE_SIZE', '100')),
+    debounce=callback_debounce,
+)
@@ -0,0 +1,134 @@
+"""
+Прием обновлений Telegram через вебхук (альтернатива long polling).
+
+HTTP-эндпоинт на aiohttp проверяет секретный токен из заголовка
+X-Telegram-Bot-Api-Secret-Token и передает обновления в dp.feed_update.
+Без секрета эндпоинт не работает: в режиме webhook BOT_WEBHOOK_SECRET
+обязателен, и бот не запускается без него. Секрет должен быть общим для
+всех экземпляров: случайный секрет каждого процесса перезаписывался бы
+при регистрации вебхука, и остальные экземпляры отвечали бы Telegram 401.
+Обновления, накопившиеся в Telegram за время перезапуска, при регистрации
+вебхука не сбрасываются.
+Одновременно обрабатывается не более BOT_WEBHOOK_CONCURRENCY обновлений,
+остальные запросы ждут свободного слота (Telegram повторит доставку сам).
+"""
+
+import asyncio
+import hmac
+import logging
+import os
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from dotenv import load_dotenv
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+# Публичный адрес, который регистрируется в Telegram (без пути)
+BOT_WEBHOOK_BASE_URL = os.getenv('BOT_WEBHOOK_BASE_URL', '')
+BOT_WEBHOOK_PATH = os.getenv('BOT_WEBHOOK_PATH', '/telegram/webhook')
+BOT_WEBHOOK_SECRET = os.getenv('BOT_WEBHOOK_SECRET', '')
+BOT_WEBHOOK_HOST = os.getenv('BOT_WEBHOOK_HOST', '0.0.0.0')
+BOT_WEBHOOK_PORT = int(os.getenv('BOT_WEBHOOK_PORT', '8080'))
+BOT_WEBHOOK_CONCURRENCY = int(os.getenv('BOT_WEBHOOK_CONCURRENCY', '100'))
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+def check_webhook_settings():
+    """Проверяет настройки режима webhook до запуска бота."""
+    if not BOT_WEBHOOK_BASE_URL:
+        raise ValueError("BOT_WEBHOOK_BASE_URL не задан для режима webhook")
+    if not BOT_WEBHOOK_SECRET:
+        raise ValueError("BOT_WEBHOOK_SECRET не задан для режима webhook")
+
+
+class TelegramWebhookHandler:
+    """Обработчик запросов от Telegram с ограничением параллельности."""
+
+    def __init__(self, bot: Bot, dp: Dispatcher, secret: str, concurrency: int):
+        if not secret:
+            raise ValueError("Вебхук Telegram нельзя запускать без секретного токена")
+        self.bot = bot
+        self.dp = dp
+        self.secret = secret
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks = set()
+
+    def _check_secret(self, request: web.Request) -> bool:
+        received = request.headers.get(SECRET_HEADER, '')
+        return hmac.compare_digest(received, self.secret)
+
+    async def _process(self, update: Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке обновления {update.update_id}: {e}", exc_info=True)
+        finally:
+            self._slots.release()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not self._check_secret(request):
+            logger.warning(f"Отклонен запрос вебхука без верного секрета от {request.remote}")
+            return web.Response(status=401)
+
+        try:
+            data = await request.json()
+            update = Update.model_validate(data, context={"bot": self.bot})
+        except Exception as e:
+            logger.warning(f"Некорректное обновление в вебхуке: {e}")
+            return web.Response(status=400)
+
+        # Ждем свободный слот, затем отвечаем Telegram сразу, не дожидаясь обработки
+        await self._slots.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def drain(self):
+        """Дожидается обработки всех принятых обновлений."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def setup_telegram_webhook(app: web.Application, bot: Bot, dp: Dispatcher):
+    """Добавляет в aiohttp-приложение эндпоинт вебхука Telegram."""
+    handler = TelegramWebhookHandler(
+        bot, dp,
+        secret=BOT_WEBHOOK_SECRET,
+        concurrency=BOT_WEBHOOK_CONCURRENCY,
+    )
+    app['telegram_webhook'] = handler
+    app.router.add_post(BOT_WEBHOOK_PATH, handler.handle)
+    app.on_shutdown.append(lambda _: handler.drain())
+
+
+async def start_http_server(app: web.Application) -> web.AppRunner:
+    """Запускает HTTP-сервер бота (вебхук Telegram, уведомления ЮКассы)."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, BOT_WEBHOOK_HOST, BOT_WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"HTTP-сервер слушает {BOT_WEBHOOK_HOST}:{BOT_WEBHOOK_PORT}")
+    return runner
+
+
+async def register_webhook(bot: Bot, dp: Dispatcher):
+    """Регистрирует вебхук в Telegram (накопившиеся обновления сохраняются)."""
+    check_webhook_settings()
+
+    await bot.set_webhook(
+        url=BOT_WEBHOOK_BASE_URL.rstrip('/') + BOT_WEBHOOK_PATH,
+        secret_token=BOT_WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        drop_pending_updates=False,
+    )
+    logger.info(
+        f"✅ Вебхук зарегистрирован: {BOT_WEBHOOK_PATH}, "
+        f"параллельность {BOT_WEBHOOK_CONCURRENCY}"
+    )
@@ -0,0 +1,128 @@
+"""
+Расписание вебинаров в памяти процесса.
+
+Таблица webinars маленькая и меняется редко, поэтому предстоящие вебинары
+загружаются при старте бота и хранятся отсортированными по дате. Индекс
+перестраивается после /create_webinar и периодически по таймеру.
+"""
+
+import asyncio
+import logging
+import os
+from bisect import bisect_right
+from datetime import datetime
+
+from dotenv import load_dotenv
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import async_session
+from models import User, Webinar, webinar_registrations
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+
+class WebinarSchedule:
+    """Отсортированный по дате индекс предстоящих вебинаров."""
+
+    def __init__(self, refresh_interval: float = 300.0):
+        self.refresh_interval = refresh_interval
+
+        self._webinars = []  # Отсоединенные объекты Webinar, по возрастанию даты
+        self._dates = []     # Даты вебинаров для бинарного поиска
+        self._task = None
+
+    async def refresh(self):
+        """Перечитывает предстоящие вебинары из БД и перестраивает индекс."""
+        async with async_session() as session:
+            result = await session.execute(
+                select(Webinar)
+                .where(Webinar.webinar_date > datetime.now())
+                .order_by(Webinar.webinar_date.asc())
+            )
+            webinars = result.scalars().all()
+
+        # Заменяем оба списка разом, чтобы читатели не увидели смесь старого и нового
+        self._webinars, self._dates = (
+            list(webinars), [webinar.webinar_date for webinar in webinars]
+        )
+        logger.info(f"Расписание вебинаров обновлено: {len(webinars)} предстоящих")
+
+    def upcoming(self, now: datetime = None) -> list:
+        """Возвращает вебинары, которые еще не начались, по возрастанию даты."""
+        now = now or datetime.now()
+        webinars, dates = self._webinars, self._dates
+        return webinars[bisect_right(dates, now):]
+
+    def next_webinar(self, now: datetime = None):
+        """
+        Возвращает ближайший предстоящий вебинар без запроса к БД.
+
+        Returns:
+            Объект Webinar или None
+        """
+        now = now or datetime.now()
+        webinars, dates = self._webinars, self._dates
+        index = bisect_right(dates, now)
+        return webinars[index] if index < len(webinars) else None
+
+    async def next_registered_webinar(self, session: AsyncSession, telegram_id: int):
+        """
+        Возвращает ближайший предстоящий вебинар, на который записан пользователь.
+
+        Если предстоящих вебинаров нет, запрос к БД не выполняется, иначе
+        выполняется одна проверка по webinar_registrations для ID из индекса.
+
+        Returns:
+            Объект Webinar или None
+        """
+        upcoming = self.upcoming()
+        if not upcoming:
+            return None
+
+        result = await session.execute(
+            select(webinar_registrations.c.webinar_id)
+            .join(User, User.id == webinar_registrations.c.user_id)
+            .where(
+                User.telegram_id == telegram_id,
+                webinar_registrations.c.webinar_id.in_(
+                    [webinar.id for webinar in upcoming]
+                )
+            )
+        )
+        registered_ids = set(result.scalars().all())
+
+        for webinar in upcoming:
+            if webinar.id in registered_ids:
+                return webinar
+        return None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Ошибка при обновлении расписания вебинаров: {e}")
+
+    async def start(self):
+        """Загружает расписание и запускает периодическое обновление."""
+        await self.refresh()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает периодическое обновление."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+webinar_schedule = WebinarSchedule(
+    refresh_interval=float(os.getenv('WEBINAR_SCHEDULE_REFRESH', '300')),
+)